@@ -0,0 +1,92 @@
+import os
+import hmac
+import asyncio
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Header, Depends, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional, Dict, Any
+from models.knowledge_models import KnowledgeEntry, KnowledgeEntryCreate, KnowledgeEntryUpdate, KnowledgeEntryList
+from services.knowledge_base_service import get_knowledge_base_service
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    """校验管理接口令牌，未配置ADMIN_TOKEN时管理接口不可用"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=503, detail="未配置ADMIN_TOKEN，管理接口已禁用")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode("utf-8"), admin_token.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="管理令牌无效")
+
+# 创建路由
+router = APIRouter(prefix="/admin", dependencies=[Depends(verify_admin_token)])
+
+@router.get("/kb", response_model=KnowledgeEntryList)
+async def list_knowledge_entries(offset: int = Query(default=0, ge=0), limit: int = Query(default=100, ge=1, le=1000)):
+    """分页获取知识库条目"""
+    entries = get_knowledge_base_service().knowledge_base
+    return KnowledgeEntryList(total=len(entries), entries=entries[offset:offset + limit])
+
+@router.post("/kb", response_model=KnowledgeEntry)
+async def create_knowledge_entry(entry: KnowledgeEntryCreate):
+    """新增知识库条目，新增后立即可被检索"""
+    try:
+        return await asyncio.to_thread(get_knowledge_base_service().add_entry, entry.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/kb/stats")
+async def knowledge_base_stats() -> Dict[str, Any]:
+    """获取知识库索引统计信息"""
+    return get_knowledge_base_service().stats()
+
+@router.post("/kb/compact")
+async def compact_knowledge_base() -> Dict[str, Any]:
+    """在后台合并重建知识库索引"""
+    started = get_knowledge_base_service().compact_in_background()
+    return {"started": started}
+
+@router.get("/kb/{entry_id}", response_model=KnowledgeEntry)
+async def get_knowledge_entry(entry_id: str):
+    """获取知识库条目"""
+    entry = get_knowledge_base_service().get_entry(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="知识库条目不存在")
+    return entry
+
+@router.put("/kb/{entry_id}", response_model=KnowledgeEntry)
+async def update_knowledge_entry(entry_id: str, update: KnowledgeEntryUpdate):
+    """更新知识库条目"""
+    entry = await asyncio.to_thread(get_knowledge_base_service().update_entry, entry_id, update.title, update.content)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="知识库条目不存在")
+    return entry
+
+@router.delete("/kb/{entry_id}")
+async def delete_knowledge_entry(entry_id: str):
+    """删除知识库条目"""
+    success = await asyncio.to_thread(get_knowledge_base_service().delete_entry, entry_id)
+    if not success:
+        raise HTTPException(status_code=404, detail="知识库条目不存在")
+    return {"status": "success", "message": "知识库条目已删除"}
+
+@router.get("/export/history")
+def export_history(
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    gzip: bool = False
+):
+    """
+    流式导出聊天历史为NDJSON（每行一条记录），可按用户、会话和时间范围过滤，可选gzip压缩
+    
+    数据从数据库游标中按批读取并逐块输出，内存占用与导出的记录数量无关
+    """
+    from services.history_export import export_chat_history
+    # 同步迭代器由Starlette在线程池中迭代，数据库读取不阻塞事件循环
+    chunks = export_chat_history(user_id, session_id, start_time, end_time, compress=gzip)
+    filename = f"chat_history_{user_id or 'all'}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
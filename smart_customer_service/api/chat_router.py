@@ -1,46 +1,161 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import time
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
-from models.chat_models import ChatRequest, Message, ChatResponse
-from services.chat_service import process_chat_request, record_message
-from services.sensitive_word_service import filter_sensitive_words
+from typing import Optional
+from models.chat_models import ChatRequest, BatchChatRequest, ChatResponse
+from services.chat_service import process_chat_request, process_chat_batch, BATCH_MAX_SIZE
+from services.llm_scheduler import SchedulerRejected
+from services.metrics import REQUEST_DURATION, REQUESTS_IN_FLIGHT
+from services.tracing import trace_span
+from services.sse_encoder import SSE_HEADERS, encode_chat_stream, json_dumps
 
 # 创建路由
 router = APIRouter()
 
 @router.post("/chat", response_model=ChatResponse)
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest):
     """处理客户端的聊天请求"""
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(1, "chat")
     try:
         # 处理聊天请求
-        response = process_chat_request(request)
+        with trace_span("router.chat"):
+            response = await process_chat_request(request)
         return response
+    except SchedulerRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        REQUESTS_IN_FLIGHT.dec(1, "chat")
+        REQUEST_DURATION.observe(time.perf_counter() - start, "chat")
 
 @router.post("/chat/stream")
-def stream_chat_endpoint(request: ChatRequest):
+async def stream_chat_endpoint(request: ChatRequest):
     """处理客户端的流式聊天请求"""
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(1, "stream")
+    finished = False
+    
+    def finish():
+        nonlocal finished
+        if not finished:
+            finished = True
+            REQUESTS_IN_FLIGHT.dec(1, "stream")
+            REQUEST_DURATION.observe(time.perf_counter() - start, "stream")
+    
     try:
-        # 生成流式响应生成器
-        def generate():
-            for chunk in process_chat_request(request, stream=True):
-                if isinstance(chunk, dict):
-                    yield f"data: {chunk}\n\n"
-                else:
-                    yield f"data: {chunk.model_dump_json()}\n\n"
+        # 获取流式响应（异步生成器），调用大模型失败时返回的是错误响应对象
+        with trace_span("router.chat_stream"):
+            response_stream = await process_chat_request(request, stream=True)
+            
+            # 先取得第一个片段再返回响应，排队被拒绝时仍然可以返回429/503
+            first_chunk = None
+            exhausted = False
+            if not isinstance(response_stream, ChatResponse):
+                try:
+                    first_chunk = await response_stream.__anext__()
+                except StopAsyncIteration:
+                    # 生成器没有产生任何片段时返回空的流，而不是500错误
+                    exhausted = True
         
-        return StreamingResponse(generate(), media_type="text/event-stream")
+        async def chunks():
+            if isinstance(response_stream, ChatResponse):
+                yield response_stream
+                return
+            if exhausted:
+                return
+            yield first_chunk
+            async for chunk in response_stream:
+                yield chunk
+        
+        # 生成流式响应生成器，片段编码为JSON格式的SSE帧
+        async def generate():
+            try:
+                async for frame in encode_chat_stream(chunks()):
+                    yield frame
+            finally:
+                # 流式请求的耗时统计到最后一个片段输出完毕
+                finish()
+        
+        return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
+    except SchedulerRejected as e:
+        finish()
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        finish()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/batch")
+async def batch_chat_endpoint(request: BatchChatRequest):
+    """
+    批量处理聊天请求，按完成顺序以NDJSON格式逐行返回每个请求的结果（index对应请求在列表中的位置），
+    最后一行为{"done": true, "total": ..., "failed": ...}
+    """
+    if len(request.requests) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"每批最多{BATCH_MAX_SIZE}个请求")
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(1, "batch")
+    finished = False
+    
+    def finish():
+        nonlocal finished
+        if not finished:
+            finished = True
+            REQUESTS_IN_FLIGHT.dec(1, "batch")
+            REQUEST_DURATION.observe(time.perf_counter() - start, "batch")
+    
+    try:
+        with trace_span("router.chat_batch", size=len(request.requests)):
+            results = await process_chat_batch(request.requests, request.concurrency)
+        
+        async def generate():
+            try:
+                async for result in results:
+                    yield json_dumps(result) + b"\n"
+            finally:
+                finish()
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    except SchedulerRejected as e:
+        finish()
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
+        finish()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/history/{user_id}")
-def get_chat_history(user_id: str):
-    """获取用户的聊天历史记录"""
+async def get_chat_history(
+    user_id: str,
+    session_id: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    """获取用户的聊天历史记录，按时间倒序游标分页，携带上一页返回的next_cursor获取下一页"""
     try:
-        from services.chat_history_service import get_user_chat_history
-        history = get_user_chat_history(user_id)
-        return {"history": history}
+        from services.chat_history_service import get_user_chat_history_page_async
+        return await get_user_chat_history_page_async(user_id, session_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """获取大模型响应缓存、相同请求合并和上下文窗口管理的统计信息"""
+    from services.response_cache import get_response_cache_stats
+    from services.request_coalescer import get_coalescing_stats
+    from services.context_manager import get_context_stats
+    return {**get_response_cache_stats(), "coalescing": get_coalescing_stats(), "context": get_context_stats()}
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats_endpoint():
+    """获取大模型调度器的并发、排队和拒绝统计"""
+    from services.llm_scheduler import get_scheduler_stats
+    return get_scheduler_stats()
+
+@router.get("/upstreams/stats")
+async def get_upstreams_stats():
+    """获取上游连接池的负载、健康状态和延迟统计"""
+    from services.upstream_pool import get_upstream_stats
+    return get_upstream_stats()
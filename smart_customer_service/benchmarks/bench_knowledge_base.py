@@ -0,0 +1,133 @@
+"""
+知识库检索性能基准测试
+
+在合成的大规模知识库上对比原有实现（TfidfVectorizer单词级分词 + 全量cosine_similarity + argsort）
+与字符n-gram倒排索引的单次检索延迟，并统计源文档出现在top-3中的比例作为召回率参考。
+
+用法（在smart_customer_service目录下执行）:
+    python -m benchmarks.bench_knowledge_base
+    python -m benchmarks.bench_knowledge_base --kb-size 100000 --queries 500
+"""
+import sys
+import time
+import random
+import argparse
+from typing import List, Dict, Any
+
+import numpy as np
+
+from services.retrieval_engine import InvertedIndex
+from benchmarks.corpus import COMMON_CHARS, zipf_weights, random_sentence
+
+
+def make_knowledge_base(size: int, rng: random.Random) -> List[Dict[str, str]]:
+    """生成指定规模的知识库条目"""
+    weights = zipf_weights(len(COMMON_CHARS))
+    return [
+        {
+            "id": f"kb{i:06d}",
+            "title": random_sentence(rng, rng.randint(4, 8), weights),
+            "content": random_sentence(rng, rng.randint(40, 120), weights)
+        }
+        for i in range(size)
+    ]
+
+
+def make_queries(knowledge_base: List[Dict[str, str]], count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """从随机条目中截取片段作为查询，记录其来源条目"""
+    queries = []
+    for _ in range(count):
+        doc_index = rng.randrange(len(knowledge_base))
+        content = knowledge_base[doc_index]["content"]
+        length = rng.randint(6, 16)
+        start = rng.randrange(max(len(content) - length, 1))
+        queries.append({"text": "请问" + content[start:start + length] + "？", "doc_index": doc_index})
+    return queries
+
+
+def percentile_summary(latencies: List[float]) -> Dict[str, float]:
+    """计算延迟分位数（毫秒）"""
+    values = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def bench_legacy(documents: List[str], queries: List[Dict[str, Any]], top_k: int) -> Dict[str, Any]:
+    """原有实现：单词级TF-IDF，对全部文档计算余弦相似度并完整排序"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    start = time.perf_counter()
+    vectorizer = TfidfVectorizer(token_pattern=r'(?u)\b\w+\b', max_df=0.8, min_df=1)
+    document_vectors = vectorizer.fit_transform(documents)
+    build_time = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        similarities = cosine_similarity(vectorizer.transform([query["text"]]), document_vectors).flatten()
+        top_indices = similarities.argsort()[-top_k:][::-1]
+        top_indices = [idx for idx in top_indices if similarities[idx] > 0.1]
+        latencies.append(time.perf_counter() - start)
+        hits += query["doc_index"] in top_indices
+    return {"build_s": build_time, "recall_at_k": hits / len(queries), **percentile_summary(latencies)}
+
+
+def bench_inverted_index(documents: List[str], queries: List[Dict[str, Any]], top_k: int, analyzer_name: str) -> Dict[str, Any]:
+    """倒排索引实现：只对候选文档打分，argpartition选取top-k"""
+    start = time.perf_counter()
+    index = InvertedIndex.build(documents, analyzer_name=analyzer_name)
+    build_time = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        results = index.search(query["text"], top_k=top_k, min_score=0.1)
+        latencies.append(time.perf_counter() - start)
+        hits += any(doc_index == query["doc_index"] for doc_index, _ in results)
+    return {"build_s": build_time, "recall_at_k": hits / len(queries), **percentile_summary(latencies)}
+
+
+def run(kb_size: int = 100000, query_count: int = 300, top_k: int = 3, analyzer_name: str = "char_ngram", seed: int = 42, legacy: bool = True) -> Dict[str, Any]:
+    """
+    运行基准测试
+
+    返回:
+        Dict[str, Any]: 各实现的构建耗时、检索延迟和召回率
+    """
+    rng = random.Random(seed)
+    knowledge_base = make_knowledge_base(kb_size, rng)
+    documents = [f"{item['title']}\n{item['content']}" for item in knowledge_base]
+    queries = make_queries(knowledge_base, query_count, rng)
+
+    results = {"kb_size": kb_size, "queries": query_count, "top_k": top_k}
+    results["inverted_index"] = bench_inverted_index(documents, queries, top_k, analyzer_name)
+    if legacy:
+        results["legacy"] = bench_legacy(documents, queries, top_k)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="知识库检索性能基准测试")
+    parser.add_argument("--kb-size", type=int, default=100000, help="知识库条目数量")
+    parser.add_argument("--queries", type=int, default=300, help="查询数量")
+    parser.add_argument("--analyzer", default="char_ngram", help="分词器名称")
+    parser.add_argument("--skip-legacy", action="store_true", help="不测试原有实现")
+    args = parser.parse_args(argv)
+
+    results = run(kb_size=args.kb_size, query_count=args.queries, analyzer_name=args.analyzer, legacy=not args.skip_legacy)
+    print(f"知识库条目: {results['kb_size']}  查询数量: {results['queries']}  top_k: {results['top_k']}")
+    print(f"{'实现':<16} {'构建(秒)':>10} {'平均(ms)':>10} {'P50(ms)':>10} {'P99(ms)':>10} {'召回率':>8}")
+    for name in ("legacy", "inverted_index"):
+        if name in results:
+            item = results[name]
+            print(f"{name:<16} {item['build_s']:>10.2f} {item['mean_ms']:>10.3f} {item['p50_ms']:>10.3f} {item['p99_ms']:>10.3f} {item['recall_at_k']:>8.1%}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+敏感词过滤性能基准测试
+
+对比原有嵌套字典DFA实现与Aho-Corasick自动机在1KB/10KB/100KB文本上的吞吐量。
+
+用法（在smart_customer_service目录下执行）:
+    python -m benchmarks.bench_sensitive_words
+    python -m benchmarks.bench_sensitive_words --lexicon-size 50000 --repeat 5
+"""
+import sys
+import time
+import random
+import argparse
+from typing import List, Tuple, Dict, Any
+
+from services.sensitive_word_service import SensitiveWordFilter
+from benchmarks.corpus import COMMON_CHARS
+
+
+def legacy_build_dfa(words: List[str]) -> Dict[str, Any]:
+    """原有实现：构建嵌套字典DFA"""
+    dfa = {}
+    for word in words:
+        current = dfa
+        for char in word:
+            if char not in current:
+                current[char] = {}
+            current = current[char]
+        current["is_end"] = True
+    return dfa
+
+
+def legacy_filter(dfa: Dict[str, Any], text: str) -> Tuple[str, List[str]]:
+    """原有实现：在每个字符位置重新遍历嵌套字典"""
+    if not text or not dfa:
+        return text, []
+    result = list(text)
+    sensitive_words_found = []
+    for i in range(len(result)):
+        current = dfa
+        word = ""
+        for j in range(i, len(result)):
+            char = result[j]
+            if char in current:
+                current = current[char]
+                word += char
+                if "is_end" in current:
+                    sensitive_words_found.append(word)
+                    for k in range(i, j + 1):
+                        result[k] = "*"
+                    break
+            else:
+                break
+    return "".join(result), list(set(sensitive_words_found))
+
+
+def make_lexicon(size: int, rng: random.Random) -> List[str]:
+    """生成指定规模的敏感词库，包含默认敏感词和随机生成的2~6字词"""
+    words = set(SensitiveWordFilter()._load_sensitive_words())
+    while len(words) < size:
+        words.add("".join(rng.choice(COMMON_CHARS) for _ in range(rng.randint(2, 6))))
+    return list(words)
+
+
+def make_text(size: int, lexicon: List[str], rng: random.Random, density: float = 0.01) -> str:
+    """生成指定长度的文本，按给定密度混入敏感词"""
+    pieces = []
+    length = 0
+    while length < size:
+        if rng.random() < density:
+            piece = rng.choice(lexicon)
+        else:
+            piece = rng.choice(COMMON_CHARS)
+        pieces.append(piece)
+        length += len(piece)
+    return "".join(pieces)[:size]
+
+
+def best_of(func, repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(lexicon_size: int = 10000, text_sizes: Tuple[int, ...] = (1024, 10 * 1024, 100 * 1024), repeat: int = 3, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    运行基准测试
+
+    返回:
+        List[Dict[str, Any]]: 每种文本长度的测试结果
+    """
+    rng = random.Random(seed)
+    lexicon = make_lexicon(lexicon_size, rng)
+
+    start = time.perf_counter()
+    dfa = legacy_build_dfa(lexicon)
+    legacy_build = time.perf_counter() - start
+
+    word_filter = SensitiveWordFilter()
+    word_filter.sensitive_words = lexicon
+    start = time.perf_counter()
+    word_filter.automaton = word_filter._build_automaton()
+    automaton_build = time.perf_counter() - start
+
+    results = []
+    for size in text_sizes:
+        text = make_text(size, lexicon, rng)
+        legacy_time = best_of(lambda: legacy_filter(dfa, text), repeat)
+        automaton_time = best_of(lambda: word_filter.filter_sensitive_words(text), repeat)
+        results.append({
+            "lexicon_size": len(lexicon),
+            "text_size": size,
+            "legacy_build_s": legacy_build,
+            "automaton_build_s": automaton_build,
+            "legacy_s": legacy_time,
+            "automaton_s": automaton_time,
+            "legacy_chars_per_s": size / legacy_time,
+            "automaton_chars_per_s": size / automaton_time,
+            "speedup": legacy_time / automaton_time,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="敏感词过滤性能基准测试")
+    parser.add_argument("--lexicon-size", type=int, default=10000, help="敏感词库规模")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测试重复次数")
+    args = parser.parse_args(argv)
+
+    results = run(lexicon_size=args.lexicon_size, repeat=args.repeat)
+    first = results[0]
+    print(f"敏感词数量: {first['lexicon_size']}  构建耗时: DFA {first['legacy_build_s'] * 1000:.1f} ms / AC {first['automaton_build_s'] * 1000:.1f} ms")
+    print(f"{'文本长度':>10} {'DFA (字符/秒)':>16} {'AC (字符/秒)':>16} {'加速比':>8}")
+    for item in results:
+        print(f"{item['text_size']:>10} {item['legacy_chars_per_s']:>16,.0f} {item['automaton_chars_per_s']:>16,.0f} {item['speedup']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
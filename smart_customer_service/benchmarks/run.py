@@ -0,0 +1,485 @@
+"""
+可复现的性能基准测试套件
+
+覆盖请求路径上的主要热点，输出机器可读的JSON结果，并可与保存的基线对比以发现性能回退:
+    sensitive_words  敏感词过滤（敏感词库规模 × 文本长度）
+    knowledge_base   知识库检索（知识库规模）
+    history          聊天历史入队、批量写入和查询（预先填充的SQLite数据库）
+    pipeline         process_chat_request端到端处理（大模型替换为固定延迟的桩实现）
+
+所有随机数据由固定种子生成；数据库、知识库和响应缓存使用临时目录，不会修改服务数据。
+每个测试项的延迟以毫秒记录，与基线对比时使用p50_ms（越小越好）。
+
+用法（在smart_customer_service目录下执行）:
+    python -m benchmarks.run
+    python -m benchmarks.run --quick --suite sensitive_words,knowledge_base
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --baseline benchmarks/baseline.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Optional
+
+# 服务模块在导入时读取配置，必须在导入之前把数据和缓存指向临时目录
+BENCH_DIR = tempfile.mkdtemp(prefix="scs-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}"
+os.environ["KB_PERSIST"] = "false"
+os.environ["KB_INDEX_DIR"] = os.path.join(BENCH_DIR, "kb_index")
+os.environ["RESPONSE_CACHE_DB"] = ""
+os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+
+import numpy as np
+
+from benchmarks.corpus import COMMON_CHARS, zipf_weights, random_sentence
+from benchmarks.bench_sensitive_words import make_lexicon, make_text
+from benchmarks.bench_knowledge_base import make_knowledge_base, make_queries
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_OUTPUT_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+# 结果文件格式版本，格式不兼容时不与基线对比
+RESULT_FORMAT = 1
+
+# 完整模式和快速模式（--quick）的测试规模
+SIZES = {
+    "full": {
+        "lexicon_sizes": (1000, 10000, 50000),
+        "text_sizes": (1024, 10 * 1024, 100 * 1024),
+        "kb_sizes": (1000, 10000, 100000),
+        "kb_queries": 300,
+        "history_users": 2000,
+        "history_messages_per_user": 100,
+        "history_queries": 300,
+        "pipeline_requests": 300,
+        "pipeline_concurrency": 32,
+    },
+    "quick": {
+        "lexicon_sizes": (1000, 10000),
+        "text_sizes": (1024, 10 * 1024),
+        "kb_sizes": (1000, 10000),
+        "kb_queries": 100,
+        "history_users": 200,
+        "history_messages_per_user": 50,
+        "history_queries": 100,
+        "pipeline_requests": 100,
+        "pipeline_concurrency": 16,
+    },
+}
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Any]:
+    """计算延迟分位数（毫秒）和每秒操作数"""
+    values = np.array(latencies) * 1000
+    return {
+        "n": len(latencies),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "min_ms": float(values.min()),
+        "ops_per_s": float(len(values) / (values.sum() / 1000)) if values.sum() > 0 else None,
+    }
+
+
+def measure(func: Callable[[], Any], iterations: int, warmup: int = 3) -> Dict[str, Any]:
+    """预热后逐次计时执行func"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def bench_sensitive_words(sizes: Dict[str, Any], seed: int) -> Dict[str, Dict[str, Any]]:
+    """敏感词过滤：对每种敏感词库规模和文本长度测量filter_sensitive_words"""
+    from services.sensitive_word_service import SensitiveWordFilter
+
+    results = {}
+    for lexicon_size in sizes["lexicon_sizes"]:
+        rng = random.Random(seed)
+        lexicon = make_lexicon(lexicon_size, rng)
+        word_filter = SensitiveWordFilter()
+        word_filter.sensitive_words = lexicon
+        start = time.perf_counter()
+        word_filter.automaton = word_filter._build_automaton()
+        build_ms = (time.perf_counter() - start) * 1000
+        for text_size in sizes["text_sizes"]:
+            text = make_text(text_size, lexicon, rng)
+            # 较长的文本减少迭代次数，使每项测试耗时大致相同
+            iterations = max(20, min(500, 2000000 // text_size))
+            item = measure(lambda: word_filter.filter_sensitive_words(text), iterations)
+            item["chars_per_s"] = text_size / (item["p50_ms"] / 1000)
+            item["build_ms"] = build_ms
+            results[f"sensitive_words.filter[lexicon={lexicon_size},text={text_size}]"] = item
+    return results
+
+
+def bench_knowledge_base(sizes: Dict[str, Any], seed: int) -> Dict[str, Dict[str, Any]]:
+    """知识库检索：对每种知识库规模测量search_knowledge_base，同时记录索引构建耗时"""
+    from services.knowledge_base_service import KnowledgeBaseService
+
+    results = {}
+    service = KnowledgeBaseService()
+    for kb_size in sizes["kb_sizes"]:
+        rng = random.Random(seed)
+        entries = make_knowledge_base(kb_size, rng)
+        queries = [query["text"] for query in make_queries(entries, sizes["kb_queries"], rng)]
+        start = time.perf_counter()
+        service._prepare_knowledge_base(entries)
+        build_ms = (time.perf_counter() - start) * 1000
+        query_iter = iter(queries * 2)
+        item = measure(lambda: service.search_knowledge_base(next(query_iter)), len(queries), warmup=min(10, len(queries)))
+        item["build_ms"] = build_ms
+        results[f"knowledge_base.search[kb={kb_size}]"] = item
+    return results
+
+
+def seed_history(users: int, messages_per_user: int, seed: int) -> List[str]:
+    """
+    向临时数据库填充聊天历史，每个用户5个会话
+
+    返回:
+        List[str]: 用户ID列表
+    """
+    from sqlalchemy import insert
+    from database.database import engine, ChatHistory
+    from database.migrations import run_migrations
+    from database.session_summary import backfill_session_summaries
+
+    run_migrations(engine)
+    rng = random.Random(seed)
+    weights = zipf_weights(len(COMMON_CHARS))
+    start_time = datetime(2024, 1, 1)
+    user_ids = [f"bench-user-{i:05d}" for i in range(users)]
+    rows = []
+    with engine.begin() as connection:
+        for user_index, user_id in enumerate(user_ids):
+            for message_index in range(messages_per_user):
+                content = random_sentence(rng, rng.randint(10, 60), weights)
+                rows.append({
+                    "user_id": user_id,
+                    "session_id": f"{user_id}-s{message_index % 5}",
+                    "role": "user" if message_index % 2 == 0 else "assistant",
+                    "content": content,
+                    "filtered_content": content,
+                    "timestamp": start_time + timedelta(minutes=user_index * messages_per_user + message_index),
+                    "message_metadata": {"usage": {"prompt_tokens": 20, "completion_tokens": 40, "total_tokens": 60}} if message_index % 2 else {},
+                })
+                if len(rows) >= 5000:
+                    connection.execute(insert(ChatHistory), rows)
+                    rows = []
+        if rows:
+            connection.execute(insert(ChatHistory), rows)
+        backfill_session_summaries(connection)
+    return user_ids
+
+
+def bench_history(sizes: Dict[str, Any], seed: int) -> Dict[str, Dict[str, Any]]:
+    """聊天历史：消息入队延迟、后台批量写入吞吐量，以及偏移分页、游标分页和会话列表查询"""
+    from services.chat_service import record_message
+    from services.history_writer import history_writer, flush_history
+    from services.chat_history_service import get_user_chat_history, get_user_chat_history_page, get_user_sessions
+
+    total_rows = sizes["history_users"] * sizes["history_messages_per_user"]
+    start = time.perf_counter()
+    user_ids = seed_history(sizes["history_users"], sizes["history_messages_per_user"], seed)
+    seed_ms = (time.perf_counter() - start) * 1000
+
+    rng = random.Random(seed)
+    results = {}
+
+    # 入队延迟（请求路径上的开销），随后等待后台线程全部写入
+    counter = iter(range(10 ** 9))
+    written_before = history_writer.written_count
+    start = time.perf_counter()
+    item = measure(lambda: record_message(rng.choice(user_ids), "bench-record", "user", f"消息{next(counter)}"), 5000, warmup=0)
+    flushed = flush_history(timeout=60)
+    elapsed = time.perf_counter() - start
+    item["seeded_rows"] = total_rows
+    item["seed_ms"] = seed_ms
+    results["history.record_message"] = item
+    written = history_writer.written_count - written_before
+    # 写入耗时主要取决于HISTORY_FLUSH_INTERVAL，只记录吞吐量，不与基线对比
+    results["history.write_throughput"] = {
+        "n": written,
+        "elapsed_ms": elapsed * 1000,
+        "rows_per_s": written / elapsed if elapsed > 0 else None,
+        "flushed": flushed,
+    }
+
+    iterations = sizes["history_queries"]
+    results["history.get_user_chat_history[limit=100,offset=0]"] = measure(
+        lambda: get_user_chat_history(rng.choice(user_ids), limit=100), iterations)
+    results["history.get_user_chat_history[session,limit=20]"] = measure(
+        lambda: get_user_chat_history(rng.choice(user_ids), session_id=f"{rng.choice(user_ids)}-s{rng.randrange(5)}", limit=20), iterations)
+
+    def read_two_pages():
+        # 游标分页翻到第二页，测量深度翻页的开销
+        user_id = rng.choice(user_ids)
+        page = get_user_chat_history_page(user_id, limit=20)
+        if page.get("next_cursor"):
+            get_user_chat_history_page(user_id, limit=20, cursor=page["next_cursor"])
+
+    results["history.get_user_chat_history_page[limit=20,pages=2]"] = measure(read_two_pages, iterations)
+    results["history.get_user_sessions"] = measure(lambda: get_user_sessions(rng.choice(user_ids)), iterations)
+    return results
+
+
+def stub_upstream(latency: float = 0.0, text: str = "您好，这是基准测试使用的固定回复，请参考知识库中的相关说明进行操作。"):
+    """把上游连接池替换为固定延迟的桩实现，只测量中间件自身的处理开销"""
+    from types import SimpleNamespace
+    from services.upstream_pool import upstream_pool
+
+    async def completion(model: str, **params):
+        if latency:
+            await asyncio.sleep(latency)
+        usage = SimpleNamespace(prompt_tokens=50, completion_tokens=30, total_tokens=80)
+        usage.to_dict = lambda: {"prompt_tokens": 50, "completion_tokens": 30, "total_tokens": 80}
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+    async def stream(model: str, **params):
+        if latency:
+            await asyncio.sleep(latency)
+        for i in range(0, len(text), 4):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 4]))])
+
+    upstream_pool.completion = completion
+    upstream_pool.stream = stream
+
+
+def bench_pipeline(sizes: Dict[str, Any], seed: int) -> Dict[str, Dict[str, Any]]:
+    """端到端：process_chat_request的串行延迟、并发吞吐量和流式响应（不含HTTP层）"""
+    from models.chat_models import ChatRequest, Message
+    from services.chat_service import process_chat_request
+    from services.response_cache import response_cache
+    from services.request_coalescer import request_coalescer
+    from services.history_writer import flush_history
+
+    stub_upstream()
+    # 每个请求都走完整的处理路径，不命中响应缓存，也不合并请求
+    response_cache.enabled = False
+    request_coalescer.enabled = False
+
+    rng = random.Random(seed)
+    weights = zipf_weights(len(COMMON_CHARS))
+    questions = ["请问" + random_sentence(rng, rng.randint(8, 30), weights) + "？" for _ in range(200)]
+    counter = iter(range(10 ** 9))
+
+    def make_request(session: bool = False) -> ChatRequest:
+        index = next(counter)
+        return ChatRequest(
+            user_id=f"bench-pipeline-{index % 50}",
+            session_id=f"bench-session-{index % 50}" if session else None,
+            messages=[Message(role="user", content=questions[index % len(questions)])],
+        )
+
+    async def timed(coro_factory: Callable[[], Any]) -> float:
+        start = time.perf_counter()
+        await coro_factory()
+        return time.perf_counter() - start
+
+    async def consume_stream():
+        generator = await process_chat_request(make_request(), stream=True)
+        async for _ in generator:
+            pass
+
+    async def run_all() -> Dict[str, Dict[str, Any]]:
+        requests = sizes["pipeline_requests"]
+        for _ in range(5):
+            await process_chat_request(make_request())
+
+        results = {}
+        latencies = [await timed(lambda: process_chat_request(make_request())) for _ in range(requests)]
+        results["pipeline.chat[sequential]"] = latency_summary(latencies)
+
+        latencies = [await timed(lambda: process_chat_request(make_request(session=True))) for _ in range(requests)]
+        results["pipeline.chat[session,sequential]"] = latency_summary(latencies)
+
+        latencies = [await timed(consume_stream) for _ in range(requests)]
+        results["pipeline.chat_stream[sequential]"] = latency_summary(latencies)
+
+        # 并发请求：延迟包含事件循环上的排队时间，吞吐量按总耗时计算
+        concurrency = sizes["pipeline_concurrency"]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded() -> float:
+            async with semaphore:
+                return await timed(lambda: process_chat_request(make_request()))
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(bounded() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        item = latency_summary(list(latencies))
+        item["ops_per_s"] = requests / elapsed
+        item["concurrency"] = concurrency
+        results[f"pipeline.chat[concurrency={concurrency}]"] = item
+        return results
+
+    results = asyncio.run(run_all())
+    flush_history(timeout=60)
+    return results
+
+
+SUITES = {
+    "sensitive_words": bench_sensitive_words,
+    "knowledge_base": bench_knowledge_base,
+    "history": bench_history,
+    "pipeline": bench_pipeline,
+}
+
+
+def git_commit() -> Optional[str]:
+    """返回当前git提交，不在git仓库中时返回None"""
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=BENCHMARK_DIR, timeout=10)
+        return output.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment_info() -> Dict[str, Any]:
+    """记录运行环境，对比不同机器上的结果时参考"""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "git_commit": git_commit(),
+    }
+
+
+def run(suites: List[str], quick: bool = False, seed: int = 42) -> Dict[str, Any]:
+    """
+    运行选定的测试套件
+
+    返回:
+        Dict[str, Any]: 包含format、mode、seed、timestamp、environment和results（测试项名称 -> 指标）
+    """
+    mode = "quick" if quick else "full"
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in suites:
+        start = time.perf_counter()
+        print(f"[{name}] 运行中...", file=sys.stderr)
+        results.update(SUITES[name](SIZES[mode], seed))
+        print(f"[{name}] 完成，耗时{time.perf_counter() - start:.1f}秒", file=sys.stderr)
+    return {
+        "format": RESULT_FORMAT,
+        "mode": mode,
+        "seed": seed,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment_info(),
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    按测试项名称与基线对比p50_ms
+
+    返回:
+        List[Dict[str, Any]]: 双方都有的测试项，包含基线值、当前值、变化比例和是否回退
+    """
+    if baseline.get("format") != current.get("format"):
+        print("基线文件格式不一致，跳过对比", file=sys.stderr)
+        return []
+    if baseline.get("mode") != current.get("mode"):
+        # 快速模式和完整模式的请求数量、会话轮数不同，同名测试项也不可比
+        print(f"基线为{baseline.get('mode')}模式，本次为{current.get('mode')}模式，跳过对比", file=sys.stderr)
+        return []
+    rows = []
+    for name, item in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("p50_ms") or item.get("p50_ms") is None:
+            continue
+        change = item["p50_ms"] / base["p50_ms"] - 1
+        rows.append({
+            "name": name,
+            "baseline_ms": base["p50_ms"],
+            "current_ms": item["p50_ms"],
+            "change": change,
+            "regression": change > threshold,
+        })
+    return rows
+
+
+def print_results(report: Dict[str, Any], comparison: List[Dict[str, Any]]):
+    """打印结果表格"""
+    changes = {row["name"]: row for row in comparison}
+    print(f"{'测试项':<58} {'P50(ms)':>11} {'P99(ms)':>11} {'次/秒':>12} {'对比基线':>10}")
+    for name, item in report["results"].items():
+        row = changes.get(name)
+        change = f"{row['change']:+.1%}{' !' if row['regression'] else ''}" if row else "-"
+        ops = f"{item['ops_per_s']:,.0f}" if item.get("ops_per_s") else "-"
+        ops = f"{item['rows_per_s']:,.0f}" if item.get("rows_per_s") else ops
+        p50 = f"{item['p50_ms']:.3f}" if "p50_ms" in item else "-"
+        p99 = f"{item['p99_ms']:.3f}" if "p99_ms" in item else "-"
+        print(f"{name:<58} {p50:>11} {p99:>11} {ops:>12} {change:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="性能基准测试套件")
+    parser.add_argument("--suite", default=",".join(SUITES), help=f"逗号分隔的测试套件，可选: {', '.join(SUITES)}")
+    parser.add_argument("--quick", action="store_true", help="使用较小的测试规模")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子")
+    parser.add_argument("--output", default=None, help="结果JSON文件路径，默认写入benchmarks/results/目录")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线JSON文件路径，文件不存在时不对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50_ms超过基线该比例视为回退")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线")
+    args = parser.parse_args(argv)
+
+    suites = [name.strip() for name in args.suite.split(",") if name.strip()]
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown:
+        parser.error(f"未知的测试套件: {', '.join(unknown)}")
+
+    try:
+        report = run(suites, quick=args.quick, seed=args.seed)
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+    comparison = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            comparison = compare(report, json.load(f), args.threshold)
+        report["baseline"] = {"path": args.baseline, "threshold": args.threshold, "comparison": comparison}
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['mode']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_results(report, comparison)
+    print(f"结果已写入: {output}")
+    if args.save_baseline:
+        print(f"基线已保存: {args.baseline}")
+
+    regressions = [row for row in comparison if row["regression"]]
+    if regressions:
+        print(f"{len(regressions)}项测试相比基线变慢超过{args.threshold:.0%}:")
+        for row in regressions:
+            print(f"  {row['name']}: {row['baseline_ms']:.3f} ms -> {row['current_ms']:.3f} ms ({row['change']:+.1%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,139 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from typing import Dict, Any
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, DateTime, JSON, Index, PrimaryKeyConstraint
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
 
 # 加载环境变量
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat_history.db")
 
+# 连接池配置（SQLite内存数据库之外的所有数据库）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite连接参数，每个新连接建立时设置
+SQLITE_PRAGMAS = {
+    # WAL模式下读写互不阻塞，聊天历史写入器提交时不会阻塞历史查询和导出
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    # WAL模式下NORMAL只在检查点时fsync，进程崩溃不会丢数据，断电可能丢失最近提交的事务
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+    # 负数表示以KB为单位，默认每个连接64MB页缓存
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+}
+
+# 异步数据库URL，默认根据DATABASE_URL替换为对应的异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql"
+}
+
+def is_sqlite(url: str) -> bool:
+    """判断是否为SQLite数据库"""
+    return make_url(url).get_backend_name() == "sqlite"
+
+def is_sqlite_memory(url: str) -> bool:
+    """判断是否为SQLite内存数据库"""
+    return is_sqlite(url) and make_url(url).database in (None, "", ":memory:")
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """
+    根据数据库类型返回create_engine的参数
+    
+    参数:
+        url: 数据库URL
+    
+    返回:
+        Dict[str, Any]: 引擎参数
+    """
+    options: Dict[str, Any] = {}
+    if is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+        if is_sqlite_memory(url):
+            # 内存数据库使用单连接池，不支持连接池大小参数
+            return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING
+    )
+    return options
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """新建SQLite连接时设置连接参数"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def create_database_engine(url: str = DATABASE_URL) -> Engine:
+    """
+    按数据库类型创建并配置数据库引擎
+    
+    参数:
+        url: 数据库URL
+    
+    返回:
+        Engine: 数据库引擎
+    """
+    database_engine = create_engine(url, **engine_options(url))
+    if is_sqlite(url):
+        event.listen(database_engine, "connect", set_sqlite_pragmas)
+    return database_engine
+
 # 创建数据库引擎
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+engine = create_database_engine()
 
 # 创建会话本地类
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎和异步会话类，首次使用时创建（需要安装对应的异步驱动，如asyncpg或aiosqlite）
+DB_ASYNC_ENABLED = os.getenv("DB_ASYNC_ENABLED", "false").lower() in ("1", "true", "yes")
+_async_engine = None
+_async_session_factory = None
+
+def get_async_database_url(url: str = DATABASE_URL) -> str:
+    """返回异步数据库URL，优先使用环境变量ASYNC_DATABASE_URL"""
+    async_url = os.getenv("ASYNC_DATABASE_URL")
+    if async_url:
+        return async_url
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"不支持的异步数据库类型: {parsed.get_backend_name()}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+def get_async_engine():
+    """获取异步数据库引擎，首次调用时创建"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        async_url = get_async_database_url()
+        options = engine_options(async_url)
+        options.pop("connect_args", None)
+        _async_engine = create_async_engine(async_url, **options)
+        if is_sqlite(async_url):
+            event.listen(_async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return _async_engine
+
+def get_async_session_factory():
+    """获取异步会话类，首次调用时创建"""
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_session_factory = async_sessionmaker(get_async_engine(), expire_on_commit=False)
+    return _async_session_factory
+
 # 创建基类
 Base = declarative_base()
 
@@ -31,6 +149,34 @@ class ChatHistory(Base):
     filtered_content = Column(Text)
     timestamp = Column(DateTime, default=datetime.now)
     message_metadata = Column(JSON, nullable=True)
+    
+    __table_args__ = (
+        # 按用户分页查询历史记录（按时间戳和ID倒序的游标分页）
+        Index("ix_chat_history_user_timestamp_id", "user_id", "timestamp", "id"),
+        # 按用户和会话查询历史记录
+        Index("ix_chat_history_user_session_timestamp", "user_id", "session_id", "timestamp"),
+        # 不指定用户按时间范围导出历史记录
+        Index("ix_chat_history_timestamp_id", "timestamp", "id"),
+    )
+
+class ChatSession(Base):
+    """会话汇总数据库模型，随聊天历史的写入增量更新"""
+    __tablename__ = "chat_sessions"
+    
+    user_id = Column(String(50), nullable=False)
+    session_id = Column(String(50), nullable=False)
+    first_message_time = Column(DateTime)
+    last_message_time = Column(DateTime)
+    message_count = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "session_id"),
+        # 按最近消息时间获取用户的会话列表
+        Index("ix_chat_sessions_user_last_message_time", "user_id", "last_message_time"),
+    )
 
 # 初始化数据库
 def init_db():
@@ -1,42 +1,23 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+import sys
 
-# 获取数据库URL
-database_url = os.getenv("DATABASE_URL", "sqlite:///./chat_history.db")
+if not __package__:
+    # 以脚本方式运行（python database/init_db.py）时，用项目目录替换脚本所在目录，
+    # 否则database会被解析为同目录下的database.py而不是database包
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# 创建数据库引擎
-engine = create_engine(
-    database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in database_url else {}
-)
-
-# 创建基类
-Base = declarative_base()
-
-class ChatHistory(Base):
-    """聊天历史数据库模型"""
-    __tablename__ = "chat_history"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String(50), index=True)
-    session_id = Column(String(50), index=True)
-    role = Column(String(20))
-    content = Column(Text)
-    filtered_content = Column(Text)
-    timestamp = Column(DateTime, default=datetime.now)
-    message_metadata = Column(JSON, nullable=True)
+from database.database import engine
+from database.migrations import run_migrations
 
 # 初始化数据库
 def init_database():
-    """初始化数据库，创建所有表"""
+    """初始化数据库，创建所有表并执行尚未执行的结构迁移"""
     try:
-        # 创建数据库表
-        Base.metadata.create_all(bind=engine)
+        # 创建数据库表（模型和引擎统一定义在database.database中）
+        run_migrations(engine)
         print("数据库初始化成功！")
     except Exception as e:
         print(f"数据库初始化失败: {str(e)}")
 
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    init_database()
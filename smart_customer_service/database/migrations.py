@@ -0,0 +1,88 @@
+"""
+数据库结构迁移
+
+已有数据库（如旧版本创建的chat_history.db）按版本号依次执行尚未执行的迁移，
+已执行的版本记录在schema_migrations表中，重复执行是安全的。
+
+用法（在smart_customer_service目录下执行）:
+    python -m database.migrations
+"""
+import sys
+from datetime import datetime
+from typing import List, Tuple, Callable
+from sqlalchemy import Table, MetaData, Column, Integer, String, DateTime, select
+from sqlalchemy.engine import Connection, Engine
+from database.database import engine, Base, ChatHistory
+
+# 迁移记录表，使用独立的元数据，不随业务表一起创建
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime, default=datetime.now)
+)
+
+def create_chat_history_indexes(connection: Connection):
+    """为chat_history表创建模型中定义的、数据库中尚不存在的索引"""
+    for index in ChatHistory.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+def backfill_chat_sessions(connection: Connection):
+    """根据已有的聊天历史回填会话汇总表chat_sessions（表本身由create_all创建）"""
+    from database.session_summary import backfill_session_summaries
+    backfill_session_summaries(connection)
+
+# 迁移列表：(版本号, 说明, 迁移函数)，版本号必须递增
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "chat_history复合索引", create_chat_history_indexes),
+    (2, "chat_sessions会话汇总表", backfill_chat_sessions),
+    (3, "chat_history时间索引(timestamp, id)", create_chat_history_indexes),
+]
+
+def get_applied_versions(connection: Connection) -> List[int]:
+    """返回已执行的迁移版本号"""
+    return [row.version for row in connection.execute(select(schema_migrations.c.version))]
+
+def run_migrations(bind: Engine = engine) -> List[int]:
+    """
+    创建缺失的表并执行尚未执行的迁移
+
+    参数:
+        bind: 数据库引擎
+
+    返回:
+        List[int]: 本次执行的迁移版本号
+    """
+    # 新建数据库时直接创建包含全部索引的表，迁移只需补充记录
+    Base.metadata.create_all(bind=bind)
+    migration_metadata.create_all(bind=bind)
+
+    with bind.connect() as connection:
+        applied = set(get_applied_versions(connection))
+
+    executed = []
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        # 每个迁移在独立的事务中执行，失败时不会记录版本号
+        with bind.begin() as connection:
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(version=version, description=description, applied_at=datetime.now()))
+        print(f"已执行迁移 {version}: {description}")
+        executed.append(version)
+    return executed
+
+def main():
+    try:
+        executed = run_migrations()
+        if not executed:
+            print("数据库结构已是最新")
+    except Exception as e:
+        print(f"数据库迁移失败: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+会话汇总表（chat_sessions）维护
+
+聊天历史写入器在插入历史记录的同一个事务中增量更新会话汇总（首末消息时间、消息数量、token用量），
+获取会话列表时只需按索引读取汇总表，不再对用户的全部历史记录分组聚合。
+
+回填命令（在smart_customer_service目录下执行，根据chat_history重建会话汇总，建议在服务停止时执行）:
+    python -m database.session_summary
+    python -m database.session_summary --user-id user123
+"""
+import sys
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import select, delete, insert, update, case, or_, and_
+from database.database import engine, ChatHistory, ChatSession
+
+# 汇总表中累加的计数字段
+SUMMARY_COUNTERS = ("message_count", "prompt_tokens", "completion_tokens", "total_tokens")
+
+# token用量字段（来自大模型响应的usage）
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+def accumulate_summary(summaries: Dict[Tuple[str, str], Dict[str, Any]], user_id: str, session_id: str,
+                       timestamp: Optional[datetime], metadata: Optional[Dict[str, Any]]):
+    """
+    将一条历史记录累加到会话汇总中
+
+    参数:
+        summaries: (用户ID, 会话ID) -> 会话汇总
+        user_id: 用户ID
+        session_id: 会话ID
+        timestamp: 消息时间戳
+        metadata: 消息元数据，其中的usage字段计入token用量
+    """
+    summary = summaries.get((user_id, session_id))
+    if summary is None:
+        summary = summaries[(user_id, session_id)] = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "first_message_time": timestamp,
+            "last_message_time": timestamp,
+            **{name: 0 for name in SUMMARY_COUNTERS}
+        }
+    elif timestamp is not None:
+        if summary["first_message_time"] is None or timestamp < summary["first_message_time"]:
+            summary["first_message_time"] = timestamp
+        if summary["last_message_time"] is None or timestamp > summary["last_message_time"]:
+            summary["last_message_time"] = timestamp
+    summary["message_count"] += 1
+    usage = (metadata or {}).get("usage") or {}
+    for name in USAGE_FIELDS:
+        try:
+            summary[name] += int(usage.get(name) or 0)
+        except (TypeError, ValueError):
+            pass
+
+def summarize_history_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    按会话汇总一批待写入的历史记录
+
+    参数:
+        rows: 历史记录字典列表（与ChatHistory的列对应）
+
+    返回:
+        List[Dict[str, Any]]: 每个会话的汇总增量
+    """
+    summaries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for row in rows:
+        accumulate_summary(summaries, row["user_id"], row["session_id"], row.get("timestamp") or datetime.now(), row.get("message_metadata"))
+    return list(summaries.values())
+
+class _Values:
+    """以属性和下标两种方式访问的字面值集合，用于通用的合并规则"""
+
+    def __init__(self, values: Dict[str, Any]):
+        self.__dict__.update(values)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.__dict__[name]
+
+def _merge_values(table, new) -> Dict[str, Any]:
+    """冲突时的合并规则：首末消息时间取最小/最大值，计数字段累加"""
+    values = {
+        "first_message_time": case(
+            (or_(table.c.first_message_time.is_(None), new.first_message_time < table.c.first_message_time), new.first_message_time),
+            else_=table.c.first_message_time
+        ),
+        "last_message_time": case(
+            (or_(table.c.last_message_time.is_(None), new.last_message_time > table.c.last_message_time), new.last_message_time),
+            else_=table.c.last_message_time
+        )
+    }
+    for name in SUMMARY_COUNTERS:
+        values[name] = table.c[name] + new[name]
+    return values
+
+def upsert_session_summaries(executor: Any, summaries: List[Dict[str, Any]]):
+    """
+    将会话汇总增量合并到chat_sessions表，在调用方的事务中执行
+
+    参数:
+        executor: 数据库会话（Session）或连接（Connection）
+        summaries: summarize_history_rows返回的会话汇总增量
+    """
+    if not summaries:
+        return
+    table = ChatSession.__table__
+    dialect = executor.dialect.name if hasattr(executor, "dialect") else executor.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=[table.c.user_id, table.c.session_id], set_=_merge_values(table, stmt.excluded))
+        executor.execute(stmt, summaries)
+    elif dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_duplicate_key_update(**_merge_values(table, stmt.inserted))
+        executor.execute(stmt, summaries)
+    else:
+        # 其他数据库逐个会话先更新，不存在时插入
+        for summary in summaries:
+            merged = {name: summary[name] for name in ("first_message_time", "last_message_time", *SUMMARY_COUNTERS)}
+            result = executor.execute(
+                update(table)
+                .where(and_(table.c.user_id == summary["user_id"], table.c.session_id == summary["session_id"]))
+                .values(**_merge_values(table, _Values(merged)))
+            )
+            if not result.rowcount:
+                executor.execute(insert(table).values(**summary))
+
+def backfill_session_summaries(executor: Any, user_id: Optional[str] = None, session_id: Optional[str] = None, batch_size: int = 5000) -> int:
+    """
+    根据chat_history重建会话汇总，在调用方的事务中执行
+
+    参数:
+        executor: 数据库会话（Session）或连接（Connection）
+        user_id: 用户ID，可选，只重建该用户的会话
+        session_id: 会话ID，可选，只重建该会话
+        batch_size: 每次从数据库读取的记录数
+
+    返回:
+        int: 重建的会话数量
+    """
+    summary_filters = []
+    history_filters = []
+    if user_id:
+        summary_filters.append(ChatSession.user_id == user_id)
+        history_filters.append(ChatHistory.user_id == user_id)
+    if session_id:
+        summary_filters.append(ChatSession.session_id == session_id)
+        history_filters.append(ChatHistory.session_id == session_id)
+
+    executor.execute(delete(ChatSession).where(*summary_filters))
+
+    # 流式读取历史记录并在内存中按会话汇总，内存占用只与会话数量有关
+    summaries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    query = (
+        select(ChatHistory.user_id, ChatHistory.session_id, ChatHistory.timestamp, ChatHistory.message_metadata)
+        .where(*history_filters)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in executor.execute(query):
+        accumulate_summary(summaries, row.user_id, row.session_id, row.timestamp, row.message_metadata)
+
+    values = list(summaries.values())
+    for start in range(0, len(values), batch_size):
+        executor.execute(insert(ChatSession), values[start:start + batch_size])
+    return len(values)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="根据聊天历史重建会话汇总表")
+    parser.add_argument("--user-id", default=None, help="只重建该用户的会话")
+    args = parser.parse_args(argv)
+
+    from database.migrations import run_migrations
+    run_migrations()
+    try:
+        with engine.begin() as connection:
+            count = backfill_session_summaries(connection, user_id=args.user_id)
+        print(f"已重建{count}个会话的汇总")
+    except Exception as e:
+        print(f"重建会话汇总失败: {str(e)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
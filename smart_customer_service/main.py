@@ -1,10 +1,22 @@
 import os
-import uvicorn
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
+# 启用启动性能分析时，尽早开始统计后续模块的导入耗时
+from services.startup import startup_profiler, warmup_manager
+if startup_profiler is not None:
+    startup_profiler.install()
+_app_init_start = time.perf_counter()
+
+import uvicorn
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+# 运行环境，development环境下启用代码热重载
+APP_ENV = os.getenv("APP_ENV", "production")
+
 # 创建FastAPI应用
 app = FastAPI(title="智能客服中间件", description="使用LiteLLM的智能客服中间件系统")
 
@@ -17,22 +29,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求追踪：携带追踪请求头或被抽样的请求记录各时间段的耗时，并在Server-Timing响应头中返回
+from services.tracing import TRACE_HEADER, should_trace, start_trace, create_profiler, install_db_tracing
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """追踪请求，配置了TRACE_PROFILE_MODE时同时进行性能剖析，耗时超过阈值的请求写入剖析文件"""
+    if not should_trace(request.headers.get(TRACE_HEADER)):
+        return await call_next(request)
+    trace = start_trace(request.headers.get("X-Trace-Id"))
+    profiler = create_profiler()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        if profiler is not None:
+            path = profiler.stop(trace, (time.perf_counter() - start) * 1000)
+            if path:
+                print(f"慢请求{request.url.path}的性能剖析已写入{path}")
+    response.headers["X-Trace-Id"] = trace.trace_id
+    server_timing = trace.server_timing()
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
 # 导入路由
-from api import chat_router
+from api import chat_router, admin_router
+
+# 被追踪的请求中记录每条SQL语句的耗时
+from database.database import engine
+install_db_tracing(engine)
 
 # 注册路由
 app.include_router(chat_router.router, prefix="/api", tags=["聊天服务"])
+app.include_router(admin_router.router, prefix="/api", tags=["知识库管理"])
+
+# 注册启动预热组件：LiteLLM和知识库索引在首次使用时才加载，服务启动后在后台提前完成
+# 上游未配置API密钥时该组件失败，就绪检查返回503
+from services.chat_service import get_litellm
+from services.knowledge_base_service import get_knowledge_base_service
+from services.upstream_pool import check_upstream_api_keys
+warmup_manager.register("upstreams", check_upstream_api_keys)
+warmup_manager.register("litellm", get_litellm)
+warmup_manager.register("knowledge_base", get_knowledge_base_service)
+
+if startup_profiler is not None:
+    startup_profiler.record_init("main", time.perf_counter() - _app_init_start)
+
+@app.on_event("startup")
+def start_warmup():
+    """服务启动时在后台预热耗时较长的组件"""
+    warmup_manager.start()
+
+@app.on_event("shutdown")
+def flush_history_on_shutdown():
+    """关闭服务时写入队列中剩余的聊天历史记录"""
+    from services.history_writer import shutdown_history_writer
+    shutdown_history_writer()
 
 @app.get("/")
 def read_root():
     """根路径，返回服务状态"""
     return {"status": "running", "version": "1.0.0"}
 
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus格式的指标，包含各处理阶段耗时、大模型首个片段延迟、token用量、错误数和队列深度"""
+    from fastapi.responses import PlainTextResponse
+    from services.metrics import render_metrics
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+def read_ready():
+    """就绪检查，所有组件预热完成后返回200，否则返回503"""
+    status = warmup_manager.status()
+    if startup_profiler is not None:
+        status["startup_profile"] = startup_profiler.report()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 if __name__ == "__main__":
     # 启动服务器
     uvicorn.run(
         "main:app",
         host=os.getenv("HOST", "0.0.0.0"),
         port=int(os.getenv("PORT", "8000")),
-        reload=True
-    )
\ No newline at end of file
+        reload=APP_ENV == "development"
+    )
@@ -13,16 +13,23 @@ class Message(BaseModel):
 class ChatRequest(BaseModel):
     """聊天请求模型，用于接收客户端的聊天请求"""
     user_id: str = Field(..., description="用户ID")
-    messages: List[Message] = Field(..., description="聊天消息列表")
+    session_id: Optional[str] = Field(default=None, description="会话ID，提供时使用服务端保存的会话上下文，只需发送最新一轮消息")
+    messages: List[Message] = Field(..., min_length=1, description="聊天消息列表")
     model: str = Field(default="Qwen/QwQ-32B", description="使用的大模型")
     max_tokens: Optional[int] = Field(default=1000, description="最大生成token数")
     temperature: Optional[float] = Field(default=0.7, description="生成温度")
     stream: Optional[bool] = Field(default=False, description="是否使用流式响应")
     additional_context: Optional[Dict[str, Any]] = Field(default=None, description="额外上下文信息")
 
+class BatchChatRequest(BaseModel):
+    """批量聊天请求模型，用于离线任务一次提交多个聊天请求"""
+    requests: List[ChatRequest] = Field(..., min_length=1, description="聊天请求列表，按非流式处理")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="同时调用大模型的请求数，默认使用服务端配置")
+
 class ChatResponse(BaseModel):
     """聊天响应模型，用于返回大模型的响应"""
     user_id: str = Field(..., description="用户ID")
+    session_id: Optional[str] = Field(default=None, description="会话ID，后续请求携带该ID即可延续会话")
     message: Message = Field(..., description="响应消息")
     model: str = Field(..., description="使用的大模型")
     usage: Optional[Dict[str, int]] = Field(default=None, description="token使用情况")
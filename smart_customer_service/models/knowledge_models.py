@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+class KnowledgeEntry(BaseModel):
+    """知识库条目模型"""
+    id: str = Field(..., description="条目ID")
+    title: str = Field(default="", description="条目标题")
+    content: str = Field(..., description="条目内容")
+
+class KnowledgeEntryCreate(BaseModel):
+    """新增知识库条目请求模型"""
+    id: Optional[str] = Field(default=None, description="条目ID，不提供时自动生成")
+    title: str = Field(default="", description="条目标题")
+    content: str = Field(..., min_length=1, description="条目内容")
+
+class KnowledgeEntryUpdate(BaseModel):
+    """更新知识库条目请求模型，未提供的字段保持不变"""
+    title: Optional[str] = Field(default=None, description="条目标题")
+    content: Optional[str] = Field(default=None, min_length=1, description="条目内容")
+
+class KnowledgeEntryList(BaseModel):
+    """知识库条目列表响应模型"""
+    total: int = Field(..., description="条目总数")
+    entries: List[KnowledgeEntry] = Field(..., description="条目列表")
@@ -1,6 +1,60 @@
-from typing import List, Dict, Any, Optional
+import json
+import base64
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
-from database.database import get_db, ChatHistory
+from sqlalchemy import select, tuple_
+from database.database import get_db, get_async_session_factory, DB_ASYNC_ENABLED, ChatHistory, ChatSession
+from database.session_summary import backfill_session_summaries
+from services.session_service import invalidate_session_context
+from services.context_manager import invalidate_session_summary
+
+def record_to_dict(record: ChatHistory) -> Dict[str, Any]:
+    """将聊天历史记录转换为字典"""
+    return {
+        "id": record.id,
+        "user_id": record.user_id,
+        "session_id": record.session_id,
+        "role": record.role,
+        "content": record.content,
+        "filtered_content": record.filtered_content,
+        "timestamp": record.timestamp.isoformat() if record.timestamp else None,
+        "metadata": record.message_metadata
+    }
+
+def encode_history_cursor(timestamp: datetime, record_id: int) -> str:
+    """
+    将分页位置编码为不透明的游标字符串
+    
+    参数:
+        timestamp: 当前页最后一条记录的时间戳
+        record_id: 当前页最后一条记录的ID
+    
+    返回:
+        str: URL安全的游标字符串
+    """
+    payload = json.dumps([timestamp.isoformat(), record_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析游标字符串
+    
+    参数:
+        cursor: encode_history_cursor生成的游标
+    
+    返回:
+        Tuple[datetime, int]: (时间戳, 记录ID)
+    
+    异常:
+        ValueError: 游标格式无效
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, record_id = json.loads(payload)
+        return datetime.fromisoformat(timestamp), int(record_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
 
 class ChatHistoryService:
     """聊天历史服务类，用于管理和获取用户的聊天历史记录"""
@@ -13,7 +67,7 @@ class ChatHistoryService:
             user_id: 用户ID
             session_id: 会话ID，可选，如果提供则只返回该会话的记录
             limit: 返回的最大记录数
-            offset: 偏移量，用于分页
+            offset: 偏移量，用于分页（越往后翻页越慢，建议使用get_user_chat_history_page的游标分页）
         
         返回:
             List[Dict[str, Any]]: 聊天历史记录列表
@@ -30,23 +84,10 @@ class ChatHistoryService:
                 query = query.filter(ChatHistory.session_id == session_id)
             
             # 按时间戳降序排列，并应用分页
-            chat_history = query.order_by(ChatHistory.timestamp.desc()).offset(offset).limit(limit).all()
+            chat_history = query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).offset(offset).limit(limit).all()
             
             # 转换为字典列表
-            result = []
-            for record in chat_history:
-                result.append({
-                    "id": record.id,
-                    "user_id": record.user_id,
-                    "session_id": record.session_id,
-                    "role": record.role,
-                    "content": record.content,
-                    "filtered_content": record.filtered_content,
-                    "timestamp": record.timestamp.isoformat() if record.timestamp else None,
-                    "metadata": record.message_metadata
-                })
-            
-            return result
+            return [record_to_dict(record) for record in chat_history]
         except Exception as e:
             print(f"获取聊天历史记录失败: {str(e)}")
             return []
@@ -54,42 +95,117 @@ class ChatHistoryService:
             # 关闭数据库会话
             db.close()
             
+    def get_user_chat_history_page(self, user_id: str, session_id: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        使用游标（keyset）分页获取用户的聊天历史记录
+        
+        按(timestamp, id)倒序排列，翻页时从上一页最后一条记录之后继续读取，
+        借助复合索引(user_id, timestamp, id)直接定位，翻到多深都不需要扫描和跳过前面的记录。
+        
+        参数:
+            user_id: 用户ID
+            session_id: 会话ID，可选，如果提供则只返回该会话的记录
+            limit: 返回的最大记录数
+            cursor: 上一页返回的next_cursor，为空时从最新的记录开始
+        
+        返回:
+            Dict[str, Any]: 包含history（聊天历史记录列表）和next_cursor（下一页游标，没有更多记录时为None）
+        
+        异常:
+            ValueError: 游标格式无效
+        """
+        query = self._build_history_page_query(user_id, session_id, limit, cursor)
+        
+        # 获取数据库会话
+        db = next(get_db())
+        
+        try:
+            records = db.execute(query).scalars().all()
+            return self._build_history_page(records, limit)
+        finally:
+            # 关闭数据库会话
+            db.close()
+            
+    async def get_user_chat_history_page_async(self, user_id: str, session_id: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        异步使用游标分页获取用户的聊天历史记录，参数和返回值同get_user_chat_history_page
+        
+        启用异步数据库引擎（DB_ASYNC_ENABLED）时直接在事件循环中查询，否则在线程池中执行同步查询
+        """
+        if not DB_ASYNC_ENABLED:
+            return await asyncio.to_thread(self.get_user_chat_history_page, user_id, session_id, limit, cursor)
+        
+        query = self._build_history_page_query(user_id, session_id, limit, cursor)
+        async with get_async_session_factory()() as db:
+            records = (await db.execute(query)).scalars().all()
+        return self._build_history_page(records, limit)
+        
+    @staticmethod
+    def _build_history_page_query(user_id: str, session_id: Optional[str], limit: int, cursor: Optional[str]):
+        """构建游标分页查询语句，游标格式无效时抛出ValueError"""
+        position = decode_history_cursor(cursor) if cursor else None
+        
+        # 构建查询
+        query = select(ChatHistory).where(ChatHistory.user_id == user_id)
+        
+        # 如果指定了会话ID，则过滤会话
+        if session_id:
+            query = query.where(ChatHistory.session_id == session_id)
+        
+        # 从游标位置之后继续读取
+        if position is not None:
+            query = query.where(tuple_(ChatHistory.timestamp, ChatHistory.id) < position)
+        
+        # 多读取一条记录用于判断是否还有下一页
+        return query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit + 1)
+        
+    @staticmethod
+    def _build_history_page(records: List[ChatHistory], limit: int) -> Dict[str, Any]:
+        """根据查询结果生成一页数据和下一页游标"""
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = encode_history_cursor(records[-1].timestamp, records[-1].id)
+        
+        return {
+            "history": [record_to_dict(record) for record in records],
+            "next_cursor": next_cursor
+        }
+            
     def get_user_sessions(self, user_id: str) -> List[Dict[str, Any]]:
         """
         获取用户的所有会话列表
         
+        从会话汇总表按索引(user_id, last_message_time)读取，不再对用户的全部历史记录分组聚合
+        
         参数:
             user_id: 用户ID
         
         返回:
-            List[Dict[str, Any]]: 会话列表，包含会话ID和最近消息时间
+            List[Dict[str, Any]]: 会话列表，包含会话ID、首末消息时间、消息数量和token用量，按最近消息时间降序排列
         """
         # 获取数据库会话
         db = next(get_db())
         
         try:
-            # 查询用户的所有会话ID和最近消息时间
-            # 注意：SQLAlchemy的查询方式可能因版本而异，这里使用了基本的查询方式
-            from sqlalchemy import func
-            
-            # 按会话分组，获取每个会话的最大时间戳
-            sessions_query = (
-                db.query(
-                    ChatHistory.session_id,
-                    func.max(ChatHistory.timestamp).label("latest_message_time")
-                )
-                .filter(ChatHistory.user_id == user_id)
-                .group_by(ChatHistory.session_id)
-                .order_by(func.max(ChatHistory.timestamp).desc())
+            sessions = (
+                db.query(ChatSession)
+                .filter(ChatSession.user_id == user_id)
+                .order_by(ChatSession.last_message_time.desc())
                 .all()
             )
             
             # 转换为字典列表
             result = []
-            for session in sessions_query:
+            for session in sessions:
                 result.append({
                     "session_id": session.session_id,
-                    "latest_message_time": session.latest_message_time.isoformat() if session.latest_message_time else None
+                    "first_message_time": session.first_message_time.isoformat() if session.first_message_time else None,
+                    "latest_message_time": session.last_message_time.isoformat() if session.last_message_time else None,
+                    "message_count": session.message_count,
+                    "prompt_tokens": session.prompt_tokens,
+                    "completion_tokens": session.completion_tokens,
+                    "total_tokens": session.total_tokens
                 })
             
             return result
@@ -120,6 +236,17 @@ class ChatHistoryService:
         db = next(get_db())
         
         try:
+            # 使对应会话的上下文缓存和摘要失效
+            record = None
+            if history_id:
+                record = db.query(ChatHistory.user_id, ChatHistory.session_id).filter(ChatHistory.id == history_id).first()
+                if record:
+                    invalidate_session_context(record.user_id, record.session_id)
+                    invalidate_session_summary(record.user_id, record.session_id)
+            else:
+                invalidate_session_context(user_id, session_id)
+                invalidate_session_summary(user_id, session_id)
+            
             # 构建查询
             query = db.query(ChatHistory)
             
@@ -133,6 +260,14 @@ class ChatHistoryService:
             
             # 执行删除
             deleted_count = query.delete(synchronize_session=False)
+            
+            # 在同一个事务中重建受影响会话的汇总
+            if deleted_count:
+                if history_id:
+                    if record:
+                        backfill_session_summaries(db, user_id=record.user_id, session_id=record.session_id)
+                else:
+                    backfill_session_summaries(db, user_id=user_id, session_id=session_id)
             db.commit()
             
             return deleted_count > 0
@@ -153,6 +288,14 @@ def get_user_chat_history(user_id: str, session_id: Optional[str] = None, limit:
     """便捷函数，获取用户的聊天历史记录"""
     return chat_history_service.get_user_chat_history(user_id, session_id, limit, offset)
     
+def get_user_chat_history_page(user_id: str, session_id: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """便捷函数，使用游标分页获取用户的聊天历史记录"""
+    return chat_history_service.get_user_chat_history_page(user_id, session_id, limit, cursor)
+    
+async def get_user_chat_history_page_async(user_id: str, session_id: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """异步便捷函数，使用游标分页获取用户的聊天历史记录"""
+    return await chat_history_service.get_user_chat_history_page_async(user_id, session_id, limit, cursor)
+    
 def get_user_sessions(user_id: str) -> List[Dict[str, Any]]:
     """便捷函数，获取用户的所有会话列表"""
     return chat_history_service.get_user_sessions(user_id)
@@ -1,17 +1,43 @@
 import os
+import time
 import uuid
-import litellm
-from typing import List, Dict, Any, Optional, Generator
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator
 from datetime import datetime
 from models.chat_models import ChatRequest, ChatResponse, Message
-from services.sensitive_word_service import filter_sensitive_words
-from services.knowledge_base_service import attach_knowledge_to_query
-from database.database import get_db, ChatHistory
+from services.sensitive_word_service import filter_sensitive_words_async, filter_sensitive_words_batch_async, create_stream_filter
+from services.knowledge_base_service import attach_knowledge_to_query_async, attach_knowledge_to_queries_async
+from services.history_writer import submit_history, submit_history_async
+from services.session_service import get_session_context, set_session_context, append_session_messages
+from services.response_cache import make_cache_key, get_cached_response, cache_response
+from services.request_coalescer import coalesce_request, coalesce_stream
+from services.context_manager import fit_context, estimate_text_tokens
+from services.upstream_pool import upstream_completion, upstream_stream, upstream_model_label
+from services.llm_scheduler import SchedulerRejected, llm_slot, check_llm_admission, get_request_priority
+from services.tracing import get_current_trace
+from services.metrics import stage_timer, observe_stage, record_usage, RESPONSES, UPSTREAM_TTFT, UPSTREAM_TOKENS_PER_SECOND
+
+# 批量聊天接口每批最多的请求数和默认的大模型调用并发数
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# 调用大模型失败时返回给用户的内容
+ERROR_REPLY = "抱歉，我现在无法为您提供服务，请稍后再试。"
+
+def get_litellm():
+    """
+    获取LiteLLM模块，首次调用时导入
+    
+    LiteLLM导入耗时数秒，延迟到第一次调用大模型或启动预热时再导入，不拖慢服务启动
+    """
+    import litellm
+    return litellm
 
 # 配置LiteLLM
 def configure_litellm():
     """配置LiteLLM，设置API密钥和其他参数"""
     import os
+    litellm = get_litellm()
     
     # 从环境变量加载API密钥
     if os.getenv("OPENAI_API_KEY"):
@@ -23,45 +49,52 @@ def configure_litellm():
 # 初始化LiteLLM配置
 # configure_litellm()
 
-def process_chat_request(request: ChatRequest, stream: bool = False) -> Any:
+async def process_chat_request(request: ChatRequest, stream: bool = False) -> Any:
     """
-    处理聊天请求
+    处理聊天请求（异步）
     
     参数:
         request: 聊天请求对象
         stream: 是否使用流式响应
     
     返回:
-        ChatResponse: 聊天响应对象，或者流式响应的生成器
+        ChatResponse: 聊天响应对象，或者流式响应的异步生成器
     """
-    # 生成会话ID
-    session_id = str(uuid.uuid4())
+    # 大模型并发已满且排队已满时尽早拒绝，不再处理该请求
+    check_llm_admission(request.model, get_request_priority(request.user_id, stream or bool(request.stream)))
+    
+    # 使用客户端提供的会话ID，未提供时生成新的会话ID
+    session_id = request.session_id or str(uuid.uuid4())
     
     # 处理用户消息
     user_message = request.messages[-1]
     
     # 过滤敏感词
-    filtered_content, sensitive_words = filter_sensitive_words(user_message.content)
+    with stage_timer("sensitive_filter"):
+        filtered_content, sensitive_words = await filter_sensitive_words_async(user_message.content)
+    
+    # 先获取会话上下文再记录用户消息：缓存未命中时从聊天历史重建上下文，
+    # 若先记录，重建的上下文可能已包含本轮用户消息，导致本轮消息重复
+    with stage_timer("session_context"):
+        session_context = await get_session_context(request.user_id, session_id) if request.session_id else []
     
     # 记录用户消息
-    record_message(
-        user_id=request.user_id,
-        session_id=session_id,
-        role="user",
-        content=user_message.content,
-        filtered_content=filtered_content,
-        metadata={"sensitive_words": sensitive_words}
-    )
+    with stage_timer("record_message"):
+        await record_message_async(
+            user_id=request.user_id,
+            session_id=session_id,
+            role="user",
+            content=user_message.content,
+            filtered_content=filtered_content,
+            metadata={"sensitive_words": sensitive_words}
+        )
     
     # 为用户消息附加知识库内容
-    enhanced_query = attach_knowledge_to_query(filtered_content)
+    with stage_timer("knowledge_lookup"):
+        enhanced_query = await attach_knowledge_to_query_async(filtered_content)
     
     # 准备发送给大模型的消息
-    messages_for_llm = [msg.dict() for msg in request.messages[:-1]]
-    messages_for_llm.append({
-        "role": "user",
-        "content": enhanced_query
-    })
+    messages_for_llm = await prepare_llm_messages(request, session_id, filtered_content, enhanced_query, session_context)
     
     # 调用大模型
     try:
@@ -74,11 +107,14 @@ def process_chat_request(request: ChatRequest, stream: bool = False) -> Any:
             )
         else:
             # 非流式响应
-            return get_chat_completion(
+            return await get_chat_completion(
                 request=request,
                 session_id=session_id,
                 messages=messages_for_llm
             )
+    except SchedulerRejected:
+        # 调度器拒绝的请求由接口返回429/503，客户端按Retry-After重试
+        raise
     except Exception as e:
         # 记录错误信息
         error_message = f"调用大模型失败: {str(e)}"
@@ -87,12 +123,12 @@ def process_chat_request(request: ChatRequest, stream: bool = False) -> Any:
         # 生成错误响应
         error_response = Message(
             role="assistant",
-            content="抱歉，我现在无法为您提供服务，请稍后再试。",
+            content=ERROR_REPLY,
             metadata={"error": True}
         )
         
         # 记录错误响应
-        record_message(
+        await record_message_async(
             user_id=request.user_id,
             session_id=session_id,
             role="assistant",
@@ -102,166 +138,422 @@ def process_chat_request(request: ChatRequest, stream: bool = False) -> Any:
         
         return ChatResponse(
             user_id=request.user_id,
+            session_id=session_id,
             message=error_response,
             model=request.model,
             usage=None
         )
 
-def get_chat_completion(request: ChatRequest, session_id: str, messages: List[Dict[str, str]]) -> ChatResponse:
+async def prepare_llm_messages(request: ChatRequest, session_id: str, filtered_content: str, enhanced_query: str,
+                               session_context: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
     """
-    获取大模型的聊天完成响应
+    准备发送给大模型的消息：已有会话使用服务端缓存的上下文，客户端只需发送最新一轮消息，
+    并按模型的上下文窗口和max_tokens裁剪上下文，较早的消息替换为会话摘要
+    
+    session_context为记录本轮用户消息之前获取的会话上下文，未提供时在此获取
     """
+    if session_context is None:
+        with stage_timer("session_context"):
+            session_context = await get_session_context(request.user_id, session_id) if request.session_id else []
+    if session_context:
+        messages_for_llm = session_context
+        append_session_messages(request.user_id, session_id, {"role": "user", "content": filtered_content})
+    else:
+        # 新会话以客户端提供的历史消息作为初始上下文
+        messages_for_llm = [{"role": msg.role, "content": msg.content} for msg in request.messages[:-1]]
+        set_session_context(request.user_id, session_id, messages_for_llm + [{"role": "user", "content": filtered_content}])
+    messages_for_llm.append({
+        "role": "user",
+        "content": enhanced_query
+    })
+    
+    with stage_timer("context_fit"):
+        return fit_context(request.user_id, session_id, messages_for_llm, request.model, request.max_tokens, fallback_content=filtered_content)
 
-    model_name = "Qwen/QwQ-32B"  # ✅ 使用硅基流动支持的模型名
+async def get_chat_completion(request: ChatRequest, session_id: str, messages: List[Dict[str, str]]) -> ChatResponse:
+    """
+    获取大模型的聊天完成响应，命中响应缓存时不调用大模型，
+    与进行中的相同请求合并为一次上游调用
+    """
+    response, history_row = await complete_chat_request(request, session_id, messages)
+    
+    # 记录大模型响应
+    with stage_timer("record_message"):
+        await submit_history_async([history_row])
+    
+    # 被追踪的请求在响应元数据中返回各时间段的耗时（不写入聊天历史）
+    trace = get_current_trace()
+    if trace is not None:
+        response.message.metadata = {**response.message.metadata, "trace": trace.to_dict()}
+    return response
 
-    # 调用LiteLLM获取响应
-    response = litellm.completion(
-        # model=request.model,
-        model=model_name,
-        messages=messages,
-        max_tokens=request.max_tokens,
-        temperature=request.temperature,
-        api_key="sk-uzwqzshzwyfjjrdhedyfpqpacibopopfqwpbogihnmdqxbue",
-        api_base="https://api.siliconflow.cn/v1",
-        custom_llm_provider="openai",  
-        stream=False
-    )
+async def complete_chat_request(request: ChatRequest, session_id: str, messages: List[Dict[str, str]],
+                                priority: Optional[int] = None) -> Tuple[ChatResponse, Dict[str, Any]]:
+    """
+    获取大模型的完整响应并过滤敏感词，不写入聊天历史
     
-    # 提取响应内容
-    response_content = response.choices[0].message.content
+    参数:
+        priority: 调度优先级，默认根据用户ID确定
+    
+    返回:
+        Tuple[ChatResponse, Dict[str, Any]]: (聊天响应, 待写入的聊天历史记录)
+    """
+    # 查询响应缓存
+    with stage_timer("cache_lookup"):
+        cache_key = make_cache_key(messages, request.model, request.temperature, request.max_tokens)
+        cached = await get_cached_response(cache_key)
+    coalesced = False
+    
+    if cached is not None:
+        response_content = cached["content"]
+        usage = cached["usage"]
+    else:
+        # 相同的请求正在调用大模型时直接等待其结果
+        result, coalesced = await coalesce_request(cache_key, lambda: fetch_chat_completion(request, messages, cache_key, priority))
+        response_content = result["content"]
+        usage = result["usage"]
+    RESPONSES.inc(1, "cache" if cached is not None else "coalesced" if coalesced else "upstream")
     
     # 过滤响应中的敏感词
-    filtered_response, sensitive_words_in_response = filter_sensitive_words(response_content)
+    with stage_timer("response_filter"):
+        filtered_response, sensitive_words_in_response = await filter_sensitive_words_async(response_content)
+    
+    metadata = {"sensitive_words": sensitive_words_in_response}
+    if cached is not None:
+        metadata["cache_hit"] = True
+    if coalesced:
+        metadata["coalesced"] = True
     
     # 创建响应消息
     response_message = Message(
         role="assistant",
         content=filtered_response,
-        metadata={"sensitive_words": sensitive_words_in_response}
+        metadata=metadata
     )
     
-    # 记录大模型响应
-    record_message(
+    # 大模型响应的聊天历史记录，实际调用大模型时同时记录token用量，计入会话汇总
+    history_row = build_history_row(
         user_id=request.user_id,
         session_id=session_id,
         role="assistant",
         content=response_content,
         filtered_content=filtered_response,
-        metadata={"sensitive_words": sensitive_words_in_response}
+        metadata=metadata if cached is not None or coalesced or not usage else {**metadata, "usage": usage}
     )
-    
-    # 提取使用情况统计
-    usage = None
-    if hasattr(response, "usage"):
-        raw_usage = response.usage.to_dict() if hasattr(response.usage, "to_dict") else dict(response.usage)
-        # 过滤usage字典，只保留整数类型的值
-        usage = {}
-        for key, value in raw_usage.items():
-            # 跳过带有_details后缀的字段，它们可能是复杂类型
-            if key.endswith('_details'):
-                continue
-            # 确保值是整数类型
-            if isinstance(value, int):
-                usage[key] = value
-            elif value is not None:
-                try:
-                    usage[key] = int(value)
-                except (ValueError, TypeError):
-                    pass
+    append_session_messages(request.user_id, session_id, {"role": "assistant", "content": filtered_response})
     
     # 返回聊天响应
-    return ChatResponse(
+    response = ChatResponse(
         user_id=request.user_id,
+        session_id=session_id,
         message=response_message,
         model=request.model,
         usage=usage
     )
+    return response, history_row
 
-def stream_chat_completion(request: ChatRequest, session_id: str, messages: List[Dict[str, str]]) -> Generator[Dict[str, Any], None, None]:
+async def fetch_chat_completion(request: ChatRequest, messages: List[Dict[str, str]], cache_key: str, priority: Optional[int] = None) -> Dict[str, Any]:
     """
-    获取大模型的流式聊天完成响应
+    调用大模型获取完整响应并写入响应缓存
+    
+    参数:
+        priority: 调度优先级，默认根据用户ID确定
+    
+    返回:
+        Dict[str, Any]: 包含content（响应内容）和usage（使用情况统计）
     """
-    # 调用LiteLLM获取流式响应
-    response_stream = litellm.completion(
-        model="Qwen/QwQ-32B",
-        messages=messages,
-        max_tokens=request.max_tokens,
-        temperature=request.temperature,
-        api_key="sk-uzwqzshzwyfjjrdhedyfpqpacibopopfqwpbogihnmdqxbue",
-        api_base="https://api.siliconflow.cn/v1",
-        custom_llm_provider="openai",  
-        stream=True
-    )
+    if priority is None:
+        priority = get_request_priority(request.user_id)
+    
+    # 在调度器的并发槽位内通过上游连接池调用LiteLLM获取响应，上游的模型名称、API地址和密钥由配置决定
+    queue_start = time.perf_counter()
+    async with llm_slot(request.model, priority):
+        observe_stage("llm_queue", time.perf_counter() - queue_start)
+        with stage_timer("upstream"):
+            response = await upstream_completion(
+                request.model,
+                messages=messages,
+                max_tokens=request.max_tokens,
+                temperature=request.temperature
+            )
+    
+    # 提取响应内容和使用情况统计
+    response_content = response.choices[0].message.content
+    usage = extract_usage(response)
+    record_usage(upstream_model_label(request.model), usage)
+    
+    # 写入响应缓存
+    await cache_response(cache_key, response_content, usage)
+    return {"content": response_content, "usage": usage}
+
+def extract_usage(response: Any) -> Optional[Dict[str, int]]:
+    """
+    提取大模型响应中的使用情况统计
+    """
+    if not hasattr(response, "usage") or response.usage is None:
+        return None
+    raw_usage = response.usage.to_dict() if hasattr(response.usage, "to_dict") else dict(response.usage)
+    # 过滤usage字典，只保留整数类型的值
+    usage = {}
+    for key, value in raw_usage.items():
+        # 跳过带有_details后缀的字段，它们可能是复杂类型
+        if key.endswith('_details'):
+            continue
+        # 确保值是整数类型
+        if isinstance(value, int):
+            usage[key] = value
+        elif value is not None:
+            try:
+                usage[key] = int(value)
+            except (ValueError, TypeError):
+                pass
+    return usage
+
+async def stream_completion_deltas(request: ChatRequest, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+    """
+    调用大模型获取流式响应，逐个生成文本片段
+    """
+    # 在调度器的并发槽位内通过上游连接池调用LiteLLM获取流式响应，槽位在流结束后释放
+    queue_start = time.perf_counter()
+    async with llm_slot(request.model, get_request_priority(request.user_id, stream=True)):
+        start = time.perf_counter()
+        observe_stage("llm_queue", start - queue_start)
+        first_token_time = None
+        generated = []
+        with stage_timer("upstream_stream"):
+            response_stream = upstream_stream(
+                request.model,
+                messages=messages,
+                max_tokens=request.max_tokens,
+                temperature=request.temperature
+            )
+            
+            async for chunk in response_stream:
+                if hasattr(chunk, "choices") and chunk.choices:
+                    choice = chunk.choices[0]
+                    if hasattr(choice, "delta") and hasattr(choice.delta, "content") and choice.delta.content:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                            UPSTREAM_TTFT.observe(first_token_time - start, upstream_model_label(request.model))
+                        generated.append(choice.delta.content)
+                        yield choice.delta.content
+        
+        # 流式响应没有usage，按生成文本估算首个片段之后的生成速度
+        if first_token_time is not None:
+            elapsed = time.perf_counter() - first_token_time
+            if elapsed > 0:
+                UPSTREAM_TOKENS_PER_SECOND.observe(estimate_text_tokens("".join(generated)) / elapsed, upstream_model_label(request.model))
+
+async def replay_cached_deltas(content: str) -> AsyncGenerator[str, None]:
+    """
+    将缓存的完整响应作为一个文本片段输出
+    """
+    yield content
+
+async def stream_chat_completion(request: ChatRequest, session_id: str, messages: List[Dict[str, str]]) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    获取大模型的流式聊天完成响应，命中响应缓存时直接输出缓存内容，
+    与进行中的相同请求共享同一个上游流
+    """
+    # 查询响应缓存
+    with stage_timer("cache_lookup"):
+        cache_key = make_cache_key(messages, request.model, request.temperature, request.max_tokens)
+        cached = await get_cached_response(cache_key)
+    coalesced = False
+    if cached is not None:
+        deltas = replay_cached_deltas(cached["content"])
+    else:
+        # 上游流正常结束后写入响应缓存，多个订阅者共享的流只写入一次
+        deltas, coalesced = coalesce_stream(
+            cache_key,
+            lambda: stream_completion_deltas(request, messages),
+            on_complete=lambda content: cache_response(cache_key, content)
+        )
+    RESPONSES.inc(1, "cache" if cached is not None else "coalesced" if coalesced else "upstream")
     
-    full_response = ""
+    # 流式敏感词过滤器，跨片段的敏感词同样会被替换
+    stream_filter = create_stream_filter()
     
     # 处理流式响应
-    for chunk in response_stream:
-        if hasattr(chunk, "choices") and chunk.choices:
-            choice = chunk.choices[0]
-            if hasattr(choice, "delta") and hasattr(choice.delta, "content") and choice.delta.content:
-                # 收集响应内容
-                full_response += choice.delta.content
-                
-                # 过滤当前片段中的敏感词
-                filtered_chunk, _ = filter_sensitive_words(choice.delta.content)
-                
-                # 生成流式响应
-                yield {
-                    "user_id": request.user_id,
-                    "content": filtered_chunk,
-                    "model": request.model,
-                    "is_final": False
-                }
-    
-    # 过滤完整响应中的敏感词
-    filtered_full_response, sensitive_words_in_response = filter_sensitive_words(full_response)
+    async for delta in deltas:
+        # 过滤当前片段，只输出已确认安全的文本
+        filtered_chunk = stream_filter.feed(delta)
+        if not filtered_chunk:
+            continue
+        
+        # 生成流式响应
+        yield {
+            "user_id": request.user_id,
+            "session_id": session_id,
+            "content": filtered_chunk,
+            "model": request.model,
+            "is_final": False
+        }
+    
+    # 输出暂存的剩余文本
+    filtered_tail = stream_filter.finish()
+    if filtered_tail:
+        yield {
+            "user_id": request.user_id,
+            "session_id": session_id,
+            "content": filtered_tail,
+            "model": request.model,
+            "is_final": False
+        }
+    
+    # 完整响应的过滤结果直接复用流式过滤器的扫描结果
+    full_response = stream_filter.text
+    filtered_full_response = stream_filter.filtered_text
+    sensitive_words_in_response = stream_filter.sensitive_words
+    
+    metadata = {"sensitive_words": sensitive_words_in_response}
+    if cached is not None:
+        metadata["cache_hit"] = True
+    if coalesced:
+        metadata["coalesced"] = True
     
     # 记录大模型响应
-    record_message(
-        user_id=request.user_id,
-        session_id=session_id,
-        role="assistant",
-        content=full_response,
-        filtered_content=filtered_full_response,
-        metadata={"sensitive_words": sensitive_words_in_response}
-    )
+    with stage_timer("record_message"):
+        await record_message_async(
+            user_id=request.user_id,
+            session_id=session_id,
+            role="assistant",
+            content=full_response,
+            filtered_content=filtered_full_response,
+            metadata=metadata
+        )
+    append_session_messages(request.user_id, session_id, {"role": "assistant", "content": filtered_full_response})
+    
+    # 被追踪的请求在最终响应的元数据中返回各时间段的耗时（不写入聊天历史）
+    trace = get_current_trace()
+    if trace is not None:
+        metadata = {**metadata, "trace": trace.to_dict()}
     
     # 生成最终响应
     yield {
         "user_id": request.user_id,
+        "session_id": session_id,
         "content": filtered_full_response,
         "model": request.model,
         "is_final": True,
-        "metadata": {"sensitive_words": sensitive_words_in_response}
+        "metadata": metadata
     }
 
-def record_message(user_id: str, session_id: str, role: str, content: str, filtered_content: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+async def process_chat_batch(requests: List[ChatRequest], concurrency: Optional[int] = None) -> AsyncGenerator[Dict[str, Any], None]:
     """
-    记录消息到数据库
+    批量处理聊天请求（非流式）
+    
+    敏感词过滤和知识库检索对整批请求各执行一次（一次线程池调用），大模型调用以批量优先级在有限的并发下进行，
+    整批的聊天历史在结束时作为一组记录提交，在同一个事务中写入。
+    
+    参数:
+        requests: 聊天请求列表
+        concurrency: 同时调用大模型的请求数，不超过BATCH_MAX_CONCURRENCY
+    
+    返回:
+        AsyncGenerator[Dict[str, Any], None]: 按完成顺序生成每个请求的结果，
+            成功为{"index", "response"}，失败为{"index", "error", "status_code"}，最后生成{"done": True, "total", "failed"}
+    
+    异常:
+        SchedulerRejected: 大模型并发和排队都已满，整批请求无法进入调度
     """
-    # 获取数据库会话
-    db = next(get_db())
+    # 整批请求进入处理之前检查调度器能否接收
+    priorities = [get_request_priority(request.user_id, batch=True) for request in requests]
+    for model, priority in dict.fromkeys(zip((request.model for request in requests), priorities)):
+        check_llm_admission(model, priority)
     
-    try:
-        # 创建聊天历史记录
-        chat_history = ChatHistory(
-            user_id=user_id,
+    session_ids = [request.session_id or str(uuid.uuid4()) for request in requests]
+    
+    # 整批过滤敏感词
+    with stage_timer("batch_sensitive_filter"):
+        filtered = await filter_sensitive_words_batch_async([request.messages[-1].content for request in requests])
+    
+    user_rows = [
+        build_history_row(
+            user_id=request.user_id,
             session_id=session_id,
-            role=role,
-            content=content,
+            role="user",
+            content=request.messages[-1].content,
             filtered_content=filtered_content,
-            message_metadata=metadata
+            metadata={"sensitive_words": sensitive_words}
         )
-        
-        # 添加到数据库
-        db.add(chat_history)
-        db.commit()
-        db.refresh(chat_history)
-    except Exception as e:
-        # 发生错误时回滚
-        db.rollback()
-        print(f"记录消息失败: {str(e)}")
+        for request, session_id, (filtered_content, sensitive_words) in zip(requests, session_ids, filtered)
+    ]
+    
+    # 整批检索知识库，使用同一个索引快照
+    with stage_timer("batch_knowledge_lookup"):
+        enhanced_queries = await attach_knowledge_to_queries_async([filtered_content for filtered_content, _ in filtered])
+    
+    return run_chat_batch(requests, session_ids, priorities, [filtered_content for filtered_content, _ in filtered],
+                          enhanced_queries, user_rows, min(concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+
+async def run_chat_batch(requests: List[ChatRequest], session_ids: List[str], priorities: List[int], filtered_contents: List[str],
+                         enhanced_queries: List[str], user_rows: List[Dict[str, Any]], concurrency: int) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    以有限的并发调用大模型，按完成顺序生成结果，结束（或客户端断开）时一次提交整批的聊天历史
+    
+    用户消息在该项开始处理时才计入聊天历史，客户端断开时尚未开始的项不会留下记录
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    history_rows: List[Dict[str, Any]] = []
+    
+    async def run_one(index: int) -> Dict[str, Any]:
+        request = requests[index]
+        session_id = session_ids[index]
+        async with semaphore:
+            history_rows.append(user_rows[index])
+            try:
+                messages_for_llm = await prepare_llm_messages(request, session_id, filtered_contents[index], enhanced_queries[index])
+                response, history_row = await complete_chat_request(request, session_id, messages_for_llm, priorities[index])
+                history_rows.append(history_row)
+                return {"index": index, "response": response.model_dump(mode="json")}
+            except SchedulerRejected as e:
+                return {"index": index, "error": str(e), "status_code": e.status_code, "retry_after": e.retry_after}
+            except Exception as e:
+                print(f"批量请求第{index}项调用大模型失败: {str(e)}")
+                history_rows.append(build_history_row(request.user_id, session_id, "assistant", ERROR_REPLY,
+                                                      metadata={"error": True, "error_message": str(e)}))
+                return {"index": index, "error": ERROR_REPLY, "status_code": 500}
+    
+    tasks = [asyncio.create_task(run_one(index)) for index in range(len(requests))]
+    failed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if "error" in result:
+                failed += 1
+            yield result
+        yield {"done": True, "total": len(requests), "failed": failed}
     finally:
-        # 关闭数据库会话
-        db.close()
\ No newline at end of file
+        # 客户端断开时取消尚未完成的请求并等待其结束（释放调度槽位），已完成的结果照常写入
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        with stage_timer("batch_record_message"):
+            await submit_history_async(history_rows)
+
+def build_history_row(user_id: str, session_id: str, role: str, content: str, filtered_content: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    构建一条聊天历史记录，时间戳取记录产生的时间而不是写入数据库的时间
+    """
+    return {
+        "user_id": user_id,
+        "session_id": session_id,
+        "role": role,
+        "content": content,
+        "filtered_content": filtered_content,
+        "timestamp": datetime.now(),
+        "message_metadata": metadata
+    }
+
+def record_message(user_id: str, session_id: str, role: str, content: str, filtered_content: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+    """
+    记录消息到数据库，消息进入后台写入队列，由写入线程批量提交
+    """
+    submit_history([build_history_row(user_id, session_id, role, content, filtered_content, metadata)])
+
+async def record_message_async(user_id: str, session_id: str, role: str, content: str, filtered_content: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
+    """
+    异步记录消息到数据库，请求路径只需一次入队操作
+    """
+    await submit_history_async([build_history_row(user_id, session_id, role, content, filtered_content, metadata)])
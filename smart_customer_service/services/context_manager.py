@@ -0,0 +1,273 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+# 常见模型的上下文窗口大小（token数），未列出的模型使用CONTEXT_WINDOW_TOKENS
+MODEL_CONTEXT_LIMITS = {
+    "Qwen/QwQ-32B": 32768,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "claude-3-haiku-20240307": 200000,
+}
+
+# 每条消息的格式开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 中日韩字符按每个字符一个token估算，其他文本按每4个字符一个token估算
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+# 摘要中的角色名称
+ROLE_NAMES = {"user": "用户", "assistant": "客服"}
+
+SUMMARY_PREFIX = "以下是本次会话较早内容的摘要：\n"
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    估算文本的token数
+
+    中文按字计数，其他字符按4个字符一个token计数，结果略大于常见分词器的实际值，不会低估上下文长度
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+class ContextWindowManager:
+    """
+    上下文窗口管理服务类
+
+    按模型的上下文窗口和max_tokens计算提示词的token预算，超出预算时保留系统消息和最近几轮消息原文，
+    较早的消息替换为会话摘要。每条消息的token数和每个会话的摘要都会缓存，
+    会话每增加一轮只需计算新消息的token数，并把新移出窗口的消息增量合并到已有摘要中。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, default_context_limit: Optional[int] = None,
+                 max_prompt_tokens: Optional[int] = None, summary_tokens: Optional[int] = None):
+        """
+        初始化上下文窗口管理器
+
+        参数:
+            enabled: 是否启用上下文窗口管理
+            default_context_limit: 未知模型的上下文窗口大小（token数）
+            max_prompt_tokens: 提示词的token数上限（控制成本），0表示只受上下文窗口限制
+            summary_tokens: 会话摘要的token数上限
+        """
+        self.enabled = enabled if enabled is not None else os.getenv("CONTEXT_MANAGER_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.default_context_limit = default_context_limit or int(os.getenv("CONTEXT_WINDOW_TOKENS", "8192"))
+        self.max_prompt_tokens = max_prompt_tokens if max_prompt_tokens is not None else int(os.getenv("CONTEXT_MAX_PROMPT_TOKENS", "6000"))
+        self.summary_tokens = summary_tokens or int(os.getenv("CONTEXT_SUMMARY_TOKENS", "500"))
+        self.safety_margin = int(os.getenv("CONTEXT_SAFETY_MARGIN", "256"))
+        self.keep_recent = int(os.getenv("CONTEXT_KEEP_RECENT_MESSAGES", "4"))
+        self.snippet_chars = int(os.getenv("CONTEXT_SUMMARY_SNIPPET_CHARS", "80"))
+        self.token_cache_size = int(os.getenv("CONTEXT_TOKEN_CACHE_SIZE", "50000"))
+        self.summary_cache_size = int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", "10000"))
+        # (角色, 内容) -> token数
+        self._token_cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        # (用户ID, 会话ID) -> (已摘要的消息数, 已摘要消息的指纹, 摘要行列表)
+        self._summaries: "OrderedDict[Tuple[str, str], Tuple[int, str, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 统计信息
+        self.token_cache_hits = 0
+        self.token_cache_misses = 0
+        self.trimmed_requests = 0
+        self.summary_hits = 0
+        self.summary_rebuilds = 0
+
+    def get_context_limit(self, model: str) -> int:
+        """返回模型的上下文窗口大小"""
+        return MODEL_CONTEXT_LIMITS.get(model, self.default_context_limit)
+
+    def get_prompt_budget(self, model: str, max_tokens: Optional[int]) -> int:
+        """
+        计算提示词的token预算
+
+        参数:
+            model: 模型名称
+            max_tokens: 最大生成token数
+
+        返回:
+            int: 上下文窗口扣除生成token数和安全余量后的token数，不超过max_prompt_tokens
+        """
+        budget = self.get_context_limit(model) - (max_tokens or 0) - self.safety_margin
+        if self.max_prompt_tokens > 0:
+            budget = min(budget, self.max_prompt_tokens)
+        return max(budget, 0)
+
+    def count_message_tokens(self, message: Dict[str, str]) -> int:
+        """计算单条消息的token数，结果按(角色, 内容)缓存"""
+        key = (message["role"], message["content"])
+        with self._lock:
+            tokens = self._token_cache.get(key)
+            if tokens is not None:
+                self._token_cache.move_to_end(key)
+                self.token_cache_hits += 1
+                return tokens
+            self.token_cache_misses += 1
+        tokens = estimate_text_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._token_cache[key] = tokens
+            while len(self._token_cache) > self.token_cache_size:
+                self._token_cache.popitem(last=False)
+        return tokens
+
+    def count_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """计算消息列表的token数"""
+        return sum(self.count_message_tokens(message) for message in messages)
+
+    def _summarize_line(self, message: Dict[str, str]) -> str:
+        """把一条消息压缩为一行摘要"""
+        content = " ".join(message["content"].split())
+        if len(content) > self.snippet_chars:
+            content = content[:self.snippet_chars] + "…"
+        return f"{ROLE_NAMES.get(message['role'], message['role'])}: {content}"
+
+    def get_summary(self, user_id: str, session_id: str, dropped: List[Dict[str, str]], max_tokens: int) -> str:
+        """
+        获取被移出窗口的消息的摘要
+
+        同一会话的摘要会缓存，被移出窗口的消息增加时只把新增的消息合并到已有摘要中；
+        已缓存摘要对应的消息与当前消息不一致（如会话上下文被重建）时重新生成摘要。
+
+        参数:
+            user_id: 用户ID
+            session_id: 会话ID
+            dropped: 按时间顺序排列的被移出窗口的消息
+            max_tokens: 摘要的token数上限
+
+        返回:
+            str: 摘要文本，超出token上限时优先保留较新的内容
+        """
+        key = (user_id, session_id)
+        # 链式指纹：第i项包含前i条消息的内容，用于确认缓存的摘要对应的是当前消息的前缀
+        digests = []
+        digest = ""
+        for message in dropped:
+            digest = hashlib.sha1(f"{digest}\0{message['role']}\0{message['content']}".encode("utf-8")).hexdigest()
+            digests.append(digest)
+        with self._lock:
+            cached = self._summaries.get(key)
+        lines: List[str] = []
+        start = 0
+        if cached is not None:
+            covered, digest, cached_lines = cached
+            if covered <= len(dropped) and (covered == 0 or digests[covered - 1] == digest):
+                lines = list(cached_lines)
+                start = covered
+                self.summary_hits += 1
+            else:
+                self.summary_rebuilds += 1
+        lines.extend(self._summarize_line(message) for message in dropped[start:])
+
+        # 超出上限时移除最早的摘要行
+        tokens = estimate_text_tokens(SUMMARY_PREFIX) + sum(estimate_text_tokens(line) + 1 for line in lines)
+        while lines and tokens > max_tokens:
+            tokens -= estimate_text_tokens(lines.pop(0)) + 1
+
+        with self._lock:
+            self._summaries[key] = (len(dropped), digests[-1] if digests else "", lines)
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+        return SUMMARY_PREFIX + "\n".join(lines) if lines else ""
+
+    def fit(self, user_id: str, session_id: str, messages: List[Dict[str, str]], model: str, max_tokens: Optional[int],
+            fallback_content: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        把发送给大模型的消息裁剪到token预算以内
+
+        参数:
+            user_id: 用户ID
+            session_id: 会话ID
+            messages: 按时间顺序排列的消息，最后一条为当前用户消息
+            model: 模型名称
+            max_tokens: 最大生成token数
+            fallback_content: 当前用户消息超出预算时替换使用的内容（如不附加知识库内容的原始问题）
+
+        返回:
+            List[Dict[str, str]]: 系统消息、较早消息的摘要、最近的消息原文和当前用户消息
+        """
+        if not self.enabled or not messages:
+            return messages
+        budget = self.get_prompt_budget(model, max_tokens)
+        if self.count_tokens(messages) <= budget:
+            return messages
+
+        self.trimmed_requests += 1
+        system = [message for message in messages[:-1] if message["role"] == "system"]
+        history = [message for message in messages[:-1] if message["role"] != "system"]
+        latest = messages[-1]
+        fixed = self.count_tokens(system) + self.count_message_tokens(latest)
+        if fixed > budget and fallback_content is not None:
+            latest = {"role": latest["role"], "content": fallback_content}
+            fixed = self.count_tokens(system) + self.count_message_tokens(latest)
+
+        # 从最新的消息开始保留原文，先保证最近keep_recent条消息，剩余预算留给摘要
+        available = budget - fixed
+        recent_limit = min(self.keep_recent, len(history))
+        kept = 0
+        used = 0
+        for message in reversed(history):
+            tokens = self.count_message_tokens(message)
+            reserve = self.summary_tokens if kept >= recent_limit else 0
+            if used + tokens + reserve > available:
+                break
+            used += tokens
+            kept += 1
+
+        dropped = history[:len(history) - kept]
+        result = list(system)
+        summary_budget = min(self.summary_tokens, available - used - MESSAGE_OVERHEAD_TOKENS)
+        if dropped and summary_budget > 0:
+            summary = self.get_summary(user_id, session_id, dropped, summary_budget)
+            if summary:
+                result.append({"role": "system", "content": summary})
+        result.extend(history[len(history) - kept:])
+        result.append(latest)
+        return result
+
+    def invalidate(self, user_id: Optional[str] = None, session_id: Optional[str] = None):
+        """使匹配的会话摘要失效，两个参数都不指定时清空摘要缓存"""
+        with self._lock:
+            for key in [key for key in self._summaries if (user_id is None or key[0] == user_id) and (session_id is None or key[1] == session_id)]:
+                del self._summaries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """返回上下文窗口管理统计信息"""
+        lookups = self.token_cache_hits + self.token_cache_misses
+        return {
+            "enabled": self.enabled,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "summary_tokens": self.summary_tokens,
+            "token_cache_size": len(self._token_cache),
+            "token_cache_hit_rate": self.token_cache_hits / lookups if lookups else 0.0,
+            "trimmed_requests": self.trimmed_requests,
+            "cached_summaries": len(self._summaries),
+            "summary_hits": self.summary_hits,
+            "summary_rebuilds": self.summary_rebuilds
+        }
+
+# 创建全局的上下文窗口管理器实例
+context_window_manager = ContextWindowManager()
+
+# 提供便捷的函数
+def fit_context(user_id: str, session_id: str, messages: List[Dict[str, str]], model: str, max_tokens: Optional[int],
+                fallback_content: Optional[str] = None) -> List[Dict[str, str]]:
+    """便捷函数，把发送给大模型的消息裁剪到token预算以内"""
+    return context_window_manager.fit(user_id, session_id, messages, model, max_tokens, fallback_content)
+
+def count_tokens(messages: List[Dict[str, str]]) -> int:
+    """便捷函数，计算消息列表的token数"""
+    return context_window_manager.count_tokens(messages)
+
+def invalidate_session_summary(user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """便捷函数，使会话摘要失效"""
+    context_window_manager.invalidate(user_id, session_id)
+
+def get_context_stats() -> Dict[str, Any]:
+    """便捷函数，获取上下文窗口管理统计信息"""
+    return context_window_manager.stats()
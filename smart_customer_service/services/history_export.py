@@ -0,0 +1,121 @@
+"""
+聊天历史流式导出
+
+按批从数据库游标中读取记录，逐行编码为NDJSON（可选gzip压缩）并分块输出，
+内存占用与导出的记录数量无关，可用于导出数百万条记录的合规审计数据。
+
+用法（在smart_customer_service目录下执行）:
+    python -m services.history_export --output history.ndjson
+    python -m services.history_export --user-id user123 --start 2024-01-01 --end 2024-02-01 --gzip --output user123.ndjson.gz
+"""
+import os
+import sys
+import json
+import zlib
+import argparse
+from datetime import datetime
+from typing import Dict, Any, Optional, Iterator
+from sqlalchemy import select
+from database.database import engine, ChatHistory
+from services.chat_history_service import record_to_dict
+
+# 每次从数据库游标读取的记录数
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# 输出块大小（字节），累积到该大小后输出一次
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def iter_chat_history(user_id: Optional[str] = None, session_id: Optional[str] = None, start_time: Optional[datetime] = None,
+                      end_time: Optional[datetime] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    使用服务端游标逐条读取聊天历史记录
+
+    参数:
+        user_id: 用户ID，可选，不提供时导出所有用户
+        session_id: 会话ID，可选
+        start_time: 起始时间（包含），可选
+        end_time: 结束时间（不包含），可选
+        batch_size: 每次从数据库游标读取的记录数
+
+    返回:
+        Iterator[Dict[str, Any]]: 聊天历史记录迭代器
+    """
+    query = select(ChatHistory)
+    if user_id:
+        query = query.where(ChatHistory.user_id == user_id)
+    if session_id:
+        query = query.where(ChatHistory.session_id == session_id)
+    if start_time:
+        query = query.where(ChatHistory.timestamp >= start_time)
+    if end_time:
+        query = query.where(ChatHistory.timestamp < end_time)
+    # 指定用户时按复合索引(user_id, timestamp, id)的顺序读取，不指定用户但限定时间范围时按索引(timestamp, id)只扫描范围内的记录，
+    # 否则按主键顺序读取，都不需要额外排序
+    query = query.order_by(ChatHistory.timestamp, ChatHistory.id) if user_id or start_time or end_time else query.order_by(ChatHistory.id)
+
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        for partition in result.partitions():
+            for row in partition:
+                yield record_to_dict(row)
+
+def export_chat_history(user_id: Optional[str] = None, session_id: Optional[str] = None, start_time: Optional[datetime] = None,
+                        end_time: Optional[datetime] = None, compress: bool = False, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    将聊天历史导出为NDJSON字节流
+
+    参数:
+        user_id: 用户ID，可选，不提供时导出所有用户
+        session_id: 会话ID，可选
+        start_time: 起始时间（包含），可选
+        end_time: 结束时间（不包含），可选
+        compress: 是否使用gzip压缩
+        batch_size: 每次从数据库游标读取的记录数
+
+    返回:
+        Iterator[bytes]: 输出数据块迭代器，每块约EXPORT_CHUNK_SIZE字节
+    """
+    # wbits=31表示输出带gzip文件头的数据
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    buffered = 0
+    for record in iter_chat_history(user_id, session_id, start_time, end_time, batch_size):
+        line = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= EXPORT_CHUNK_SIZE:
+            chunk = b"".join(buffer)
+            buffer, buffered = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流式导出聊天历史为NDJSON")
+    parser.add_argument("--user-id", default=None, help="只导出该用户的记录")
+    parser.add_argument("--session-id", default=None, help="只导出该会话的记录")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None, help="起始时间（包含），ISO格式")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None, help="结束时间（不包含），ISO格式")
+    parser.add_argument("--gzip", action="store_true", help="使用gzip压缩")
+    parser.add_argument("--output", default="-", help="输出文件路径，默认输出到标准输出")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="每次从数据库读取的记录数")
+    args = parser.parse_args(argv)
+
+    chunks = export_chat_history(args.user_id, args.session_id, args.start, args.end, args.gzip, args.batch_size)
+    if args.output == "-":
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+if __name__ == "__main__":
+    sys.exit(main())
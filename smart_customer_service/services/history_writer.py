@@ -0,0 +1,304 @@
+import os
+import queue
+import atexit
+import asyncio
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import insert
+from database.database import engine, SessionLocal, ChatHistory, ChatSession
+from database.session_summary import summarize_history_rows, upsert_session_summaries
+
+# 停止后台写入线程的哨兵对象
+_STOP = object()
+
+class HistoryWriter:
+    """
+    聊天历史后台批量写入器
+
+    请求路径只需将记录放入内存队列，后台线程按数量和时间上限将记录分组批量提交，
+    将每条消息一次提交（一次fsync）合并为每批一次提交。整批提交失败时逐组重试，
+    只丢弃重试仍然失败的记录组，不影响同一批中其他请求的记录。
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 max_queue_size: Optional[int] = None, enqueue_timeout: Optional[float] = None):
+        """
+        初始化写入器
+
+        参数:
+            batch_size: 每批最多写入的记录数
+            flush_interval: 记录在队列中等待提交的最长时间（秒）
+            max_queue_size: 队列容量，队列满时对调用方施加背压
+            enqueue_timeout: 队列满时调用方最长等待时间（秒），超时后在调用方线程中直接写入
+        """
+        self.batch_size = batch_size or int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.2"))
+        self.max_queue_size = max_queue_size or int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+        self.enqueue_timeout = enqueue_timeout or float(os.getenv("HISTORY_ENQUEUE_TIMEOUT", "5"))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._summary_table_checked = False
+        # (user_id, session_id) -> 已提交但尚未写入（或写入失败）的记录组数量，重建会话上下文前等待其归零
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._pending_cond = threading.Condition()
+        # 统计信息
+        self.written_count = 0
+        self.failed_count = 0
+        self.batch_count = 0
+
+    def start(self):
+        """启动后台写入线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, rows: List[Dict[str, Any]]):
+        """
+        提交一组记录，同一组记录保证在同一个事务中写入
+
+        队列满时阻塞等待（背压），超过enqueue_timeout仍未入队则在当前线程直接写入，保证记录不丢失。
+
+        参数:
+            rows: ChatHistory字段字典列表
+        """
+        if not rows:
+            return
+        self.start()
+        self._track(rows)
+        self._put(rows)
+
+    def _put(self, rows: List[Dict[str, Any]]):
+        """将记录组放入队列，超过enqueue_timeout仍未入队则在当前线程直接写入"""
+        try:
+            self._queue.put(rows, timeout=self.enqueue_timeout)
+        except queue.Full:
+            print(f"聊天历史写入队列已满，直接写入{len(rows)}条记录")
+            self._write_batch([rows])
+
+    async def submit_async(self, rows: List[Dict[str, Any]]):
+        """
+        异步提交一组记录，队列未满时只需一次入队操作，队列满时在线程池中等待，不阻塞事件循环
+
+        参数:
+            rows: ChatHistory字段字典列表
+        """
+        if not rows:
+            return
+        self.start()
+        self._track(rows)
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            await asyncio.to_thread(self._put, rows)
+
+    @staticmethod
+    def _session_keys(rows: List[Dict[str, Any]]) -> set:
+        """返回记录组涉及的(user_id, session_id)集合"""
+        return {(row.get("user_id"), row.get("session_id")) for row in rows}
+
+    def _track(self, rows: List[Dict[str, Any]]):
+        """登记尚未写入的记录组"""
+        with self._pending_cond:
+            for key in self._session_keys(rows):
+                self._pending[key] = self._pending.get(key, 0) + 1
+
+    def _untrack(self, groups: List[List[Dict[str, Any]]]):
+        """记录组写入完成（无论成功与否）后取消登记，并唤醒等待该会话的线程"""
+        with self._pending_cond:
+            for group in groups:
+                for key in self._session_keys(group):
+                    count = self._pending.get(key, 0) - 1
+                    if count > 0:
+                        self._pending[key] = count
+                    else:
+                        self._pending.pop(key, None)
+            self._pending_cond.notify_all()
+
+    def flush_session(self, user_id: str, session_id: str, timeout: Optional[float] = None) -> bool:
+        """
+        等待指定会话已提交的记录全部写入数据库，不等待其他会话的记录
+
+        参数:
+            user_id: 用户ID
+            session_id: 会话ID
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        返回:
+            bool: 是否在超时前全部写入
+        """
+        key = (user_id, session_id)
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: key not in self._pending, timeout)
+
+    def queue_size(self) -> int:
+        """返回队列中等待写入的记录组数量"""
+        return self._queue.qsize()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待队列中的所有记录写入数据库
+
+        参数:
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        返回:
+            bool: 是否在超时前全部写入
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.unfinished_tasks == 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """
+        停止后台写入线程，停止前写入队列中剩余的全部记录
+
+        参数:
+            timeout: 等待写入线程退出的最长时间（秒）
+        """
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        """后台写入线程主循环"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            batch_rows = len(item)
+            taken = 1
+            # 在时间上限内继续收集记录，直到达到批量上限
+            deadline = time.monotonic() + self.flush_interval
+            while batch_rows < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                batch_rows += len(item)
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+        # 写入停止信号之后仍残留在队列中的记录
+        remaining_groups = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining_groups.append(item)
+            self._queue.task_done()
+        if remaining_groups:
+            self._write_batch(remaining_groups)
+
+    def _write_batch(self, groups: List[List[Dict[str, Any]]]):
+        """
+        在一个事务中批量写入多组记录，整批失败时逐组在各自的事务中重试
+
+        参数:
+            groups: 记录组列表，每组是一次submit提交的记录
+        """
+        try:
+            self._write_groups(groups)
+        finally:
+            self._untrack(groups)
+
+    def _write_groups(self, groups: List[List[Dict[str, Any]]]):
+        """写入多组记录，整批失败时逐组重试，只丢弃重试仍然失败的记录组"""
+        rows = [row for group in groups for row in group]
+        error = self._write_rows(rows)
+        if error is None:
+            return
+        if len(groups) == 1:
+            self.failed_count += len(rows)
+            print(f"批量写入聊天历史失败({len(rows)}条): {error}")
+            return
+        # 逐组重试，找出导致整批失败的记录组，其他组照常写入
+        print(f"批量写入聊天历史失败({len(rows)}条)，逐组重试: {error}")
+        for group in groups:
+            error = self._write_rows(group)
+            if error is not None:
+                self.failed_count += len(group)
+                print(f"写入聊天历史失败({len(group)}条): {error}")
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        在一个事务中写入记录，并更新对应的会话汇总
+
+        返回:
+            Optional[str]: 写入失败时返回错误信息，成功时返回None
+        """
+        db = SessionLocal()
+        try:
+            if not self._summary_table_checked:
+                # 尚未执行迁移的旧数据库没有会话汇总表，先创建（已有会话需执行python -m database.migrations回填）
+                ChatSession.__table__.create(bind=engine, checkfirst=True)
+                self._summary_table_checked = True
+            db.execute(insert(ChatHistory), rows)
+            upsert_session_summaries(db, summarize_history_rows(rows))
+            db.commit()
+            self.written_count += len(rows)
+            self.batch_count += 1
+            return None
+        except Exception as e:
+            # 发生错误时回滚
+            db.rollback()
+            return str(e)
+        finally:
+            # 关闭数据库会话
+            db.close()
+
+# 创建全局的聊天历史写入器实例
+history_writer = HistoryWriter()
+
+# 进程退出时写入剩余记录
+atexit.register(history_writer.stop)
+
+# 提供便捷的函数
+def submit_history(rows: List[Dict[str, Any]]):
+    """便捷函数，提交一组聊天历史记录"""
+    history_writer.submit(rows)
+
+async def submit_history_async(rows: List[Dict[str, Any]]):
+    """便捷函数，异步提交一组聊天历史记录"""
+    await history_writer.submit_async(rows)
+
+def flush_history(timeout: Optional[float] = None) -> bool:
+    """便捷函数，等待队列中的聊天历史全部写入"""
+    return history_writer.flush(timeout)
+
+def flush_session_history(user_id: str, session_id: str, timeout: Optional[float] = None) -> bool:
+    """便捷函数，等待指定会话已提交的聊天历史全部写入"""
+    return history_writer.flush_session(user_id, session_id, timeout)
+
+def shutdown_history_writer():
+    """便捷函数，写入剩余记录并停止后台写入线程"""
+    history_writer.stop()
@@ -0,0 +1,322 @@
+"""
+知识库索引离线构建与加载
+
+索引目录结构（每次构建生成一个新的版本目录，CURRENT文件指向当前版本）：
+
+    kb_index/
+    ├── CURRENT                 # 当前版本目录名
+    └── 20240101T120000-1a2b3c/
+        ├── manifest.json       # 格式版本、分词器、文档数量、知识库文件指纹等
+        ├── terms.bin           # 有序词表（UTF-8编码的词项首尾相接）
+        ├── term_offsets.npy    # 每个词项在terms.bin中的偏移
+        ├── term_prefixes.npy   # 每个词项前8个字节组成的整数，用于批量二分查找
+        ├── idf.npy             # 每个词项的IDF值
+        ├── indptr.npy          # 倒排表偏移
+        ├── doc_ids.npy         # 倒排表中的文档编号
+        ├── weights.npy         # 倒排表中的归一化TF-IDF权重
+        ├── entry_ids.bin       # 每个文档对应的知识库条目ID（UTF-8编码，首尾相接）
+        ├── entry_id_offsets.npy  # 每个条目ID在entry_ids.bin中的偏移
+        ├── entry_id_order.npy  # 按字节序排列的条目ID下标，用于按ID二分查找文档编号
+        ├── entries.bin         # 知识库条目（每条一个UTF-8编码的JSON对象，首尾相接）
+        └── entry_offsets.npy   # 每个条目在entries.bin中的偏移
+
+数组文件使用numpy的.npy格式，加载时以只读方式内存映射，多个工作进程共享操作系统页缓存中的同一份数据。
+词表和条目ID以UTF-8字节数组加偏移数组存储，同样内存映射，不在工作进程中展开为Python对象。
+
+用法（在smart_customer_service目录下执行）:
+    python -m services.index_store
+    python -m services.index_store --kb-file ./knowledge_base.json --output ./kb_index --analyzer jieba
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+from typing import List, Dict, Any, Optional, Tuple, Union
+import numpy as np
+from services.retrieval_engine import InvertedIndex, StringTable
+
+# 项目目录
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 知识库文件路径，默认为项目目录下的knowledge_base.json
+KNOWLEDGE_BASE_FILE = os.getenv("KNOWLEDGE_BASE_FILE", os.path.join(PROJECT_DIR, "knowledge_base.json"))
+
+# 离线构建的知识库索引目录，默认为项目目录下的kb_index
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", os.path.join(PROJECT_DIR, "kb_index"))
+
+# 索引文件格式版本，格式不兼容的修改需要递增
+INDEX_FORMAT_VERSION = 2
+
+# 倒排索引数组文件（词表单独以字符串表存储）
+INDEX_ARRAYS = ("idf", "indptr", "doc_ids", "weights")
+
+def document_text(item: Dict[str, str]) -> str:
+    """返回知识库条目用于检索的文本，标题同样参与检索"""
+    return f"{item.get('title', '')}\n{item['content']}"
+
+def source_fingerprint(kb_file: str) -> Optional[Dict[str, int]]:
+    """
+    返回知识库文件的指纹（大小和修改时间），用于判断索引是否过期
+
+    参数:
+        kb_file: 知识库文件路径
+
+    返回:
+        Optional[Dict[str, int]]: 文件指纹，文件不存在时返回None
+    """
+    try:
+        stat = os.stat(kb_file)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+class MappedEntries:
+    """
+    内存映射的知识库条目序列
+
+    条目按需从entries.bin中解码，支持追加新条目（新条目只保存在内存中），
+    可以替代知识库服务中的条目列表使用。
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        """
+        初始化条目序列
+
+        参数:
+            blob: entries.bin的字节数组
+            offsets: 每个条目的起始偏移，长度为条目数量+1
+        """
+        self._blob = blob
+        self._offsets = offsets
+        self._mapped_count = len(offsets) - 1
+        self._appended: List[Dict[str, str]] = []
+
+    def __len__(self) -> int:
+        return self._mapped_count + len(self._appended)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, str], List[Dict[str, str]]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < self._mapped_count:
+            start, end = self._offsets[index], self._offsets[index + 1]
+            return json.loads(self._blob[start:end].tobytes())
+        return self._appended[index - self._mapped_count]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, entry: Dict[str, str]):
+        """追加新条目"""
+        self._appended.append(entry)
+
+class MappedIdMap:
+    """
+    知识库条目ID -> 文档编号的映射
+
+    离线构建的部分在内存映射的条目ID表中二分查找，在线新增、更新和删除的条目保存在内存中，
+    可以替代知识库服务中的ID字典使用（支持get、in、赋值和pop）。
+    """
+
+    def __init__(self, ids: StringTable, order: np.ndarray):
+        """
+        初始化映射
+
+        参数:
+            ids: 按文档编号排列的条目ID表
+            order: 按字节序排列的条目ID下标
+        """
+        self._ids = ids
+        self._order = order
+        # 在线变更：条目ID -> 文档编号，None表示已删除
+        self._overlay: Dict[str, Optional[int]] = {}
+
+    def get(self, entry_id: str, default: Optional[int] = None) -> Optional[int]:
+        if entry_id in self._overlay:
+            idx = self._overlay[entry_id]
+        else:
+            idx = self._ids.find(entry_id.encode("utf-8"), self._order)
+            idx = None if idx < 0 else idx
+        return default if idx is None else idx
+
+    def __contains__(self, entry_id: str) -> bool:
+        return self.get(entry_id) is not None
+
+    def __setitem__(self, entry_id: str, idx: int):
+        self._overlay[entry_id] = idx
+
+    def pop(self, entry_id: str) -> int:
+        idx = self.get(entry_id)
+        if idx is None:
+            raise KeyError(entry_id)
+        self._overlay[entry_id] = None
+        return idx
+
+def write_string_table(version_dir: str, name: str, offsets_name: str, table: StringTable, prefixes_name: Optional[str] = None):
+    """将字符串表写入name.bin和offsets_name.npy，指定prefixes_name时同时写入前缀数组"""
+    with open(os.path.join(version_dir, f"{name}.bin"), "wb") as f:
+        f.write(np.asarray(table.blob, dtype=np.uint8).tobytes())
+    np.save(os.path.join(version_dir, f"{offsets_name}.npy"), np.asarray(table.offsets, dtype=np.int64))
+    if prefixes_name is not None:
+        np.save(os.path.join(version_dir, f"{prefixes_name}.npy"), np.asarray(table.prefixes, dtype=np.uint64))
+
+def read_string_table(version_dir: str, name: str, offsets_name: str, prefixes_name: Optional[str] = None) -> StringTable:
+    """以内存映射方式读取字符串表，空表不映射（numpy无法映射空文件）"""
+    offsets = np.load(os.path.join(version_dir, f"{offsets_name}.npy"), mmap_mode="r")
+    blob_file = os.path.join(version_dir, f"{name}.bin")
+    blob = np.memmap(blob_file, dtype=np.uint8, mode="r") if os.path.getsize(blob_file) else np.zeros(0, dtype=np.uint8)
+    prefixes = np.load(os.path.join(version_dir, f"{prefixes_name}.npy"), mmap_mode="r") if prefixes_name is not None else None
+    return StringTable(blob, offsets, prefixes)
+
+def save_index(index_dir: str, index: InvertedIndex, entries: List[Dict[str, str]], source: Optional[Dict[str, int]] = None) -> str:
+    """
+    将倒排索引和知识库条目写入新的版本目录，并原子地更新CURRENT指向该版本
+
+    参数:
+        index_dir: 索引根目录
+        index: 倒排索引
+        entries: 知识库条目列表，下标与索引中的文档编号一致
+        source: 知识库文件指纹
+
+    返回:
+        str: 新版本目录路径
+    """
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    version_dir = os.path.join(index_dir, version)
+    os.makedirs(version_dir)
+
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(version_dir, f"{name}.npy"), getattr(index, name))
+    terms = index.terms if isinstance(index.terms, StringTable) else StringTable.from_strings(index.terms, sorted_table=True)
+    write_string_table(version_dir, "terms", "term_offsets", terms, "term_prefixes")
+
+    encoded = [json.dumps(entry, ensure_ascii=False).encode("utf-8") for entry in entries]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    with open(os.path.join(version_dir, "entries.bin"), "wb") as f:
+        for item in encoded:
+            f.write(item)
+    np.save(os.path.join(version_dir, "entry_offsets.npy"), offsets)
+    entry_ids = [entry["id"].encode("utf-8") for entry in entries]
+    write_string_table(version_dir, "entry_ids", "entry_id_offsets", StringTable.from_strings(entry["id"] for entry in entries))
+    np.save(os.path.join(version_dir, "entry_id_order.npy"), np.array(sorted(range(len(entry_ids)), key=entry_ids.__getitem__), dtype=np.int64))
+
+    manifest = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "analyzer": index.analyzer_name,
+        "n_docs": index.n_docs,
+        "n_terms": len(index.terms),
+        "source": source,
+        "created_at": time.time()
+    }
+    with open(os.path.join(version_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+    # 先写临时文件再替换，正在加载旧版本的进程不受影响
+    current_file = os.path.join(index_dir, "CURRENT")
+    with open(f"{current_file}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{current_file}.tmp", current_file)
+    return version_dir
+
+def load_index(index_dir: str, analyzer_name: Optional[str] = None, source: Optional[Dict[str, int]] = None) -> Optional[Tuple[InvertedIndex, MappedEntries, MappedIdMap]]:
+    """
+    以内存映射方式加载CURRENT指向的索引版本
+
+    参数:
+        index_dir: 索引根目录
+        analyzer_name: 期望的分词器名称，与索引不一致时不加载
+        source: 当前知识库文件指纹，与索引构建时不一致（索引已过期）时不加载
+
+    返回:
+        Optional[Tuple[InvertedIndex, MappedEntries, MappedIdMap]]: (倒排索引, 条目序列, 条目ID到文档编号的映射)，
+        索引不存在、格式不兼容或已过期时返回None
+    """
+    current_file = os.path.join(index_dir, "CURRENT")
+    if not os.path.exists(current_file):
+        return None
+    with open(current_file, "r", encoding="utf-8") as f:
+        version_dir = os.path.join(index_dir, f.read().strip())
+    with open(os.path.join(version_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+        print(f"知识库索引格式版本不兼容: {manifest.get('format_version')}")
+        return None
+    if analyzer_name is not None and manifest["analyzer"] != analyzer_name:
+        print(f"知识库索引的分词器({manifest['analyzer']})与配置({analyzer_name})不一致")
+        return None
+    if source is not None and manifest.get("source") != source:
+        print("知识库文件在索引构建后已修改，请重新构建索引")
+        return None
+
+    arrays = {name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode="r") for name in INDEX_ARRAYS}
+    terms = read_string_table(version_dir, "terms", "term_offsets", "term_prefixes")
+    index = InvertedIndex(terms=terms, n_docs=manifest["n_docs"], analyzer_name=manifest["analyzer"], **arrays)
+    blob = np.memmap(os.path.join(version_dir, "entries.bin"), dtype=np.uint8, mode="r") if manifest["n_docs"] else np.zeros(0, dtype=np.uint8)
+    entries = MappedEntries(blob, np.load(os.path.join(version_dir, "entry_offsets.npy"), mmap_mode="r"))
+    entry_ids = MappedIdMap(read_string_table(version_dir, "entry_ids", "entry_id_offsets"),
+                            np.load(os.path.join(version_dir, "entry_id_order.npy"), mmap_mode="r"))
+    return index, entries, entry_ids
+
+def prune_versions(index_dir: str, keep: int = 2):
+    """
+    删除旧的索引版本目录，保留最近的keep个版本（包括当前版本）
+
+    参数:
+        index_dir: 索引根目录
+        keep: 保留的版本数量
+    """
+    with open(os.path.join(index_dir, "CURRENT"), "r", encoding="utf-8") as f:
+        current = f.read().strip()
+    versions = sorted(name for name in os.listdir(index_dir) if os.path.isdir(os.path.join(index_dir, name)))
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+def build_index(kb_file: str, index_dir: str, analyzer_name: str = "char_ngram", keep: int = 2) -> Dict[str, Any]:
+    """
+    根据知识库文件离线构建索引
+
+    参数:
+        kb_file: 知识库文件路径
+        index_dir: 索引根目录
+        analyzer_name: 分词器名称
+        keep: 保留的版本数量
+
+    返回:
+        Dict[str, Any]: 构建结果统计
+    """
+    start = time.perf_counter()
+    with open(kb_file, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    source = source_fingerprint(kb_file)
+    index = InvertedIndex.build([document_text(item) for item in entries], analyzer_name=analyzer_name, max_df=0.8, min_df=1)
+    version_dir = save_index(index_dir, index, entries, source)
+    prune_versions(index_dir, keep)
+    return {
+        "version_dir": version_dir,
+        "n_docs": index.n_docs,
+        "n_terms": len(index.terms),
+        "elapsed_s": time.perf_counter() - start
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线构建知识库索引")
+    parser.add_argument("--kb-file", default=KNOWLEDGE_BASE_FILE, help="知识库文件路径")
+    parser.add_argument("--output", default=KB_INDEX_DIR, help="索引根目录")
+    parser.add_argument("--analyzer", default=os.getenv("KB_ANALYZER", "char_ngram"), help="分词器名称")
+    parser.add_argument("--keep", type=int, default=2, help="保留的索引版本数量")
+    args = parser.parse_args(argv)
+
+    result = build_index(args.kb_file, args.output, args.analyzer, args.keep)
+    print(f"索引已写入: {result['version_dir']}")
+    print(f"文档数量: {result['n_docs']}  词项数量: {result['n_terms']}  耗时: {result['elapsed_s']:.2f} s")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,53 @@
 import os
 import json
-from typing import List, Dict, Any, Optional
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import uuid
+import asyncio
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Union
+import numpy as np
+from services.retrieval_engine import InvertedIndex, IndexSnapshot
+from services.tracing import trace_span
+from services.index_store import KNOWLEDGE_BASE_FILE, KB_INDEX_DIR, document_text, source_fingerprint, load_index, save_index, prune_versions, MappedIdMap
 
 class KnowledgeBaseService:
-    """知识库服务类，用于管理和检索公司知识库"""
+    """
+    知识库服务类，用于管理和检索公司知识库
+    
+    检索始终读取当前的索引快照，不持有任何锁；增删改操作在写锁内追加到增量段或标记删除，
+    然后整体替换快照。增量段和删除标记累计达到阈值后在后台线程中合并重建索引。
+    """
     
     def __init__(self):
         """初始化知识库服务"""
-        # 加载知识库数据
-        self.knowledge_base = self._load_knowledge_base()
-        # 初始化向量izer和文档向量
-        self.vectorizer = None
-        self.document_vectors = None
-        self._prepare_knowledge_base()
+        # 分词器名称，默认使用字符n-gram，可配置为jieba等
+        self.analyzer_name = os.getenv("KB_ANALYZER", "char_ngram")
+        # 增量段文档数与已删除文档数之和达到该阈值时触发后台合并
+        self.compact_threshold = int(os.getenv("KB_COMPACT_THRESHOLD", "1000"))
+        # 是否将变更写回知识库文件，每个工作进程用自己的快照整体覆盖文件，只适用于单工作进程部署
+        self.persist_enabled = os.getenv("KB_PERSIST", "false").lower() in ("1", "true", "yes")
+        # 写入方状态，只在写锁内访问
+        self._write_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._entries: Sequence[Dict[str, str]] = []
+        self._id_to_doc: Union[Dict[str, int], MappedIdMap] = {}
+        self._base: Optional[InvertedIndex] = None
+        self._delta_vectors: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._delta_new_terms = 0
+        self._deleted = np.zeros(0, dtype=bool)
+        self._version = 0
+        # 合并重建期间发生的变更，重建完成后重放到新索引上
+        self._pending_ops: Optional[List[Tuple[str, Any]]] = None
+        self._compact_thread: Optional[threading.Thread] = None
+        # 后台写回知识库文件的状态
+        self._persist_lock = threading.Lock()
+        self._persist_dirty = False
+        self._persist_thread: Optional[threading.Thread] = None
+        # 当前索引快照，检索线程只读取该引用
+        self._snapshot: Optional[IndexSnapshot] = None
+        
+        # 优先以内存映射方式加载离线构建的索引，索引不存在或已过期时加载知识库数据并构建索引
+        if not self._load_prebuilt_index():
+            self._prepare_knowledge_base(self._load_knowledge_base())
         
     def _load_knowledge_base(self) -> List[Dict[str, str]]:
         """加载知识库数据，实际应用中可以从文件、数据库或API加载"""
@@ -44,7 +76,7 @@ class KnowledgeBaseService:
         ]
         
         # 检查是否存在知识库文件
-        kb_file = "d:\workTool\code\llm\smart_customer_service\knowledge_base.json"
+        kb_file = KNOWLEDGE_BASE_FILE
         if os.path.exists(kb_file):
             try:
                 with open(kb_file, 'r', encoding='utf-8') as f:
@@ -54,24 +86,72 @@ class KnowledgeBaseService:
         
         return knowledge_base
         
-    def _prepare_knowledge_base(self):
-        """准备知识库，构建文本向量用于相似度计算"""
-        if not self.knowledge_base:
-            return
-            
-        # 提取文档内容
-        documents = [item["content"] for item in self.knowledge_base]
+    def _prepare_knowledge_base(self, entries: List[Dict[str, str]]):
+        """准备知识库，构建TF-IDF倒排索引用于相似度计算"""
+        # 提取文档内容，标题同样参与检索
+        documents = [self._document_text(item) for item in entries]
+        
+        # 构建倒排索引
+        base = InvertedIndex.build(documents, analyzer_name=self.analyzer_name, max_df=0.8, min_df=1)
+        
+        with self._write_lock:
+            self._reset_state(entries, base)
+            self._publish()
+        
+    def _load_prebuilt_index(self) -> bool:
+        """
+        加载离线构建的索引（python -m services.index_store），多个工作进程共享同一份页缓存
+        
+        返回:
+            bool: 是否加载成功
+        """
+        if not KB_INDEX_DIR or not os.path.isdir(KB_INDEX_DIR):
+            return False
+        try:
+            loaded = load_index(KB_INDEX_DIR, self.analyzer_name, source_fingerprint(KNOWLEDGE_BASE_FILE))
+        except Exception as e:
+            print(f"加载知识库索引失败: {e}")
+            return False
+        if loaded is None:
+            return False
+        base, entries, id_to_doc = loaded
+        with self._write_lock:
+            self._reset_state(entries, base, id_to_doc)
+            self._publish()
+        return True
         
-        # 初始化TF-IDF向量izer
-        self.vectorizer = TfidfVectorizer(
-            token_pattern=r'(?u)\b\w+\b',
-            stop_words=None,  # 中文可以考虑使用自定义停用词表
-            max_df=0.8,
-            min_df=1
-        )
+    @staticmethod
+    def _document_text(item: Dict[str, str]) -> str:
+        """返回知识库条目用于检索的文本"""
+        return document_text(item)
         
-        # 计算文档向量
-        self.document_vectors = self.vectorizer.fit_transform(documents)
+    def _reset_state(self, entries: Sequence[Dict[str, str]], base: InvertedIndex, id_to_doc: Optional[MappedIdMap] = None):
+        """以新的基础索引重置写入方状态（需持有写锁），id_to_doc为离线索引中内存映射的ID映射"""
+        self._entries = entries
+        if id_to_doc is None:
+            self._id_to_doc = {item["id"]: idx for idx, item in enumerate(entries)}
+        else:
+            self._id_to_doc = id_to_doc
+        self._base = base
+        self._delta_vectors = []
+        self._delta_new_terms = 0
+        self._deleted = np.zeros(len(self._entries), dtype=bool)
+        
+    def _publish(self):
+        """根据写入方状态构建新快照并整体替换（需持有写锁）"""
+        delta = InvertedIndex.from_vectors(self._delta_vectors, self._base.terms, self._base.idf, self.analyzer_name)
+        self._version += 1
+        self._snapshot = IndexSnapshot(self._entries, self._base, delta, self._deleted, self._version)
+        
+    @property
+    def knowledge_base(self) -> List[Dict[str, str]]:
+        """当前有效的知识库条目列表"""
+        return self._valid_entries(self._snapshot)
+        
+    @staticmethod
+    def _valid_entries(snapshot: IndexSnapshot) -> List[Dict[str, str]]:
+        """快照中有效（未删除）的条目"""
+        return [item for idx, item in enumerate(snapshot.entries[:snapshot.n_docs]) if not snapshot.deleted[idx]]
         
     def search_knowledge_base(self, query: str, top_k: int = 3) -> List[Dict[str, str]]:
         """
@@ -84,31 +164,290 @@ class KnowledgeBaseService:
         返回:
             List[Dict[str, str]]: 检索到的相关知识库条目
         """
-        if not self.knowledge_base or self.document_vectors is None:
-            return []
-            
-        # 将查询转换为向量
-        query_vector = self.vectorizer.transform([query])
+        # 读取当前快照，检索过程中不受并发更新影响
+        return self._search_snapshot(self._snapshot, query, top_k)
         
-        # 计算相似度
-        similarities = cosine_similarity(query_vector, self.document_vectors).flatten()
+    def search_knowledge_base_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, str]]]:
+        """
+        批量检索知识库，整批查询使用同一个索引快照，不同的查询组成一个查询矩阵，与倒排表做一次稀疏矩阵乘法
         
-        # 获取最相似的top_k个文档索引
-        top_indices = similarities.argsort()[-top_k:][::-1]
+        参数:
+            queries: 用户查询列表
+            top_k: 每个查询返回的最相关文档数量
         
+        返回:
+            List[List[Dict[str, str]]]: 与queries一一对应的检索结果
+        """
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.n_docs:
+            return [[] for _ in queries]
+        # 相同的查询只检索一次
+        unique_queries = list(dict.fromkeys(queries))
+        top_documents = snapshot.search_batch(unique_queries, top_k=top_k, min_score=0.1)
+        results = {query: self._to_results(snapshot, documents) for query, documents in zip(unique_queries, top_documents)}
+        return [results[query] for query in queries]
+        
+    @staticmethod
+    def _search_snapshot(snapshot: Optional[IndexSnapshot], query: str, top_k: int) -> List[Dict[str, str]]:
+        """在指定快照中检索"""
+        if snapshot is None or not snapshot.n_docs:
+            return []
+            
+        # 只对包含查询词项的候选文档打分，并选取相似度最高的top_k个文档
+        # 设置阈值，只返回相似度足够高的结果
+        top_documents = snapshot.search(query, top_k=top_k, min_score=0.1)
+        return KnowledgeBaseService._to_results(snapshot, top_documents)
+
+    @staticmethod
+    def _to_results(snapshot: IndexSnapshot, top_documents: List[Tuple[int, float]]) -> List[Dict[str, str]]:
+        """将(文档编号, 相似度)列表转换为检索结果"""
         # 返回最相关的文档
         results = []
-        for idx in top_indices:
-            if similarities[idx] > 0.1:  # 设置阈值，只返回相似度足够高的结果
-                results.append({
-                    "id": self.knowledge_base[idx]["id"],
-                    "title": self.knowledge_base[idx]["title"],
-                    "content": self.knowledge_base[idx]["content"],
-                    "similarity": float(similarities[idx])
-                })
+        for idx, similarity in top_documents:
+            item = snapshot.entries[idx]
+            results.append({
+                "id": item["id"],
+                "title": item["title"],
+                "content": item["content"],
+                "similarity": similarity
+            })
         
         return results
         
+    def get_entry(self, entry_id: str) -> Optional[Dict[str, str]]:
+        """
+        获取知识库条目
+        
+        参数:
+            entry_id: 条目ID
+        
+        返回:
+            Optional[Dict[str, str]]: 知识库条目，不存在时返回None
+        """
+        idx = self._id_to_doc.get(entry_id)
+        return None if idx is None else self._entries[idx]
+        
+    def add_entry(self, entry: Dict[str, str]) -> Dict[str, str]:
+        """
+        新增知识库条目，条目追加到增量索引段，立即可被检索
+        
+        参数:
+            entry: 知识库条目，包含title和content，id可选（不提供时自动生成）
+        
+        返回:
+            Dict[str, str]: 新增的条目
+        """
+        entry = {"id": entry.get("id") or f"kb{uuid.uuid4().hex[:12]}", "title": entry.get("title", ""), "content": entry["content"]}
+        with self._write_lock:
+            if entry["id"] in self._id_to_doc:
+                raise ValueError(f"知识库条目已存在: {entry['id']}")
+            self._apply("upsert", entry)
+        self._after_write()
+        return entry
+        
+    def update_entry(self, entry_id: str, title: Optional[str] = None, content: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """
+        更新知识库条目，旧条目标记删除，新内容追加到增量索引段
+        
+        参数:
+            entry_id: 条目ID
+            title: 新标题，None表示不修改
+            content: 新内容，None表示不修改
+        
+        返回:
+            Optional[Dict[str, str]]: 更新后的条目，条目不存在时返回None
+        """
+        with self._write_lock:
+            idx = self._id_to_doc.get(entry_id)
+            if idx is None:
+                return None
+            current = self._entries[idx]
+            entry = {
+                "id": entry_id,
+                "title": current["title"] if title is None else title,
+                "content": current["content"] if content is None else content
+            }
+            self._apply("upsert", entry)
+        self._after_write()
+        return entry
+        
+    def delete_entry(self, entry_id: str) -> bool:
+        """
+        删除知识库条目，条目被标记删除，下次合并时从索引中移除
+        
+        参数:
+            entry_id: 条目ID
+        
+        返回:
+            bool: 删除是否成功
+        """
+        with self._write_lock:
+            if entry_id not in self._id_to_doc:
+                return False
+            self._apply("delete", entry_id)
+        self._after_write()
+        return True
+        
+    def _apply(self, op: str, value: Any, publish: bool = True):
+        """执行一次变更（需持有写锁），合并重建期间同时记录变更以便重放"""
+        if op == "upsert":
+            old_idx = self._id_to_doc.get(value["id"])
+            deleted = np.append(self._deleted, False)
+            if old_idx is not None:
+                deleted[old_idx] = True
+            self._id_to_doc[value["id"]] = len(self._entries)
+            self._entries.append(value)
+            text = self._document_text(value)
+            term_ids, weights = self._base.vectorize(text)
+            self._delta_vectors.append((term_ids, weights))
+            # 统计基础段词表中不存在的词项，这些词项在合并重建之前无法被检索到
+            self._delta_new_terms += len(set(self._base.analyzer(text))) - term_ids.size
+            self._deleted = deleted
+        elif op == "delete":
+            deleted = self._deleted.copy()
+            deleted[self._id_to_doc.pop(value)] = True
+            self._deleted = deleted
+        if self._pending_ops is not None:
+            self._pending_ops.append((op, value))
+        if publish:
+            self._publish()
+            
+    def _after_write(self):
+        """变更完成后的处理：达到阈值时触发后台合并，并写回知识库文件"""
+        snapshot = self._snapshot
+        if snapshot.delta.n_docs + snapshot.n_deleted >= self.compact_threshold:
+            self.compact_in_background()
+        elif self._delta_new_terms and snapshot.base.n_docs < self.compact_threshold:
+            # 知识库规模较小时重建代价很低，出现新词项就立即合并，使新词项尽快可被检索
+            self.compact_in_background()
+        self._schedule_persist()
+        
+    def compact(self):
+        """
+        合并重建索引：用全部有效条目重新计算词表和IDF，清空增量段和删除标记
+        
+        重建过程中不持有写锁，检索和写入不受影响，重建期间的变更在替换前重放到新索引上。
+        """
+        with self._compact_lock:
+            with self._write_lock:
+                entries = self.knowledge_base
+                self._pending_ops = []
+            try:
+                base = InvertedIndex.build([self._document_text(item) for item in entries], analyzer_name=self.analyzer_name, max_df=0.8, min_df=1)
+            except Exception:
+                with self._write_lock:
+                    self._pending_ops = None
+                raise
+            with self._write_lock:
+                pending_ops, self._pending_ops = self._pending_ops, None
+                self._reset_state(entries, base)
+                for op, value in pending_ops:
+                    self._apply(op, value, publish=False)
+                self._publish()
+                
+    def compact_in_background(self) -> bool:
+        """
+        在后台线程中合并重建索引
+        
+        返回:
+            bool: 是否启动了新的合并任务（已有合并任务在运行时返回False）
+        """
+        with self._write_lock:
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                return False
+            self._compact_thread = threading.Thread(target=self._run_compact, name="kb-compact", daemon=True)
+            self._compact_thread.start()
+        return True
+        
+    def _run_compact(self):
+        """后台合并任务"""
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"知识库索引合并失败: {str(e)}")
+            
+    def _schedule_persist(self):
+        """安排在后台将知识库写回文件，连续的多次变更合并为一次写入"""
+        if not self.persist_enabled:
+            return
+        with self._persist_lock:
+            self._persist_dirty = True
+            if self._persist_thread is not None and self._persist_thread.is_alive():
+                return
+            self._persist_thread = threading.Thread(target=self._run_persist, name="kb-persist", daemon=True)
+            self._persist_thread.start()
+            
+    def _run_persist(self):
+        """后台写回任务"""
+        while True:
+            with self._persist_lock:
+                if not self._persist_dirty:
+                    return
+                self._persist_dirty = False
+            snapshot = self._snapshot
+            entries = self._valid_entries(snapshot)
+            if self.save_knowledge_base(entries=entries):
+                self.save_prebuilt_index(snapshot, entries)
+            
+    def save_knowledge_base(self, kb_file: Optional[str] = None, entries: Optional[List[Dict[str, str]]] = None) -> bool:
+        """
+        将当前知识库条目写回文件（先写临时文件再替换，避免写入中途损坏）
+        
+        参数:
+            kb_file: 文件路径，默认为KNOWLEDGE_BASE_FILE
+            entries: 要写入的条目，默认为当前有效的知识库条目
+        
+        返回:
+            bool: 是否写入成功
+        """
+        kb_file = kb_file or KNOWLEDGE_BASE_FILE
+        temp_file = f"{kb_file}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.knowledge_base if entries is None else entries, f, ensure_ascii=False, indent=4)
+            os.replace(temp_file, kb_file)
+            return True
+        except Exception as e:
+            print(f"保存知识库文件失败: {e}")
+            return False
+            
+    def save_prebuilt_index(self, snapshot: IndexSnapshot, entries: List[Dict[str, str]]):
+        """
+        知识库文件写回后重新生成离线索引并更新CURRENT，使索引的文件指纹与写回的文件一致，
+        之后启动的工作进程仍可直接以内存映射方式加载，不会因索引过期而重新构建
+        
+        只在索引目录已存在（部署使用离线索引）时执行。快照没有增量段和删除标记时直接保存基础段，否则用entries重建。
+        
+        参数:
+            snapshot: 写回文件时的索引快照
+            entries: 写回文件的条目，与snapshot中的有效条目一致
+        """
+        if not KB_INDEX_DIR or not os.path.isdir(KB_INDEX_DIR):
+            return
+        try:
+            if snapshot.delta.n_docs == 0 and snapshot.n_deleted == 0:
+                base = snapshot.base
+            else:
+                base = InvertedIndex.build([self._document_text(item) for item in entries], analyzer_name=self.analyzer_name, max_df=0.8, min_df=1)
+            save_index(KB_INDEX_DIR, base, entries, source_fingerprint(KNOWLEDGE_BASE_FILE))
+            prune_versions(KB_INDEX_DIR)
+        except Exception as e:
+            print(f"保存知识库索引失败: {e}")
+            
+    def stats(self) -> Dict[str, Any]:
+        """返回知识库索引统计信息"""
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "entries": snapshot.n_docs - snapshot.n_deleted,
+            "base_documents": snapshot.base.n_docs,
+            "delta_documents": snapshot.delta.n_docs,
+            "deleted_documents": snapshot.n_deleted,
+            "terms": len(snapshot.base.terms),
+            "compact_threshold": self.compact_threshold,
+            "compacting": self._compact_thread is not None and self._compact_thread.is_alive()
+        }
+        
     def add_knowledge_to_query(self, query: str, knowledge: List[Dict[str, str]]) -> str:
         """
         将知识库内容添加到用户查询中
@@ -131,17 +470,46 @@ class KnowledgeBaseService:
         
         return new_query
 
-# 创建全局的知识库服务实例
-knowledge_base_service = KnowledgeBaseService()
+# 全局的知识库服务实例，首次使用时创建（构建索引耗时较长，可由启动预热在后台完成）
+_knowledge_base_service: Optional[KnowledgeBaseService] = None
+_knowledge_base_service_lock = threading.Lock()
+
+def get_knowledge_base_service() -> KnowledgeBaseService:
+    """获取全局的知识库服务实例，首次调用时加载知识库并构建索引"""
+    global _knowledge_base_service
+    if _knowledge_base_service is None:
+        with _knowledge_base_service_lock:
+            if _knowledge_base_service is None:
+                _knowledge_base_service = KnowledgeBaseService()
+    return _knowledge_base_service
 
 # 提供便捷的函数
 def search_knowledge(query: str, top_k: int = 3) -> List[Dict[str, str]]:
     """便捷函数，从知识库中检索相关信息"""
-    return knowledge_base_service.search_knowledge_base(query, top_k)
+    return get_knowledge_base_service().search_knowledge_base(query, top_k)
     
 def attach_knowledge_to_query(query: str, top_k: int = 3) -> str:
     """便捷函数，为用户查询附加知识库内容"""
+    knowledge_base_service = get_knowledge_base_service()
     # 从知识库中检索相关信息
-    knowledge = knowledge_base_service.search_knowledge_base(query, top_k)
+    with trace_span("kb.search", top_k=top_k):
+        knowledge = knowledge_base_service.search_knowledge_base(query, top_k)
     # 将知识库内容添加到查询中
-    return knowledge_base_service.add_knowledge_to_query(query, knowledge)
\ No newline at end of file
+    with trace_span("kb.format", hits=len(knowledge)):
+        return knowledge_base_service.add_knowledge_to_query(query, knowledge)
+
+async def attach_knowledge_to_query_async(query: str, top_k: int = 3) -> str:
+    """异步便捷函数，在线程池中检索知识库，不阻塞事件循环"""
+    return await asyncio.to_thread(attach_knowledge_to_query, query, top_k)
+
+def attach_knowledge_to_queries(queries: List[str], top_k: int = 3) -> List[str]:
+    """便捷函数，为一批用户查询附加知识库内容"""
+    knowledge_base_service = get_knowledge_base_service()
+    with trace_span("kb.search_batch", queries=len(queries), top_k=top_k):
+        knowledge = knowledge_base_service.search_knowledge_base_batch(queries, top_k)
+    with trace_span("kb.format", hits=sum(len(items) for items in knowledge)):
+        return [knowledge_base_service.add_knowledge_to_query(query, items) for query, items in zip(queries, knowledge)]
+
+async def attach_knowledge_to_queries_async(queries: List[str], top_k: int = 3) -> List[str]:
+    """异步便捷函数，在线程池中一次检索整批查询"""
+    return await asyncio.to_thread(attach_knowledge_to_queries, queries, top_k)
@@ -0,0 +1,270 @@
+import os
+import json
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable, AsyncIterator
+from services.upstream_pool import resolve_upstream_model
+
+# 优先级（数值越小越优先）
+PRIORITY_VIP = 0
+PRIORITY_STREAM = 1
+PRIORITY_NORMAL = 2
+PRIORITY_BATCH = 3
+
+PRIORITY_NAMES = {PRIORITY_VIP: "vip", PRIORITY_STREAM: "stream", PRIORITY_NORMAL: "normal", PRIORITY_BATCH: "batch"}
+
+# VIP用户ID（逗号分隔）
+LLM_VIP_USERS = {user_id.strip() for user_id in os.getenv("LLM_VIP_USERS", "").split(",") if user_id.strip()}
+
+class SchedulerRejected(Exception):
+    """大模型调度器拒绝请求（等待队列已满或排队超时）"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        """
+        参数:
+            message: 错误信息
+            status_code: HTTP状态码，队列已满为429，排队超时为503
+            retry_after: 建议客户端重试前等待的秒数
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class _Lane:
+    """单个模型的并发槽位和等待队列"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        # (优先级, 序号, future)组成的最小堆
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        # 大模型调用耗时的指数移动平均（秒），用于估算Retry-After
+        self.service_time = 5.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.evicted = 0
+
+class LLMScheduler:
+    """
+    大模型并发调度器
+
+    每个模型有独立的并发上限（请求中的模型名称先解析为配置的模型名称，未配置的模型与默认模型共用同一个并发上限），槽位用完后请求进入有界的优先级等待队列（VIP用户、流式请求、普通请求、批量请求依次优先），
+    同一优先级先到先服务。队列已满时，优先级更高的请求挤掉队列中优先级最低的请求，
+    否则立即以429拒绝；排队超过LLM_QUEUE_TIMEOUT秒以503拒绝。拒绝时根据排队长度和平均调用耗时给出Retry-After。
+    """
+
+    def __init__(self, default_concurrency: Optional[int] = None, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None, limits: Optional[Dict[str, int]] = None,
+                 resolve_model: Optional[Callable[[str], str]] = None):
+        """
+        初始化大模型调度器
+
+        参数:
+            default_concurrency: 未单独配置的模型的并发上限
+            max_queue: 每个模型的等待队列长度上限
+            queue_timeout: 最长排队时间（秒）
+            limits: 模型名称 -> 并发上限
+            resolve_model: 将请求中的模型名称解析为配置的模型名称的函数，默认使用上游连接池的配置
+        """
+        self.enabled = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.default_concurrency = default_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("LLM_QUEUE_SIZE", "100"))
+        self.queue_timeout = queue_timeout or float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+        self.limits = limits if limits is not None else json.loads(os.getenv("LLM_CONCURRENCY_LIMITS", "{}"))
+        self.resolve_model = resolve_model or resolve_upstream_model
+        self._lanes: Dict[str, _Lane] = {}
+        self._sequence = itertools.count()
+
+    def _lane(self, model: str) -> _Lane:
+        """返回模型的调度通道，首次使用时创建，通道按解析后的模型名称划分，数量不超过配置的模型数量"""
+        model = self.resolve_model(model)
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(int(self.limits.get(model, self.default_concurrency)))
+        return lane
+
+    def _retry_after(self, lane: _Lane) -> int:
+        """估算排队的请求全部完成所需的秒数"""
+        return max(1, math.ceil(lane.service_time * (len(lane.waiters) + 1) / lane.capacity))
+
+    def _make_room(self, lane: _Lane, model: str, priority: int) -> bool:
+        """
+        队列已满时尝试挤掉优先级最低的等待者
+
+        返回:
+            bool: 队列有空位（或已挤出空位）时返回True
+        """
+        if len(lane.waiters) < self.max_queue:
+            return True
+        if not lane.waiters:
+            return False
+        worst = max(lane.waiters)
+        if worst[0] <= priority:
+            return False
+        lane.waiters.remove(worst)
+        heapq.heapify(lane.waiters)
+        lane.evicted += 1
+        worst[2].set_exception(SchedulerRejected(f"模型{model}的请求过多，请稍后再试", 429, self._retry_after(lane)))
+        return True
+
+    def check_admission(self, model: str, priority: int = PRIORITY_NORMAL):
+        """
+        快速检查请求能否进入调度（不占用槽位），在处理请求之前尽早拒绝
+
+        异常:
+            SchedulerRejected: 没有空闲槽位且队列中没有比该请求优先级更低的等待者
+        """
+        if not self.enabled:
+            return
+        lane = self._lane(model)
+        if lane.active < lane.capacity or len(lane.waiters) < self.max_queue:
+            return
+        if lane.waiters and max(lane.waiters)[0] > priority:
+            return
+        lane.rejected_full += 1
+        raise SchedulerRejected(f"模型{model}的请求过多，请稍后再试", 429, self._retry_after(lane))
+
+    async def acquire(self, model: str, priority: int = PRIORITY_NORMAL):
+        """
+        获取模型的并发槽位，没有空闲槽位时排队等待
+
+        参数:
+            model: 模型名称
+            priority: 优先级
+
+        异常:
+            SchedulerRejected: 队列已满（429）或排队超时（503）
+        """
+        lane = self._lane(model)
+        if lane.active < lane.capacity and not lane.waiters:
+            lane.active += 1
+            lane.admitted += 1
+            return
+        if not self._make_room(lane, model, priority):
+            lane.rejected_full += 1
+            raise SchedulerRejected(f"模型{model}的请求过多，请稍后再试", 429, self._retry_after(lane))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(lane.waiters, entry)
+        lane.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 已经分配到槽位，但等待者被取消，把槽位交给下一个等待者
+                self.release(model)
+            else:
+                if entry in lane.waiters:
+                    lane.waiters.remove(entry)
+                    heapq.heapify(lane.waiters)
+                if not future.done():
+                    future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                lane.rejected_timeout += 1
+                raise SchedulerRejected(f"模型{model}排队超时，请稍后再试", 503, self._retry_after(lane)) from None
+            raise
+        lane.admitted += 1
+
+    def release(self, model: str, service_time: Optional[float] = None):
+        """
+        释放模型的并发槽位，有等待者时按优先级交给下一个等待者
+
+        参数:
+            model: 模型名称
+            service_time: 本次大模型调用耗时（秒），用于估算Retry-After
+        """
+        lane = self._lane(model)
+        if service_time is not None:
+            lane.service_time = lane.service_time * 0.9 + service_time * 0.1
+        lane.active -= 1
+        while lane.waiters and lane.active < lane.capacity:
+            _, _, future = heapq.heappop(lane.waiters)
+            if future.done():
+                continue
+            future.set_result(True)
+            lane.active += 1
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = PRIORITY_NORMAL) -> AsyncIterator[None]:
+        """
+        在并发槽位内执行大模型调用
+
+        用法:
+            async with llm_scheduler.slot(model, priority):
+                response = await ...
+        """
+        if not self.enabled:
+            yield
+            return
+        await self.acquire(model, priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(model, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回调度器统计信息"""
+        models = {}
+        for model, lane in self._lanes.items():
+            queued_by_priority: Dict[str, int] = {}
+            for priority, _, future in lane.waiters:
+                if not future.done():
+                    name = PRIORITY_NAMES.get(priority, str(priority))
+                    queued_by_priority[name] = queued_by_priority.get(name, 0) + 1
+            models[model] = {
+                "capacity": lane.capacity,
+                "active": lane.active,
+                "waiting": sum(queued_by_priority.values()),
+                "waiting_by_priority": queued_by_priority,
+                "admitted": lane.admitted,
+                "queued": lane.queued,
+                "rejected_full": lane.rejected_full,
+                "rejected_timeout": lane.rejected_timeout,
+                "evicted": lane.evicted,
+                "avg_service_s": lane.service_time
+            }
+        return {
+            "enabled": self.enabled,
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout,
+            "models": models
+        }
+
+def get_request_priority(user_id: str, stream: bool = False, batch: bool = False) -> int:
+    """
+    返回请求的优先级
+
+    参数:
+        user_id: 用户ID，LLM_VIP_USERS中的用户优先级最高
+        stream: 是否为流式请求（用户正在等待首个片段，优先于普通请求）
+        batch: 是否为批量请求（优先级最低）
+    """
+    if user_id in LLM_VIP_USERS:
+        return PRIORITY_VIP
+    if batch:
+        return PRIORITY_BATCH
+    return PRIORITY_STREAM if stream else PRIORITY_NORMAL
+
+# 创建全局的大模型调度器实例
+llm_scheduler = LLMScheduler()
+
+# 提供便捷的函数
+def llm_slot(model: str, priority: int = PRIORITY_NORMAL):
+    """便捷函数，在并发槽位内执行大模型调用"""
+    return llm_scheduler.slot(model, priority)
+
+def check_llm_admission(model: str, priority: int = PRIORITY_NORMAL):
+    """便捷函数，快速检查请求能否进入调度"""
+    llm_scheduler.check_admission(model, priority)
+
+def get_scheduler_stats() -> Dict[str, Any]:
+    """便捷函数，获取调度器统计信息"""
+    return llm_scheduler.stats()
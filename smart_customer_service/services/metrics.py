@@ -0,0 +1,252 @@
+import time
+import bisect
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable
+from services.tracing import trace_span
+
+# 延迟直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 每秒生成token数的分桶
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    """格式化标签，如{stage="upstream",le="0.5"}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    """转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value: float) -> str:
+    """格式化样本值"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """指标基类"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        """返回Prometheus文本格式的指标行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        """增加计数，labels按labelnames的顺序给出标签值"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+
+class Gauge(_Metric):
+    """可增可减的仪表，也可以在采集时通过回调函数获取当前值"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        """
+        参数:
+            callback: 采集时调用的函数，返回标签值元组 -> 当前值，提供时不使用inc/dec/set记录的值
+        """
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self) -> List[str]:
+        if self._callback is not None:
+            try:
+                values = list(self._callback().items())
+            except Exception as e:
+                print(f"采集指标{self.name}失败: {str(e)}")
+                values = []
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+
+class Histogram(_Metric):
+    """分桶直方图，记录时只做一次二分查找和两次加法"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值元组 -> [各分桶计数（不累计，最后一项为+Inf）, 总和]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str):
+        """记录一个样本，labels按labelnames的顺序给出标签值"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(entry[0]), entry[1]) for labels, entry in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', _format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """指标注册表，按Prometheus文本格式输出所有指标"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        """注册指标"""
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """返回Prometheus文本格式（version 0.0.4）的全部指标"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# 创建全局的指标注册表
+registry = MetricsRegistry()
+
+# 聊天请求处理各阶段耗时
+STAGE_DURATION = registry.histogram("chat_stage_duration_seconds", "聊天请求处理各阶段的耗时", ["stage"])
+REQUEST_DURATION = registry.histogram("chat_request_duration_seconds", "聊天接口的总耗时", ["endpoint"])
+REQUESTS_IN_FLIGHT = registry.gauge("chat_requests_in_flight", "正在处理的聊天请求数", ["endpoint"])
+
+# 大模型调用
+UPSTREAM_TTFT = registry.histogram("llm_time_to_first_token_seconds", "流式响应从调用大模型到收到首个片段的耗时", ["model"])
+UPSTREAM_TOKENS_PER_SECOND = registry.histogram("llm_stream_tokens_per_second", "流式响应首个片段之后的生成速度（估算的token数/秒）", ["model"], TOKENS_PER_SECOND_BUCKETS)
+USAGE_TOKENS = registry.counter("llm_usage_tokens_total", "大模型返回的token用量", ["model", "type"])
+RESPONSES = registry.counter("chat_responses_total", "聊天响应的来源（upstream为调用大模型，cache为命中响应缓存，coalesced为合并到进行中的请求）", ["source"])
+ERRORS = registry.counter("chat_errors_total", "聊天请求处理错误数", ["stage"])
+
+def _scheduler_depths() -> Dict[Tuple[str, ...], float]:
+    from services.llm_scheduler import llm_scheduler
+    values = {}
+    for model, lane in llm_scheduler.stats()["models"].items():
+        values[(model, "active")] = lane["active"]
+        values[(model, "waiting")] = lane["waiting"]
+    return values
+
+def _upstream_outstanding() -> Dict[Tuple[str, ...], float]:
+    from services.upstream_pool import upstream_pool
+    return {(upstream.name,): upstream.outstanding for upstreams in upstream_pool.upstreams.values() for upstream in upstreams}
+
+def _history_queue_depth() -> Dict[Tuple[str, ...], float]:
+    from services.history_writer import history_writer
+    return {(): history_writer.queue_size()}
+
+# 队列深度在采集时读取，不增加请求处理的开销
+registry.gauge("llm_scheduler_slots", "大模型调度器的占用槽位数和排队请求数", ["model", "state"], callback=_scheduler_depths)
+registry.gauge("llm_upstream_outstanding_requests", "各上游未完成的请求数", ["upstream"], callback=_upstream_outstanding)
+registry.gauge("history_writer_queue_depth", "等待写入数据库的聊天历史记录数", callback=_history_queue_depth)
+
+class StageTimer:
+    """
+    阶段计时器，退出时把耗时记录到chat_stage_duration_seconds，当前请求被追踪时同时记录为追踪时间段
+
+    用法:
+        with stage_timer("sensitive_filter"):
+            ...
+    """
+
+    __slots__ = ("stage", "start", "span")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.span = trace_span(stage)
+
+    def __enter__(self):
+        self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_DURATION.observe(time.perf_counter() - self.start, self.stage)
+        self.span.__exit__(exc_type, exc, tb)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            ERRORS.inc(1, self.stage)
+        return False
+
+# 提供便捷的函数
+def stage_timer(stage: str) -> StageTimer:
+    """便捷函数，创建阶段计时器"""
+    return StageTimer(stage)
+
+def observe_stage(stage: str, elapsed: float):
+    """便捷函数，记录阶段耗时"""
+    STAGE_DURATION.observe(elapsed, stage)
+
+def record_usage(model: str, usage: Optional[Dict[str, int]]):
+    """便捷函数，记录大模型返回的token用量"""
+    if not usage:
+        return
+    for name in ("prompt_tokens", "completion_tokens"):
+        if usage.get(name):
+            USAGE_TOKENS.inc(usage[name], model, name.split("_")[0])
+
+def render_metrics() -> str:
+    """便捷函数，返回Prometheus文本格式的全部指标"""
+    return registry.render()
@@ -0,0 +1,239 @@
+import os
+import asyncio
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable, AsyncIterator, AsyncGenerator
+
+async def close_source(source: AsyncIterator[str]):
+    """关闭上游文本片段的异步生成器，使其释放连接和大模型并发名额"""
+    aclose = getattr(source, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception as e:
+            print(f"关闭上游流失败: {str(e)}")
+
+async def passthrough_stream(source: AsyncIterator[str], on_complete: Optional[Callable[[str], Awaitable[Any]]] = None) -> AsyncGenerator[str, None]:
+    """
+    不合并时直接读取上游流，客户端断开时随之关闭上游
+
+    参数:
+        source: 上游文本片段的异步迭代器
+        on_complete: 上游正常结束后以完整文本调用的回调
+    """
+    chunks = []
+    try:
+        async for delta in source:
+            chunks.append(delta)
+            yield delta
+    finally:
+        await close_source(source)
+    if on_complete is not None:
+        try:
+            await on_complete("".join(chunks))
+        except Exception as e:
+            print(f"流式响应完成回调失败: {str(e)}")
+
+class StreamBroadcast:
+    """
+    将一个上游流式响应广播给多个订阅者
+
+    后台任务读取上游的文本片段并保存，订阅者从第一个片段开始依次读取，
+    中途加入的订阅者先补齐已收到的片段再继续等待新片段。还有其他订阅者时单个订阅者断开不影响上游读取，
+    最后一个订阅者在上游结束前断开时取消上游读取，释放大模型并发名额。
+    """
+
+    def __init__(self, source: AsyncIterator[str], on_complete: Optional[Callable[[str], Awaitable[Any]]] = None):
+        """
+        初始化广播并开始读取上游
+
+        参数:
+            source: 上游文本片段的异步迭代器
+            on_complete: 上游正常结束后以完整文本调用的回调（如写入响应缓存），只调用一次
+        """
+        self._chunks: List[str] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.subscriber_count = 0
+        self.cancelled = False
+        self.task = asyncio.ensure_future(self._pump(source, on_complete))
+
+    def _notify(self):
+        """唤醒等待新片段的订阅者"""
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _pump(self, source: AsyncIterator[str], on_complete: Optional[Callable[[str], Awaitable[Any]]]):
+        """读取上游片段"""
+        try:
+            async for delta in source:
+                self._chunks.append(delta)
+                self._notify()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+            await close_source(source)
+        if self._error is None and on_complete is not None:
+            try:
+                await on_complete("".join(self._chunks))
+            except Exception as e:
+                print(f"流式响应完成回调失败: {str(e)}")
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """
+        订阅上游文本片段
+
+        返回:
+            AsyncGenerator[str, None]: 从第一个片段开始的文本片段，上游出错时抛出相同的异常
+        """
+        self.subscriber_count += 1
+        position = 0
+        try:
+            while True:
+                # 先取得事件再检查片段数量，避免错过检查之后到达的片段
+                changed = self._changed
+                while position < len(self._chunks):
+                    yield self._chunks[position]
+                    position += 1
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                await changed.wait()
+        finally:
+            self.subscriber_count -= 1
+            if self.subscriber_count == 0 and not self._done:
+                # 没有订阅者了，取消上游读取
+                self.cancelled = True
+                self.task.cancel()
+
+class RequestCoalescer:
+    """
+    相同请求合并（singleflight）
+
+    以最终发送给大模型的消息和模型参数（与响应缓存相同的键）标识请求，
+    并发的相同非流式请求共享同一次上游调用，并发的相同流式请求共享同一个上游流。
+    上游调用在独立的任务中执行，发起请求的客户端断开不会影响其他等待者；所有等待者都断开时取消上游调用。
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        """
+        初始化请求合并器
+
+        参数:
+            enabled: 是否启用请求合并
+        """
+        self.enabled = enabled if enabled is not None else os.getenv("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 每个进行中的非流式上游调用的等待者数量
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._streams: Dict[str, StreamBroadcast] = {}
+        # 统计信息
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self.upstream_streams = 0
+        self.coalesced_streams = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行请求，已有相同请求在进行中时等待其结果
+
+        参数:
+            key: 请求键
+            factory: 发起上游调用的协程函数
+
+        返回:
+            Tuple[Any, bool]: (调用结果, 是否复用了其他请求的调用)
+        """
+        if not self.enabled:
+            self.upstream_calls += 1
+            return await factory(), False
+
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            self.upstream_calls += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(self._inflight, key, done))
+        else:
+            self.coalesced_calls += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shield保证单个等待者被取消时不会取消其他等待者共享的上游调用
+            return await asyncio.shield(task), shared
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    # 没有等待者了，取消上游调用释放调度槽位，之后的相同请求重新发起调用
+                    self._forget(self._inflight, key, task)
+                    task.cancel()
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]],
+               on_complete: Optional[Callable[[str], Awaitable[Any]]] = None) -> Tuple[AsyncGenerator[str, None], bool]:
+        """
+        订阅流式请求，已有相同的流在进行中时订阅该流
+
+        参数:
+            key: 请求键
+            factory: 创建上游文本片段异步迭代器的函数
+            on_complete: 上游正常结束后以完整文本调用的回调，每个上游流只调用一次
+
+        返回:
+            Tuple[AsyncGenerator[str, None], bool]: (文本片段异步生成器, 是否复用了其他请求的流)
+        """
+        if not self.enabled:
+            self.upstream_streams += 1
+            return passthrough_stream(factory(), on_complete), False
+
+        broadcast = self._streams.get(key)
+        # 已被取消的流不再接受新的订阅者
+        if broadcast is not None and broadcast.cancelled:
+            broadcast = None
+        shared = broadcast is not None
+        if broadcast is None:
+            self.upstream_streams += 1
+            broadcast = StreamBroadcast(factory(), on_complete)
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda done: self._forget(self._streams, key, broadcast))
+        else:
+            self.coalesced_streams += 1
+        return broadcast.subscribe(), shared
+
+    @staticmethod
+    def _forget(registry: Dict[str, Any], key: str, value: Any):
+        """请求完成后从进行中的请求表中移除（只移除自己，不影响之后的同键请求）"""
+        if registry.get(key) is value:
+            del registry[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """返回请求合并统计信息"""
+        return {
+            "enabled": self.enabled,
+            "inflight_calls": len(self._inflight),
+            "inflight_streams": len(self._streams),
+            "upstream_calls": self.upstream_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "upstream_streams": self.upstream_streams,
+            "coalesced_streams": self.coalesced_streams
+        }
+
+# 创建全局的请求合并器实例
+request_coalescer = RequestCoalescer()
+
+# 提供便捷的函数
+async def coalesce_request(key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+    """便捷函数，合并相同的非流式请求"""
+    return await request_coalescer.run(key, factory)
+
+def coalesce_stream(key: str, factory: Callable[[], AsyncIterator[str]],
+                    on_complete: Optional[Callable[[str], Awaitable[Any]]] = None) -> Tuple[AsyncGenerator[str, None], bool]:
+    """便捷函数，合并相同的流式请求"""
+    return request_coalescer.stream(key, factory, on_complete)
+
+def get_coalescing_stats() -> Dict[str, Any]:
+    """便捷函数，获取请求合并统计信息"""
+    return request_coalescer.stats()
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+# 温度分桶粒度，同一桶内的温度视为相同
+TEMPERATURE_BUCKET = 0.1
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角半角统一（NFKC）、合并连续空白并去除首尾空白"""
+    if not text:
+        return ""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+def make_cache_key(messages: List[Dict[str, str]], model: str, temperature: Optional[float], max_tokens: Optional[int]) -> str:
+    """
+    根据最终发送给大模型的消息和模型参数生成缓存键
+
+    参数:
+        messages: 发送给大模型的消息列表
+        model: 模型名称
+        temperature: 生成温度，按TEMPERATURE_BUCKET分桶
+        max_tokens: 最大生成token数
+
+    返回:
+        str: 缓存键（SHA-256十六进制字符串）
+    """
+    temperature_bucket = None if temperature is None else round(temperature / TEMPERATURE_BUCKET)
+    payload = [model, temperature_bucket, max_tokens, [[msg["role"], normalize_text(msg["content"])] for msg in messages]]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    大模型响应缓存服务类
+
+    内存中使用LRU淘汰和TTL过期策略，可选使用SQLite文件作为持久化存储，
+    内存未命中时回查磁盘，进程重启后缓存仍然有效。
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None, db_path: Optional[str] = None, enabled: Optional[bool] = None):
+        """
+        初始化响应缓存
+
+        参数:
+            max_entries: 内存中最多缓存的响应数量
+            ttl: 缓存过期时间（秒）
+            db_path: SQLite持久化文件路径，为空时只使用内存缓存
+            enabled: 是否启用缓存
+        """
+        self.enabled = enabled if enabled is not None else os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+        self.ttl = ttl or float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.db_path = db_path if db_path is not None else os.getenv("RESPONSE_CACHE_DB", "")
+        # key -> (过期时间（Unix时间戳）, 缓存值)
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def _get_db(self) -> Optional[sqlite3.Connection]:
+        """获取SQLite持久化存储连接，首次使用时创建"""
+        if not self.db_path:
+            return None
+        if self._db is None:
+            with self._db_lock:
+                if self._db is None:
+                    db = sqlite3.connect(self.db_path, check_same_thread=False)
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+                    db.commit()
+                    self._db = db
+        return self._db
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """从内存缓存中获取，过期时删除"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _set_memory(self, key: str, value: Dict[str, Any], expires_at: float):
+        """写入内存缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._cache[key] = (expires_at, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _get_disk(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """从SQLite持久化存储中获取"""
+        db = self._get_db()
+        if db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = db.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < time.time():
+                return None
+            return row[1], json.loads(row[0])
+        except Exception as e:
+            print(f"读取响应缓存失败: {str(e)}")
+            return None
+
+    def _set_disk(self, key: str, value: Dict[str, Any], expires_at: float):
+        """写入SQLite持久化存储"""
+        db = self._get_db()
+        if db is None:
+            return
+        try:
+            with self._db_lock:
+                db.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                db.commit()
+        except Exception as e:
+            print(f"写入响应缓存失败: {str(e)}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        获取缓存的响应
+
+        返回:
+            Optional[Dict[str, Any]]: 缓存值，包含content和usage，未命中时返回None
+        """
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None:
+            entry = self._get_disk(key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._set_memory(key, entry[1], entry[0])
+                value = entry[1]
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, content: str, usage: Optional[Dict[str, int]] = None):
+        """缓存大模型的响应"""
+        if not self.enabled or not content:
+            return
+        value = {"content": content, "usage": usage}
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, value, expires_at)
+        self._set_disk(key, value, expires_at)
+
+    async def get_async(self, key: str) -> Optional[Dict[str, Any]]:
+        """异步获取缓存的响应，启用磁盘存储时在线程池中执行"""
+        if not self.db_path:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def set_async(self, key: str, content: str, usage: Optional[Dict[str, int]] = None):
+        """异步缓存大模型的响应，启用磁盘存储时在线程池中执行"""
+        if not self.db_path:
+            self.set(key, content, usage)
+            return
+        await asyncio.to_thread(self.set, key, content, usage)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._cache.clear()
+        db = self._get_db()
+        if db is not None:
+            with self._db_lock:
+                db.execute("DELETE FROM response_cache")
+                db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._cache),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+# 创建全局的响应缓存实例
+response_cache = ResponseCache()
+
+# 提供便捷的函数
+async def get_cached_response(key: str) -> Optional[Dict[str, Any]]:
+    """便捷函数，获取缓存的响应"""
+    return await response_cache.get_async(key)
+
+async def cache_response(key: str, content: str, usage: Optional[Dict[str, int]] = None):
+    """便捷函数，缓存大模型的响应"""
+    await response_cache.set_async(key, content, usage)
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """便捷函数，获取响应缓存统计信息"""
+    return response_cache.stats()
@@ -0,0 +1,501 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Tuple, Callable, Optional
+import numpy as np
+
+# 连续的中日韩统一表意文字，或连续的其他字母数字
+_CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[^\W_\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_CJK_CHAR_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+def normalize_for_index(text: str) -> str:
+    """规范化文本：全角半角统一（NFKC）并转为小写"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+def char_ngram_analyzer(text: str, ngram_range: Tuple[int, int] = (1, 2)) -> List[str]:
+    """
+    字符n-gram分词器
+
+    连续的中文字符切分为字符n-gram，连续的字母数字作为一个整体词，标点和空白丢弃，
+    无需分词词典即可处理不带空格的中文句子。
+
+    参数:
+        text: 需要分词的文本
+        ngram_range: n-gram长度范围（包含两端）
+
+    返回:
+        List[str]: 词项列表
+    """
+    min_n, max_n = ngram_range
+    tokens = []
+    for run in _CJK_PATTERN.findall(normalize_for_index(text)):
+        if not _CJK_CHAR_PATTERN.match(run):
+            tokens.append(run)
+            continue
+        length = len(run)
+        for n in range(min_n, max_n + 1):
+            for start in range(length - n + 1):
+                tokens.append(run[start:start + n])
+    return tokens
+
+def jieba_analyzer(text: str) -> List[str]:
+    """基于jieba分词的分词器（需要安装jieba）"""
+    import jieba
+    return [token for token in jieba.lcut_for_search(normalize_for_index(text)) if token.strip() and not unicodedata.category(token[0]).startswith("P")]
+
+# 可用的分词器，可以通过register_analyzer注册自定义分词器
+ANALYZERS: Dict[str, Callable[[str], List[str]]] = {
+    "char_ngram": char_ngram_analyzer,
+    "jieba": jieba_analyzer,
+}
+
+def register_analyzer(name: str, analyzer: Callable[[str], List[str]]):
+    """注册自定义分词器"""
+    ANALYZERS[name] = analyzer
+
+def get_analyzer(name: str) -> Callable[[str], List[str]]:
+    """根据名称获取分词器"""
+    if name not in ANALYZERS:
+        raise ValueError(f"未知的分词器: {name}")
+    if name == "jieba":
+        try:
+            import jieba  # noqa: F401
+        except ImportError:
+            raise ValueError("使用jieba分词器需要先安装jieba: pip install jieba")
+    return ANALYZERS[name]
+
+class StringTable:
+    """
+    UTF-8字符串表
+
+    所有字符串按UTF-8编码首尾相接存放在一个字节数组中，另用偏移数组定位每个字符串，
+    两个数组都可以直接内存映射，不需要像定长的numpy字符串数组那样按最长字符串分配空间，
+    也不需要在每个工作进程中解码为Python字符串。UTF-8字节序与码位顺序一致，有序的表可以直接二分查找；
+    有序表另存每个字符串前8个字节组成的整数，批量查找时先用searchsorted定位前缀相同的范围，再比较完整的字节串。
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, prefixes: Optional[np.ndarray] = None):
+        """
+        初始化字符串表
+
+        参数:
+            blob: UTF-8字节数组
+            offsets: 每个字符串的起始偏移，长度为字符串数量+1
+            prefixes: 有序表中每个字符串前8个字节（不足补0）按大端序组成的整数，可选
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.prefixes = prefixes
+
+    @staticmethod
+    def prefix_key(encoded: bytes) -> int:
+        """返回UTF-8编码前8个字节（不足补0）按大端序组成的整数，与字节序一致"""
+        return int.from_bytes(encoded[:8].ljust(8, b"\0"), "big")
+
+    @classmethod
+    def from_strings(cls, strings, sorted_table: bool = False) -> "StringTable":
+        """根据字符串序列创建字符串表（保持原有顺序），sorted_table为True时同时生成前缀数组"""
+        encoded = [str(item).encode("utf-8") for item in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        prefixes = np.array([cls.prefix_key(item) for item in encoded], dtype=np.uint64) if sorted_table else None
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, prefixes)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def encoded(self, index: int) -> bytes:
+        """返回第index个字符串的UTF-8编码"""
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def __getitem__(self, index: int) -> str:
+        return self.encoded(index).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, key: bytes, order: Optional[np.ndarray] = None, low: int = 0, high: Optional[int] = None) -> int:
+        """
+        二分查找UTF-8编码的字符串
+
+        参数:
+            key: 要查找的字符串的UTF-8编码
+            order: 按字节序排列的下标数组，不提供时表本身必须有序
+            low: 查找范围的起点
+            high: 查找范围的终点（不包含），默认为表的长度
+
+        返回:
+            int: 字符串在表中的下标，不存在时返回-1
+        """
+        end = len(self) if high is None else high
+        high = end
+        while low < high:
+            middle = (low + high) // 2
+            if self.encoded(middle if order is None else int(order[middle])) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < end:
+            index = low if order is None else int(order[low])
+            if self.encoded(index) == key:
+                return index
+        return -1
+
+    def lookup(self, tokens: List[str]) -> np.ndarray:
+        """将字符串映射为有序表中的下标，不存在的字符串下标为-1"""
+        encoded = [token.encode("utf-8") for token in tokens]
+        if self.prefixes is None:
+            return np.fromiter((self.find(key) for key in encoded), dtype=np.int64, count=len(encoded))
+        keys = np.fromiter((self.prefix_key(key) for key in encoded), dtype=np.uint64, count=len(encoded))
+        lows = np.searchsorted(self.prefixes, keys, side="left").tolist()
+        highs = np.searchsorted(self.prefixes, keys, side="right").tolist()
+        result = np.full(len(encoded), -1, dtype=np.int64)
+        for i, (key, low, high) in enumerate(zip(encoded, lows, highs)):
+            # 前缀不同的字符串不需要比较；词项中不含\0，少于8个字节的字符串前缀（补0）相同即完全相同
+            if low == high:
+                continue
+            if high - low == 1:
+                if len(key) < 8 or self.encoded(low) == key:
+                    result[i] = low
+            else:
+                result[i] = self.find(key, low=low, high=high)
+        return result
+
+class InvertedIndex:
+    """
+    TF-IDF倒排索引
+
+    词表为有序数组，通过二分查找将词项映射为编号；倒排表按词项以CSC格式存储
+    （indptr/doc_ids/weights），文档向量已做L2归一化，查询与文档的点积即余弦相似度。
+    检索时只对包含查询词项的候选文档打分，并用argpartition选取top-k。
+    """
+
+    def __init__(self, terms: np.ndarray, idf: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                 n_docs: int, analyzer_name: str = "char_ngram", common_df_ratio: float = 0.05, min_common_df: int = 1000):
+        """
+        初始化倒排索引
+
+        参数:
+            terms: 有序词表（numpy字符串数组，或从离线索引加载的StringTable）
+            idf: 每个词项的IDF值
+            indptr: 倒排表偏移，词项i的倒排表为doc_ids[indptr[i]:indptr[i+1]]
+            doc_ids: 倒排表中的文档编号
+            weights: 倒排表中对应的归一化TF-IDF权重
+            n_docs: 文档数量
+            analyzer_name: 分词器名称
+            common_df_ratio: 文档频率超过该比例的词项视为常见词，查询包含其他词项时跳过
+            min_common_df: 常见词的最小文档频率阈值，小型知识库中所有词项都参与打分
+        """
+        self.terms = terms
+        self.idf = idf
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+        self.analyzer_name = analyzer_name
+        self.analyzer = get_analyzer(analyzer_name)
+        self.common_df = max(int(n_docs * common_df_ratio), min_common_df)
+        # 批量检索使用的词项×文档稀疏矩阵，首次批量检索时创建
+        self._term_matrix = None
+
+    @classmethod
+    def build(cls, documents: List[str], analyzer_name: str = "char_ngram", max_df: float = 0.8, min_df: int = 1) -> "InvertedIndex":
+        """
+        根据文档列表构建倒排索引
+
+        参数:
+            documents: 文档文本列表
+            analyzer_name: 分词器名称
+            max_df: 文档频率高于该比例的词项将被忽略
+            min_df: 文档频率低于该值的词项将被忽略
+
+        返回:
+            InvertedIndex: 构建好的倒排索引
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        analyzer = get_analyzer(analyzer_name)
+        # 文档数量太少时max_df会过滤掉所有词项，此时不做过滤
+        if len(documents) * max_df < 1:
+            max_df = 1.0
+        vectorizer = TfidfVectorizer(analyzer=analyzer, max_df=max_df, min_df=min_df, dtype=np.float32)
+        try:
+            document_vectors = vectorizer.fit_transform(documents).tocsc()
+        except ValueError:
+            # 没有任何有效词项
+            return cls.empty(len(documents), analyzer_name)
+        # TfidfVectorizer的词表按字典序排列，可以直接用于二分查找
+        terms = np.array(vectorizer.get_feature_names_out(), dtype=str)
+        return cls(
+            terms=terms,
+            idf=vectorizer.idf_.astype(np.float32),
+            indptr=document_vectors.indptr.astype(np.int64),
+            doc_ids=document_vectors.indices.astype(np.int32),
+            weights=document_vectors.data.astype(np.float32),
+            n_docs=len(documents),
+            analyzer_name=analyzer_name
+        )
+
+    @classmethod
+    def empty(cls, n_docs: int = 0, analyzer_name: str = "char_ngram") -> "InvertedIndex":
+        """创建一个不包含任何词项的索引"""
+        return cls(
+            terms=np.array([], dtype=str),
+            idf=np.array([], dtype=np.float32),
+            indptr=np.zeros(1, dtype=np.int64),
+            doc_ids=np.array([], dtype=np.int32),
+            weights=np.array([], dtype=np.float32),
+            n_docs=n_docs,
+            analyzer_name=analyzer_name
+        )
+
+    @classmethod
+    def from_vectors(cls, vectors: List[Tuple[np.ndarray, np.ndarray]], terms: np.ndarray, idf: np.ndarray,
+                     analyzer_name: str = "char_ngram") -> "InvertedIndex":
+        """
+        使用已有词表和IDF，根据已向量化的文档构建倒排索引（用于增量追加的文档段）
+
+        参数:
+            vectors: 每个文档的(词项编号数组, 权重数组)
+            terms: 共享的有序词表
+            idf: 共享的IDF值
+
+        返回:
+            InvertedIndex: 构建好的倒排索引，文档编号为vectors中的下标
+        """
+        from scipy.sparse import csr_matrix
+
+        lengths = [len(term_ids) for term_ids, _ in vectors]
+        indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        if indptr[-1]:
+            indices = np.concatenate([term_ids for term_ids, _ in vectors])
+            data = np.concatenate([weights for _, weights in vectors])
+        else:
+            indices = np.array([], dtype=np.int64)
+            data = np.array([], dtype=np.float32)
+        document_vectors = csr_matrix((data, indices, indptr), shape=(len(vectors), len(terms))).tocsc()
+        return cls(
+            terms=terms,
+            idf=idf,
+            indptr=document_vectors.indptr.astype(np.int64),
+            doc_ids=document_vectors.indices.astype(np.int32),
+            weights=document_vectors.data.astype(np.float32),
+            n_docs=len(vectors),
+            analyzer_name=analyzer_name
+        )
+
+    def lookup_terms(self, tokens: List[str]) -> np.ndarray:
+        """
+        将词项映射为编号
+
+        返回:
+            np.ndarray: 与tokens等长的编号数组，不在词表中的词项编号为-1
+        """
+        if not tokens or not len(self.terms):
+            return np.full(len(tokens), -1, dtype=np.int64)
+        if isinstance(self.terms, StringTable):
+            return self.terms.lookup(tokens)
+        queries = np.array(tokens, dtype=str)
+        positions = np.searchsorted(self.terms, queries)
+        positions[positions >= len(self.terms)] = 0
+        return np.where(self.terms[positions] == queries, positions, -1)
+
+    def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        将文本转换为L2归一化的稀疏TF-IDF向量
+
+        返回:
+            Tuple[np.ndarray, np.ndarray]: (词项编号数组, 权重数组)
+        """
+        counts = Counter(self.analyzer(text))
+        if not counts:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        term_ids = self.lookup_terms(list(counts.keys()))
+        valid = term_ids >= 0
+        term_ids = term_ids[valid]
+        if not term_ids.size:
+            return term_ids, np.array([], dtype=np.float32)
+        weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))[valid] * self.idf[term_ids]
+        return term_ids, weights / np.linalg.norm(weights)
+
+    def search(self, query: str, top_k: int = 3, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        检索与查询最相似的文档
+
+        参数:
+            query: 查询文本
+            top_k: 返回的最相关文档数量
+            min_score: 相似度阈值，只返回相似度大于该值的文档
+
+        返回:
+            List[Tuple[int, float]]: (文档编号, 相似度)列表，按相似度降序排列
+        """
+        term_ids, query_weights = self.vectorize(query)
+        return self.score(term_ids, query_weights, top_k, min_score)
+
+    def score(self, term_ids: np.ndarray, query_weights: np.ndarray, top_k: int = 3, min_score: float = 0.0,
+              deleted: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        根据查询向量对候选文档打分并选取top-k
+
+        参数:
+            term_ids: 查询向量的词项编号
+            query_weights: 查询向量的权重
+            top_k: 返回的最相关文档数量
+            min_score: 相似度阈值
+            deleted: 按文档编号标记已删除文档的布尔数组，已删除的文档不参与排序
+
+        返回:
+            List[Tuple[int, float]]: (文档编号, 相似度)列表，按相似度降序排列
+        """
+        if not term_ids.size or top_k <= 0:
+            return []
+        term_ids, query_weights = self._skip_common_terms(term_ids, query_weights)
+        starts = self.indptr[term_ids]
+        lengths = self.indptr[term_ids + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return []
+        # 拼接所有查询词项的倒排表位置
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        candidates = self.doc_ids[positions]
+        # 累加每个候选文档的得分，并映射回倒排表中的每个位置
+        scores = np.bincount(candidates, weights=self.weights[positions] * np.repeat(query_weights, lengths))[candidates]
+        if deleted is not None:
+            alive = ~deleted[candidates]
+            candidates, scores = candidates[alive], scores[alive]
+            total = candidates.size
+            if not total:
+                return []
+        # 同一文档最多出现len(lengths)次，取前top_k * len(lengths)个位置即可覆盖得分最高的top_k个文档
+        limit = min(top_k * len(lengths), total)
+        if limit < total:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        candidates, first = np.unique(candidates, return_index=True)
+        scores = scores[first]
+        top = np.argsort(-scores)[:top_k]
+        return [(int(candidates[i]), float(scores[i])) for i in top if scores[i] > min_score]
+
+    def _skip_common_terms(self, term_ids: np.ndarray, query_weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """跳过常见词（只要查询中还有其他词项），它们对相似度贡献很小但倒排表很长"""
+        lengths = self.indptr[term_ids + 1] - self.indptr[term_ids]
+        rare = lengths <= self.common_df
+        if rare.any() and not rare.all():
+            return term_ids[rare], query_weights[rare]
+        return term_ids, query_weights
+
+    def term_matrix(self):
+        """返回词项×文档的CSR稀疏矩阵，直接使用倒排表数组，不复制权重和文档编号"""
+        if self._term_matrix is None:
+            from scipy.sparse import csr_matrix
+            self._term_matrix = csr_matrix((self.weights, self.doc_ids, self.indptr), shape=(len(self.terms), self.n_docs))
+        return self._term_matrix
+
+    def score_batch(self, query_vectors: List[Tuple[np.ndarray, np.ndarray]], top_k: int = 3, min_score: float = 0.0,
+                    deleted: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """
+        对多个查询向量打分并分别选取top-k，所有查询组成一个稀疏矩阵，与倒排表做一次稀疏矩阵乘法
+
+        参数:
+            query_vectors: 每个查询的(词项编号数组, 权重数组)
+            top_k: 每个查询返回的最相关文档数量
+            min_score: 相似度阈值
+            deleted: 按文档编号标记已删除文档的布尔数组，已删除的文档不参与排序
+
+        返回:
+            List[List[Tuple[int, float]]]: 与query_vectors一一对应的(文档编号, 相似度)列表，按相似度降序排列
+        """
+        from scipy.sparse import csr_matrix
+
+        results: List[List[Tuple[int, float]]] = [[] for _ in query_vectors]
+        if not query_vectors or top_k <= 0 or not self.n_docs or not len(self.terms):
+            return results
+        query_vectors = [self._skip_common_terms(term_ids, weights) if term_ids.size else (term_ids, weights) for term_ids, weights in query_vectors]
+        indptr = np.zeros(len(query_vectors) + 1, dtype=np.int64)
+        np.cumsum([term_ids.size for term_ids, _ in query_vectors], out=indptr[1:])
+        if not indptr[-1]:
+            return results
+        indices = np.concatenate([term_ids for term_ids, _ in query_vectors])
+        data = np.concatenate([weights for _, weights in query_vectors]).astype(np.float32, copy=False)
+        queries = csr_matrix((data, indices, indptr), shape=(len(query_vectors), len(self.terms)))
+        # 每行为一个查询对所有候选文档的得分，只包含与查询有共同词项的文档
+        scores = queries @ self.term_matrix()
+        for row in range(len(query_vectors)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            if start == end:
+                continue
+            candidates, row_scores = scores.indices[start:end], scores.data[start:end]
+            if deleted is not None:
+                alive = ~deleted[candidates]
+                candidates, row_scores = candidates[alive], row_scores[alive]
+            if candidates.size > top_k:
+                top = np.argpartition(-row_scores, top_k - 1)[:top_k]
+                candidates, row_scores = candidates[top], row_scores[top]
+            order = np.argsort(-row_scores)
+            results[row] = [(int(candidates[i]), float(row_scores[i])) for i in order if row_scores[i] > min_score]
+        return results
+
+class IndexSnapshot:
+    """
+    知识库索引快照（不可变）
+
+    由基础索引段、增量追加段和删除标记组成。增量段沿用基础段的词表和IDF，
+    新增的词项在下一次合并重建之前不参与检索。检索线程只读取快照，写入方构建新快照后整体替换。
+    """
+
+    def __init__(self, entries: List[Dict[str, str]], base: InvertedIndex, delta: InvertedIndex, deleted: np.ndarray, version: int = 0):
+        """
+        初始化索引快照
+
+        参数:
+            entries: 知识库条目列表，下标为全局文档编号（基础段在前，增量段在后）
+            base: 基础索引段
+            delta: 增量索引段
+            deleted: 按全局文档编号标记已删除文档的布尔数组
+            version: 快照版本号
+        """
+        self.entries = entries
+        self.base = base
+        self.delta = delta
+        self.deleted = deleted
+        self.version = version
+        self.n_docs = base.n_docs + delta.n_docs
+        self.n_deleted = int(deleted.sum())
+
+    def search(self, query: str, top_k: int = 3, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        在基础段和增量段中检索并合并结果
+
+        返回:
+            List[Tuple[int, float]]: (全局文档编号, 相似度)列表，按相似度降序排列
+        """
+        term_ids, query_weights = self.base.vectorize(query)
+        deleted = self.deleted if self.n_deleted else None
+        results = self.base.score(term_ids, query_weights, top_k, min_score, deleted[:self.base.n_docs] if deleted is not None else None)
+        if self.delta.n_docs:
+            offset = self.base.n_docs
+            delta_results = self.delta.score(term_ids, query_weights, top_k, min_score, deleted[offset:] if deleted is not None else None)
+            results = sorted(results + [(doc_id + offset, score) for doc_id, score in delta_results], key=lambda item: -item[1])[:top_k]
+        return results
+
+    def search_batch(self, queries: List[str], top_k: int = 3, min_score: float = 0.0) -> List[List[Tuple[int, float]]]:
+        """
+        批量检索，基础段和增量段各做一次稀疏矩阵乘法后按查询合并结果
+
+        返回:
+            List[List[Tuple[int, float]]]: 与queries一一对应的(全局文档编号, 相似度)列表，按相似度降序排列
+        """
+        query_vectors = [self.base.vectorize(query) for query in queries]
+        deleted = self.deleted if self.n_deleted else None
+        results = self.base.score_batch(query_vectors, top_k, min_score, deleted[:self.base.n_docs] if deleted is not None else None)
+        if self.delta.n_docs:
+            offset = self.base.n_docs
+            delta_results = self.delta.score_batch(query_vectors, top_k, min_score, deleted[offset:] if deleted is not None else None)
+            results = [
+                sorted(base_results + [(doc_id + offset, score) for doc_id, score in query_delta], key=lambda item: -item[1])[:top_k]
+                for base_results, query_delta in zip(results, delta_results)
+            ]
+        return results
@@ -1,5 +1,165 @@
+import os
 import re
+import asyncio
+from collections import deque
 from typing import List, Tuple, Dict, Any
+from services.tracing import trace_span
+
+# 超过该长度的文本放到线程池中过滤，避免长文本扫描阻塞事件循环
+ASYNC_OFFLOAD_THRESHOLD = 2048
+
+class AhoCorasickAutomaton:
+    """
+    Aho-Corasick多模式匹配自动机
+    
+    状态用整数编号，转移表为按状态编号索引的数组（每个状态一个字符到状态编号的字典），
+    配合失败链接实现对文本的单次线性扫描，扫描复杂度与敏感词数量无关。
+    """
+    
+    def __init__(self, words: List[str]):
+        """根据敏感词列表编译自动机"""
+        # 转移表：goto[state][char] -> next_state
+        self.goto: List[Dict[str, int]] = [{}]
+        # 失败链接：fail[state] -> 最长真后缀对应的状态
+        self.fail: List[int] = [0]
+        # 状态深度：从根到该状态的字符数
+        self.depth: List[int] = [0]
+        # 输出表：以该状态结尾的最长敏感词长度，0表示无匹配（已沿失败链合并）
+        self.output: List[int] = [0]
+        # 最长敏感词长度
+        self.max_word_length = 0
+        
+        for word in words:
+            if word:
+                self._insert(word)
+        self._build_failure_links()
+        
+    def __len__(self) -> int:
+        """返回状态数量"""
+        return len(self.goto)
+        
+    def _insert(self, word: str):
+        """将一个敏感词插入字典树"""
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[state] + 1)
+                self.output.append(0)
+                self.goto[state][char] = next_state
+            state = next_state
+        self.output[state] = len(word)
+        self.max_word_length = max(self.max_word_length, len(word))
+        
+    def _build_failure_links(self):
+        """按广度优先顺序构建失败链接，并沿失败链合并输出表"""
+        goto, fail, output = self.goto, self.fail, self.output
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                if state == 0:
+                    fail[next_state] = 0
+                else:
+                    fallback = fail[state]
+                    while fallback and char not in goto[fallback]:
+                        fallback = fail[fallback]
+                    fail[next_state] = goto[fallback].get(char, 0)
+                # 当前状态没有完整匹配时，继承失败状态上的最长匹配
+                if output[fail[next_state]] > output[next_state]:
+                    output[next_state] = output[fail[next_state]]
+                    
+    def scan(self, text: str, state: int = 0) -> Tuple[int, List[Tuple[int, int]]]:
+        """
+        对文本进行单次线性扫描
+        
+        参数:
+            text: 需要扫描的文本
+            state: 起始状态，用于跨片段续扫
+        
+        返回:
+            Tuple[int, List[Tuple[int, int]]]: (扫描结束时的状态, 匹配区间列表)，
+            每个位置只记录以该位置结尾的最长匹配，区间为[start, end)，按end递增
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        matches = []
+        for i, char in enumerate(text):
+            next_state = goto[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(char)
+            state = next_state or 0
+            length = output[state]
+            if length:
+                matches.append((i + 1 - length, i + 1))
+        return state, matches
+
+def merge_matches(matches: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    合并重叠或相邻的匹配区间
+    
+    参数:
+        matches: 按end递增的匹配区间列表
+    
+    返回:
+        List[Tuple[int, int]]: 互不重叠、按位置递增的区间列表
+    """
+    merged = []
+    for start, end in matches:
+        # 后出现的更长匹配可能向前覆盖多个已合并的区间
+        while merged and start <= merged[-1][1]:
+            start = min(start, merged.pop()[0])
+        merged.append((start, end))
+    return merged
+
+def mask_matches(text: str, matches: List[Tuple[int, int]], offset: int = 0) -> str:
+    """
+    将匹配区间覆盖的字符替换为*号
+    
+    参数:
+        text: 原始文本
+        matches: 按end递增的匹配区间列表
+        offset: 区间相对于text起点的偏移量
+    
+    返回:
+        str: 替换后的文本
+    """
+    if not matches:
+        return text
+    pieces = []
+    position = 0
+    for start, end in merge_matches(matches):
+        start = max(start - offset, position)
+        end = min(end - offset, len(text))
+        if end <= start:
+            continue
+        pieces.append(text[position:start])
+        pieces.append("*" * (end - start))
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+def select_longest_matches(matches: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    按最长匹配语义筛选匹配区间，被更长敏感词完全包含的匹配会被丢弃
+    
+    参数:
+        matches: 按end递增的匹配区间列表
+    
+    返回:
+        List[Tuple[int, int]]: 筛选后的匹配区间列表
+    """
+    selected = []
+    for start, end in matches:
+        # end递增，因此start不大于前一个区间的start即表示包含前一个区间
+        while selected and start <= selected[-1][0]:
+            selected.pop()
+        selected.append((start, end))
+    return selected
 
 class SensitiveWordFilter:
     """敏感词过滤服务类"""
@@ -8,32 +168,35 @@ class SensitiveWordFilter:
         """初始化敏感词过滤器，加载敏感词库"""
         # 初始化敏感词库，可以从文件或数据库加载
         self.sensitive_words = self._load_sensitive_words()
-        # 构建DFA（Deterministic Finite Automaton）敏感词检测算法
-        self.dfa = self._build_dfa()
+        # 构建Aho-Corasick敏感词检测自动机
+        self.automaton = self._build_automaton()
         
     def _load_sensitive_words(self) -> List[str]:
         """加载敏感词库，实际应用中可以从文件或数据库加载"""
         # 这里使用简单的敏感词列表作为示例
-        return [
+        sensitive_words = [
             "敏感词1", "敏感词2", "敏感词3", "政治", "暴力", 
             "色情", "赌博", "毒品", "诈骗", "恶意"
         ]
         
-    def _build_dfa(self) -> Dict[str, Any]:
-        """构建DFA敏感词检测算法"""
-        dfa = {}
-        for word in self.sensitive_words:
-            current = dfa
-            for char in word:
-                if char not in current:
-                    current[char] = {}
-                current = current[char]
-            current["is_end"] = True
-        return dfa
+        # 检查是否配置了敏感词文件（每行一个敏感词）
+        words_file = os.getenv("SENSITIVE_WORDS_FILE")
+        if words_file and os.path.exists(words_file):
+            try:
+                with open(words_file, 'r', encoding='utf-8') as f:
+                    sensitive_words = [line.strip() for line in f if line.strip()]
+            except Exception as e:
+                print(f"加载敏感词文件失败: {e}")
+        
+        return sensitive_words
+        
+    def _build_automaton(self) -> AhoCorasickAutomaton:
+        """构建Aho-Corasick敏感词检测自动机"""
+        return AhoCorasickAutomaton(self.sensitive_words)
         
     def filter_sensitive_words(self, text: str) -> Tuple[str, List[str]]:
         """
-        过滤文本中的敏感词
+        过滤文本中的敏感词，所有敏感词覆盖的字符都会被替换，检测结果采用最长匹配
         
         参数:
             text: 需要过滤的文本
@@ -41,37 +204,103 @@ class SensitiveWordFilter:
         返回:
             Tuple[str, List[str]]: (过滤后的文本, 检测到的敏感词列表)
         """
-        if not text or not self.dfa:
+        if not text or len(self.automaton) <= 1:
             return text, []
             
-        result = list(text)
-        sensitive_words_found = []
-        
-        for i in range(len(result)):
-            current = self.dfa
-            matched = False
-            word = ""
-            
-            for j in range(i, len(result)):
-                char = result[j]
-                if char in current:
-                    current = current[char]
-                    word += char
-                    if "is_end" in current:
-                        sensitive_words_found.append(word)
-                        # 替换敏感词为*号
-                        for k in range(i, j + 1):
-                            result[k] = "*"
-                        matched = True
-                        break
-                else:
-                    break
+        with trace_span("sensitive.scan", chars=len(text)):
+            _, matches = self.automaton.scan(text)
+        if not matches:
+            return text, []
             
-            if matched:
-                # 跳过已处理的字符
-                i += len(word) - 1
-                
-        return "".join(result), list(set(sensitive_words_found))
+        # 去重并保持出现顺序
+        with trace_span("sensitive.mask", matches=len(matches)):
+            sensitive_words_found = dict.fromkeys(text[start:end] for start, end in select_longest_matches(matches))
+            return mask_matches(text, matches), list(sensitive_words_found)
+
+class StreamingSensitiveWordFilter:
+    """
+    流式敏感词过滤器
+    
+    跨片段保存自动机状态，并暂存末尾可能仍处于匹配过程中的字符（最多为最长敏感词长度），
+    只输出已确认不会再被敏感词覆盖的文本，因此跨片段的敏感词同样会被替换。
+    扫描过程中记录的匹配结果可直接用于生成完整响应的过滤结果，无需再次扫描全文。
+    """
+    
+    def __init__(self, automaton: AhoCorasickAutomaton):
+        """初始化流式过滤器"""
+        self.automaton = automaton
+        # 自动机当前状态
+        self.state = 0
+        # 尚未输出的原文，以及其在全文中的起始位置
+        self.buffer = ""
+        self.buffer_offset = 0
+        # 全文中的所有匹配区间
+        self.matches: List[Tuple[int, int]] = []
+        # 仍可能影响未输出文本的匹配区间
+        self._active_matches: List[Tuple[int, int]] = []
+        self._raw_parts: List[str] = []
+        self._filtered_parts: List[str] = []
+        
+    def feed(self, chunk: str) -> str:
+        """
+        输入一个文本片段
+        
+        参数:
+            chunk: 新到达的文本片段
+        
+        返回:
+            str: 已确认安全、可以输出的过滤后文本（可能为空字符串）
+        """
+        if not chunk:
+            return ""
+        self._raw_parts.append(chunk)
+        base = self.buffer_offset + len(self.buffer)
+        self.state, matches = self.automaton.scan(chunk, self.state)
+        if matches:
+            matches = [(start + base, end + base) for start, end in matches]
+            self.matches.extend(matches)
+            self._active_matches.extend(matches)
+        self.buffer += chunk
+        # 末尾depth个字符可能是某个敏感词的前缀，需要暂存
+        return self._release(base + len(chunk) - self.automaton.depth[self.state])
+        
+    def finish(self) -> str:
+        """
+        结束输入，输出暂存的剩余文本
+        
+        返回:
+            str: 剩余的过滤后文本
+        """
+        return self._release(self.buffer_offset + len(self.buffer))
+        
+    def _release(self, safe_end: int) -> str:
+        """输出全文中safe_end之前的暂存文本"""
+        count = safe_end - self.buffer_offset
+        if count <= 0:
+            return ""
+        released = mask_matches(self.buffer[:count], self._active_matches, offset=self.buffer_offset)
+        self.buffer = self.buffer[count:]
+        self.buffer_offset = safe_end
+        if self._active_matches:
+            self._active_matches = [match for match in self._active_matches if match[1] > safe_end]
+        self._filtered_parts.append(released)
+        return released
+        
+    @property
+    def text(self) -> str:
+        """已输入的完整原文"""
+        return "".join(self._raw_parts)
+        
+    @property
+    def filtered_text(self) -> str:
+        """已输出的完整过滤后文本"""
+        return "".join(self._filtered_parts)
+        
+    @property
+    def sensitive_words(self) -> List[str]:
+        """检测到的敏感词列表（最长匹配，去重并保持出现顺序）"""
+        text = self.text
+        return list(dict.fromkeys(text[start:end] for start, end in select_longest_matches(self.matches)))
 
 # 创建全局的敏感词过滤器实例
 sensitive_word_filter = SensitiveWordFilter()
@@ -79,4 +308,24 @@ sensitive_word_filter = SensitiveWordFilter()
 # 提供便捷的过滤函数
 def filter_sensitive_words(text: str) -> Tuple[str, List[str]]:
     """便捷函数，调用敏感词过滤器进行敏感词过滤"""
-    return sensitive_word_filter.filter_sensitive_words(text)
\ No newline at end of file
+    return sensitive_word_filter.filter_sensitive_words(text)
+
+def create_stream_filter() -> StreamingSensitiveWordFilter:
+    """便捷函数，创建一个使用全局敏感词库的流式过滤器"""
+    return StreamingSensitiveWordFilter(sensitive_word_filter.automaton)
+
+async def filter_sensitive_words_async(text: str) -> Tuple[str, List[str]]:
+    """异步便捷函数，短文本直接过滤，长文本在线程池中过滤"""
+    if not text or len(text) < ASYNC_OFFLOAD_THRESHOLD:
+        return sensitive_word_filter.filter_sensitive_words(text)
+    return await asyncio.to_thread(sensitive_word_filter.filter_sensitive_words, text)
+
+def filter_sensitive_words_batch(texts: List[str]) -> List[Tuple[str, List[str]]]:
+    """便捷函数，批量过滤敏感词"""
+    return [sensitive_word_filter.filter_sensitive_words(text) for text in texts]
+
+async def filter_sensitive_words_batch_async(texts: List[str]) -> List[Tuple[str, List[str]]]:
+    """异步便捷函数，总长度较短时直接过滤，否则在线程池中一次过滤整批文本"""
+    if sum(len(text) for text in texts) < ASYNC_OFFLOAD_THRESHOLD:
+        return filter_sensitive_words_batch(texts)
+    return await asyncio.to_thread(filter_sensitive_words_batch, texts)
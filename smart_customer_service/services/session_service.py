@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from database.database import get_db, ChatHistory
+from services.history_writer import flush_session_history
+
+class SessionContextCache:
+    """
+    会话上下文缓存服务类
+
+    按(用户ID, 会话ID)缓存已经整理好的、可直接发送给大模型的历史消息列表，
+    采用LRU淘汰和TTL过期策略，缓存未命中时从聊天历史记录中重建。
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, ttl: Optional[float] = None, history_limit: Optional[int] = None,
+                 flush_timeout: Optional[float] = None):
+        """
+        初始化会话上下文缓存
+
+        参数:
+            max_sessions: 最多缓存的会话数量
+            ttl: 会话上下文的过期时间（秒），每次访问后重新计时
+            history_limit: 从聊天历史重建上下文时最多加载的消息数量
+            flush_timeout: 重建前等待该会话排队中的聊天历史写入数据库的最长时间（秒）
+        """
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+        self.ttl = ttl or float(os.getenv("SESSION_CACHE_TTL", "1800"))
+        self.history_limit = history_limit or int(os.getenv("SESSION_HISTORY_LIMIT", "100"))
+        self.flush_timeout = flush_timeout or float(os.getenv("SESSION_FLUSH_TIMEOUT", "2"))
+        # (user_id, session_id) -> (过期时间, 消息列表)
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, List[Dict[str, str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """
+        从缓存中获取会话上下文
+
+        返回:
+            Optional[List[Dict[str, str]]]: 消息列表的副本，未命中或已过期时返回None
+        """
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._cache[key]
+                self.misses += 1
+                return None
+            self._cache[key] = (now + self.ttl, entry[1])
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def set(self, user_id: str, session_id: str, messages: List[Dict[str, str]]):
+        """设置会话上下文，超出容量时淘汰最久未使用的会话"""
+        key = (user_id, session_id)
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, list(messages))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_sessions:
+                self._cache.popitem(last=False)
+
+    def append(self, user_id: str, session_id: str, *messages: Dict[str, str]):
+        """向已缓存的会话上下文追加消息，会话不在缓存中时忽略（下次访问时从历史记录重建）"""
+        key = (user_id, session_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return
+            entry[1].extend(messages)
+            self._cache[key] = (time.monotonic() + self.ttl, entry[1])
+            self._cache.move_to_end(key)
+
+    def invalidate(self, user_id: Optional[str] = None, session_id: Optional[str] = None):
+        """使匹配的会话上下文缓存失效，两个参数都不指定时清空缓存"""
+        with self._lock:
+            if user_id is not None and session_id is not None:
+                self._cache.pop((user_id, session_id), None)
+                return
+            for key in [key for key in self._cache if (user_id is None or key[0] == user_id) and (session_id is None or key[1] == session_id)]:
+                del self._cache[key]
+
+    def load_from_history(self, user_id: str, session_id: str) -> List[Dict[str, str]]:
+        """
+        从聊天历史记录重建会话上下文，先等待该会话仍在后台写入队列中的记录写入数据库
+
+        参数:
+            user_id: 用户ID
+            session_id: 会话ID
+
+        返回:
+            List[Dict[str, str]]: 按时间顺序排列的消息列表，使用过滤后的内容，不包含错误响应
+        """
+        # 后台写入器尚未提交的记录不在数据库中，等待其写入，避免重建的上下文缺少最近几轮对话
+        if not flush_session_history(user_id, session_id, self.flush_timeout):
+            print(f"等待会话{session_id}的聊天历史写入超时，重建的上下文可能缺少最近的消息")
+
+        # 获取数据库会话
+        db = next(get_db())
+
+        try:
+            records = (
+                db.query(ChatHistory.role, ChatHistory.content, ChatHistory.filtered_content, ChatHistory.message_metadata)
+                .filter(ChatHistory.user_id == user_id, ChatHistory.session_id == session_id)
+                .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+                .limit(self.history_limit)
+                .all()
+            )
+
+            messages = []
+            for record in reversed(records):
+                if record.message_metadata and record.message_metadata.get("error"):
+                    continue
+                messages.append({
+                    "role": record.role,
+                    "content": record.filtered_content if record.filtered_content is not None else record.content
+                })
+            return messages
+        except Exception as e:
+            print(f"重建会话上下文失败: {str(e)}")
+            return []
+        finally:
+            # 关闭数据库会话
+            db.close()
+
+    async def get_context(self, user_id: str, session_id: str) -> List[Dict[str, str]]:
+        """
+        获取会话上下文，缓存未命中时在线程池中从聊天历史重建并写入缓存
+
+        返回:
+            List[Dict[str, str]]: 消息列表的副本，新会话返回空列表
+        """
+        messages = self.get(user_id, session_id)
+        if messages is not None:
+            return messages
+        messages = await asyncio.to_thread(self.load_from_history, user_id, session_id)
+        if messages:
+            self.set(user_id, session_id, messages)
+        return list(messages)
+
+# 创建全局的会话上下文缓存实例
+session_context_cache = SessionContextCache()
+
+# 提供便捷的函数
+async def get_session_context(user_id: str, session_id: str) -> List[Dict[str, str]]:
+    """便捷函数，获取会话上下文"""
+    return await session_context_cache.get_context(user_id, session_id)
+
+def set_session_context(user_id: str, session_id: str, messages: List[Dict[str, str]]):
+    """便捷函数，设置会话上下文"""
+    session_context_cache.set(user_id, session_id, messages)
+
+def append_session_messages(user_id: str, session_id: str, *messages: Dict[str, str]):
+    """便捷函数，向会话上下文追加消息"""
+    session_context_cache.append(user_id, session_id, *messages)
+
+def invalidate_session_context(user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """便捷函数，使会话上下文缓存失效"""
+    session_context_cache.invalidate(user_id, session_id)
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import asyncio
+from typing import Dict, Any, Optional, AsyncIterator, AsyncGenerator
+
+# 安装了orjson时使用orjson序列化（比标准库json快数倍），否则回退为标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 流式响应帧格式：compact只在第一帧和最后一帧携带user_id、model等元数据，中间帧只有content；full每帧都携带完整字段
+SSE_FRAME_FORMAT = os.getenv("SSE_FRAME_FORMAT", "compact").lower()
+
+# 合并窗口：首个片段立即发送，之后的片段在窗口时间（毫秒）内或累计达到字符数之前合并为一帧，0表示不合并
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "0"))
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "0"))
+
+# 流式响应的HTTP响应头，禁止代理缓存和缓冲
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def json_dumps(data: Any) -> bytes:
+    """将数据序列化为UTF-8编码的JSON（中文不转义，不含多余空格）"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+def encode_event(data: Any) -> bytes:
+    """编码一个SSE事件"""
+    return b"data: " + json_dumps(data) + b"\n\n"
+
+class SSEStreamEncoder:
+    """
+    流式聊天响应的SSE编码器
+
+    把stream_chat_completion生成的片段编码为SSE帧：compact格式下第一帧携带user_id、session_id和model，
+    中间帧为{"content": ...}，最后一帧（is_final）携带完整响应和元数据。
+    配置了合并窗口时，首个片段之后的小片段合并为一帧发送，减少并发流数量较多时的系统调用次数和传输字节数。
+    """
+
+    def __init__(self, frame_format: Optional[str] = None, coalesce_ms: Optional[float] = None, coalesce_chars: Optional[int] = None):
+        """
+        初始化编码器
+
+        参数:
+            frame_format: compact或full
+            coalesce_ms: 合并窗口（毫秒），0表示不按时间合并
+            coalesce_chars: 合并的字符数上限，0表示不按字符数合并
+        """
+        self.frame_format = frame_format or SSE_FRAME_FORMAT
+        self.coalesce_seconds = (coalesce_ms if coalesce_ms is not None else SSE_COALESCE_MS) / 1000
+        self.coalesce_chars = coalesce_chars if coalesce_chars is not None else SSE_COALESCE_CHARS
+        self.frames = 0
+        self.bytes = 0
+
+    def _delta_frame(self, chunk: Dict[str, Any], content: str) -> bytes:
+        """编码一个文本片段帧"""
+        if self.frame_format == "full":
+            frame = {**chunk, "content": content}
+        elif self.frames == 0:
+            frame = {"user_id": chunk.get("user_id"), "session_id": chunk.get("session_id"), "model": chunk.get("model"), "content": content}
+        else:
+            frame = {"content": content}
+        return self._count(encode_event(frame))
+
+    def _count(self, data: bytes) -> bytes:
+        self.frames += 1
+        self.bytes += len(data)
+        return data
+
+    def encode_chunk(self, chunk: Any) -> bytes:
+        """编码单个片段，chunk为片段字典或具有model_dump方法的响应对象"""
+        if not isinstance(chunk, dict):
+            return self._count(encode_event(chunk.model_dump(mode="json")))
+        if chunk.get("is_final"):
+            return self._count(encode_event(chunk))
+        return self._delta_frame(chunk, chunk.get("content", ""))
+
+    async def encode(self, chunks: AsyncIterator[Any]) -> AsyncGenerator[bytes, None]:
+        """
+        编码流式响应，按配置合并片段
+
+        参数:
+            chunks: stream_chat_completion生成的片段
+        """
+        if self.coalesce_seconds <= 0 and self.coalesce_chars <= 0:
+            async for chunk in chunks:
+                yield self.encode_chunk(chunk)
+            return
+
+        # 暂存的片段：第一个片段字典和累计的文本
+        pending_chunk: Optional[Dict[str, Any]] = None
+        pending_parts = []
+        pending_chars = 0
+        pending_since = 0.0
+
+        def flush() -> Optional[bytes]:
+            nonlocal pending_chunk, pending_chars
+            if pending_chunk is None:
+                return None
+            data = self._delta_frame(pending_chunk, "".join(pending_parts))
+            pending_chunk = None
+            pending_parts.clear()
+            pending_chars = 0
+            return data
+
+        iterator = chunks.__aiter__()
+        next_chunk: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if next_chunk is None:
+                    next_chunk = asyncio.ensure_future(iterator.__anext__())
+                if pending_chunk is not None and self.coalesce_seconds > 0:
+                    # 等待下一个片段，窗口到期时先发送暂存的文本（不取消正在等待的片段）
+                    remaining = pending_since + self.coalesce_seconds - time.monotonic()
+                    if remaining > 0:
+                        await asyncio.wait({next_chunk}, timeout=remaining)
+                    if not next_chunk.done():
+                        yield flush()
+                        continue
+                try:
+                    chunk = await next_chunk
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if next_chunk.done():
+                        next_chunk = None
+
+                if not isinstance(chunk, dict) or chunk.get("is_final"):
+                    data = flush()
+                    if data is not None:
+                        yield data
+                    yield self.encode_chunk(chunk)
+                    continue
+                content = chunk.get("content", "")
+                if self.frames == 0 and pending_chunk is None:
+                    # 首个片段立即发送，不增加首字延迟
+                    yield self._delta_frame(chunk, content)
+                    continue
+                if pending_chunk is None:
+                    pending_chunk = chunk
+                    pending_since = time.monotonic()
+                pending_parts.append(content)
+                pending_chars += len(content)
+                if self.coalesce_chars > 0 and pending_chars >= self.coalesce_chars:
+                    yield flush()
+            data = flush()
+            if data is not None:
+                yield data
+        finally:
+            if next_chunk is not None and not next_chunk.done():
+                next_chunk.cancel()
+
+# 提供便捷的函数
+def encode_chat_stream(chunks: AsyncIterator[Any]) -> AsyncGenerator[bytes, None]:
+    """便捷函数，按配置的帧格式和合并窗口编码流式聊天响应"""
+    return SSEStreamEncoder().encode(chunks)
@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+import threading
+from typing import List, Dict, Any, Optional, Callable
+
+# 是否启用启动性能分析，启用后统计每个模块的导入耗时和每个组件的初始化耗时
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes")
+
+class _TimedLoader:
+    """包装模块加载器，统计模块执行（导入）耗时"""
+
+    def __init__(self, loader: Any, profiler: "StartupProfiler"):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler._stack()
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._profiler.record_import(module.__name__, elapsed, elapsed - children)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+class _TimingFinder:
+    """元路径查找器，把其他查找器找到的模块加载器替换为计时加载器"""
+
+    def __init__(self, profiler: "StartupProfiler"):
+        self._profiler = profiler
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self._profiler)
+                return spec
+        return None
+
+class StartupProfiler:
+    """
+    启动性能分析器
+
+    统计每个模块的导入耗时（包含子模块的总耗时和自身耗时）以及各组件的初始化耗时，
+    与python -X importtime的统计口径一致，但可以在服务进程内查看。
+    """
+
+    def __init__(self):
+        """初始化启动性能分析器"""
+        self.imports: Dict[str, Dict[str, float]] = {}
+        self.inits: Dict[str, float] = {}
+        self._finder: Optional[_TimingFinder] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[float]:
+        """当前线程正在导入的模块栈，每一项为已完成的子模块导入耗时之和"""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def install(self):
+        """开始统计之后的模块导入"""
+        if self._finder is None:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        """停止统计模块导入"""
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    def record_import(self, name: str, total: float, self_time: float):
+        """记录模块导入耗时"""
+        with self._lock:
+            self.imports[name] = {"total_s": total, "self_s": self_time}
+
+    def record_init(self, name: str, elapsed: float):
+        """记录组件初始化耗时"""
+        with self._lock:
+            self.inits[name] = elapsed
+
+    def report(self, top: int = 20) -> Dict[str, Any]:
+        """
+        生成启动性能报告
+
+        参数:
+            top: 导入耗时最长的模块数量
+
+        返回:
+            Dict[str, Any]: 包含导入耗时最长的模块、按顶层包汇总的导入耗时和组件初始化耗时
+        """
+        with self._lock:
+            imports = dict(self.imports)
+            inits = dict(self.inits)
+        packages: Dict[str, float] = {}
+        for name, item in imports.items():
+            package = name.split(".", 1)[0]
+            packages[package] = packages.get(package, 0.0) + item["self_s"]
+        return {
+            "slowest_imports": [
+                {"module": name, **item}
+                for name, item in sorted(imports.items(), key=lambda pair: -pair[1]["total_s"])[:top]
+            ],
+            "packages": [
+                {"package": name, "import_s": elapsed}
+                for name, elapsed in sorted(packages.items(), key=lambda pair: -pair[1])[:top]
+            ],
+            "inits": inits
+        }
+
+    def print_report(self, top: int = 20):
+        """打印启动性能报告"""
+        report = self.report(top)
+        print("启动性能分析 - 按顶层包汇总的导入耗时:")
+        for item in report["packages"]:
+            print(f"  {item['import_s'] * 1000:>10.1f} ms  {item['package']}")
+        print("启动性能分析 - 导入耗时最长的模块（总耗时 / 自身耗时）:")
+        for item in report["slowest_imports"]:
+            print(f"  {item['total_s'] * 1000:>10.1f} ms / {item['self_s'] * 1000:>8.1f} ms  {item['module']}")
+        print("启动性能分析 - 组件初始化耗时:")
+        for name, elapsed in report["inits"].items():
+            print(f"  {elapsed * 1000:>10.1f} ms  {name}")
+
+class WarmupManager:
+    """
+    启动预热管理器
+
+    服务启动后在后台线程中依次初始化耗时较长的组件（如导入LiteLLM、构建知识库索引），
+    所有组件完成之前就绪检查返回未就绪，负载均衡器不会把流量转发到该实例。
+    """
+
+    def __init__(self, profiler: Optional[StartupProfiler] = None):
+        """
+        初始化启动预热管理器
+
+        参数:
+            profiler: 启动性能分析器，提供时记录各组件的初始化耗时
+        """
+        self.profiler = profiler
+        self._components: Dict[str, Callable[[], Any]] = {}
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, initializer: Callable[[], Any]):
+        """
+        注册需要预热的组件
+
+        参数:
+            name: 组件名称
+            initializer: 初始化函数，重复调用应当是幂等的
+        """
+        self._components[name] = initializer
+        self._status[name] = {"state": "pending"}
+
+    def start(self):
+        """在后台线程中开始预热"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """依次初始化各组件"""
+        for name, initializer in self._components.items():
+            self._status[name] = {"state": "running"}
+            start = time.perf_counter()
+            try:
+                initializer()
+            except Exception as e:
+                print(f"预热组件{name}失败: {str(e)}")
+                self._status[name] = {"state": "failed", "error": str(e)}
+                continue
+            elapsed = time.perf_counter() - start
+            self._status[name] = {"state": "ready", "elapsed_s": elapsed}
+            if self.profiler is not None:
+                self.profiler.record_init(name, elapsed)
+        if self.profiler is not None:
+            self.profiler.print_report()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待预热完成
+
+        返回:
+            bool: 是否所有组件都已就绪
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.is_ready()
+
+    def is_ready(self) -> bool:
+        """所有组件都已就绪时返回True"""
+        return all(status["state"] == "ready" for status in self._status.values())
+
+    def status(self) -> Dict[str, Any]:
+        """返回预热状态"""
+        return {"ready": self.is_ready(), "components": dict(self._status)}
+
+# 创建全局的启动性能分析器和预热管理器
+startup_profiler = StartupProfiler() if STARTUP_PROFILE else None
+warmup_manager = WarmupManager(startup_profiler)
@@ -0,0 +1,236 @@
+import os
+import time
+import uuid
+import random
+import threading
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional
+
+# 请求头中携带该字段（值为1/true）时记录该请求的追踪信息
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace")
+
+# 未携带追踪请求头的请求按该比例抽样追踪，0表示只追踪携带请求头的请求
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+# 性能剖析模式：空（不剖析）、cprofile或pyinstrument，只剖析被追踪的请求
+TRACE_PROFILE_MODE = os.getenv("TRACE_PROFILE_MODE", "").lower()
+TRACE_PROFILE_THRESHOLD_MS = float(os.getenv("TRACE_PROFILE_THRESHOLD_MS", "1000"))
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles"))
+
+# SQL语句在追踪信息中保留的最大长度
+MAX_STATEMENT_LENGTH = 200
+
+class Span:
+    """追踪中的一个时间段"""
+
+    __slots__ = ("name", "start", "end", "depth", "attrs")
+
+    def __init__(self, name: str, start: float, depth: int, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.depth = depth
+        self.attrs = attrs
+
+class Trace:
+    """一个请求的追踪信息，包含按开始时间排列的嵌套时间段"""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        # 线程池中的时间段同样追加到该列表（list.append在GIL下是原子的）
+        self.spans: List[Span] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        返回追踪信息
+
+        返回:
+            Dict[str, Any]: 包含trace_id、total_ms和spans（名称、相对请求开始的时间、耗时、嵌套深度），
+                            尚未结束的时间段duration_ms为None
+        """
+        now = time.perf_counter()
+        spans = []
+        for span in self.spans:
+            item = {
+                "name": span.name,
+                "start_ms": round((span.start - self.start) * 1000, 3),
+                "duration_ms": round((span.end - span.start) * 1000, 3) if span.end is not None else None,
+                "depth": span.depth
+            }
+            if span.attrs:
+                item["attrs"] = span.attrs
+            spans.append(item)
+        return {"trace_id": self.trace_id, "total_ms": round((now - self.start) * 1000, 3), "spans": spans}
+
+    def server_timing(self) -> str:
+        """返回Server-Timing响应头的值，按名称汇总第一层时间段的耗时"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            if span.depth == 0 and span.end is not None:
+                totals[span.name] = totals.get(span.name, 0.0) + (span.end - span.start) * 1000
+        return ", ".join(f"{name.replace('.', '_')};dur={duration:.3f}" for name, duration in totals.items())
+
+# 当前请求的追踪信息和当前时间段的嵌套深度，asyncio.to_thread会复制上下文，线程池中同样可以记录
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_depth: ContextVar[int] = ContextVar("current_depth", default=0)
+
+class _SpanContext:
+    """时间段上下文管理器，当前请求未被追踪时不做任何事情"""
+
+    __slots__ = ("name", "attrs", "span", "token")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]]):
+        self.name = name
+        self.attrs = attrs
+        self.span: Optional[Span] = None
+
+    def __enter__(self):
+        trace = _current_trace.get()
+        if trace is not None:
+            depth = _current_depth.get()
+            self.span = Span(self.name, time.perf_counter(), depth, self.attrs)
+            trace.spans.append(self.span)
+            self.token = _current_depth.set(depth + 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        if span is not None:
+            span.end = time.perf_counter()
+            if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+                span.attrs = {**(span.attrs or {}), "error": exc_type.__name__}
+            try:
+                _current_depth.reset(self.token)
+            except ValueError:
+                # 异步生成器在其他上下文中结束时无法重置，直接恢复深度
+                _current_depth.set(span.depth)
+        return False
+
+def trace_span(name: str, **attrs) -> _SpanContext:
+    """
+    记录一个时间段
+
+    用法:
+        with trace_span("kb.search", top_k=3):
+            ...
+    """
+    return _SpanContext(name, attrs or None)
+
+def get_current_trace() -> Optional[Trace]:
+    """返回当前请求的追踪信息，未被追踪时返回None"""
+    return _current_trace.get()
+
+def should_trace(header_value: Optional[str]) -> bool:
+    """根据请求头和抽样比例判断是否追踪该请求"""
+    if header_value is not None and header_value.lower() in ("1", "true", "yes"):
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+def start_trace(trace_id: Optional[str] = None) -> Trace:
+    """开始追踪当前请求"""
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    _current_depth.set(0)
+    return trace
+
+class RequestProfiler:
+    """
+    请求性能剖析
+
+    cprofile模式使用标准库cProfile（同一时间只能剖析一个请求，其余请求不剖析），输出.prof文件，可用snakeviz等工具查看；
+    pyinstrument模式支持异步调用栈，输出HTML报告，未安装pyinstrument时回退为cprofile。
+    只有耗时超过TRACE_PROFILE_THRESHOLD_MS的请求才写入TRACE_PROFILE_DIR。
+    """
+
+    _cprofile_lock = threading.Lock()
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._profiler = None
+        self._owns_lock = False
+
+    def start(self):
+        """开始剖析"""
+        if self.mode == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+                self._profiler = Profiler(async_mode="enabled")
+                self._profiler.start()
+                return
+            except ImportError:
+                print("未安装pyinstrument，使用cProfile进行性能剖析")
+                self.mode = "cprofile"
+        if self.mode == "cprofile" and RequestProfiler._cprofile_lock.acquire(blocking=False):
+            import cProfile
+            self._owns_lock = True
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self, trace: Trace, elapsed_ms: float) -> Optional[str]:
+        """
+        停止剖析，请求耗时超过阈值时写入剖析文件
+
+        返回:
+            Optional[str]: 剖析文件路径，未写入时返回None
+        """
+        if self._profiler is None:
+            return None
+        try:
+            if self.mode == "pyinstrument":
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+            if elapsed_ms < TRACE_PROFILE_THRESHOLD_MS:
+                return None
+            os.makedirs(TRACE_PROFILE_DIR, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.trace_id}-{int(elapsed_ms)}ms"
+            if self.mode == "pyinstrument":
+                path = os.path.join(TRACE_PROFILE_DIR, name + ".html")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(self._profiler.output_html())
+            else:
+                path = os.path.join(TRACE_PROFILE_DIR, name + ".prof")
+                self._profiler.dump_stats(path)
+            return path
+        except Exception as e:
+            print(f"写入性能剖析文件失败: {str(e)}")
+            return None
+        finally:
+            if self._owns_lock:
+                self._owns_lock = False
+                RequestProfiler._cprofile_lock.release()
+
+def create_profiler() -> Optional[RequestProfiler]:
+    """配置了TRACE_PROFILE_MODE时创建并开始请求性能剖析"""
+    if TRACE_PROFILE_MODE not in ("cprofile", "pyinstrument"):
+        return None
+    profiler = RequestProfiler(TRACE_PROFILE_MODE)
+    profiler.start()
+    return profiler
+
+def install_db_tracing(engine: Any):
+    """为数据库引擎注册事件，在被追踪的请求中把每条SQL语句记录为db.query时间段"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is None:
+            return
+        span = trace_span("db.query", statement=" ".join(statement.split())[:MAX_STATEMENT_LENGTH])
+        span.__enter__()
+        conn.info.setdefault("trace_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            spans.pop().__exit__(None, None, None)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("trace_spans") if conn is not None else None
+        if spans:
+            error = type(exception_context.original_exception)
+            spans.pop().__exit__(error, exception_context.original_exception, None)
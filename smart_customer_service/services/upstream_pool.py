@@ -0,0 +1,491 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable, AsyncGenerator
+
+# 默认上游配置，LLM_UPSTREAMS未配置时使用，API密钥没有默认值，必须通过环境变量配置
+LLM_MODEL = os.getenv("LLM_MODEL", "Qwen/QwQ-32B")
+LLM_API_BASE = os.getenv("LLM_API_BASE", "https://api.siliconflow.cn/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+
+# 被动健康检查：连续失败达到次数后摘除，摘除时间随连续摘除次数翻倍
+UPSTREAM_EJECT_FAILURES = int(os.getenv("UPSTREAM_EJECT_FAILURES", "3"))
+UPSTREAM_EJECT_SECONDS = float(os.getenv("UPSTREAM_EJECT_SECONDS", "30"))
+UPSTREAM_EJECT_MAX_SECONDS = float(os.getenv("UPSTREAM_EJECT_MAX_SECONDS", "300"))
+
+# 单个请求最多尝试的上游数量（失败后换一个上游重试）
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "2"))
+
+# 对冲请求：等待超过上游延迟的p95后向另一个上游发出相同请求，先返回的结果胜出
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_DELAY = float(os.getenv("UPSTREAM_HEDGE_DELAY", "3.0"))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+UPSTREAM_HEDGE_MAX_RATIO = float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.1"))
+
+# 每个上游保留的最近延迟样本数
+LATENCY_WINDOW = 1000
+
+# 视为上游故障的异常类名（包括httpx的传输层异常），这些异常计入摘除并换上游重试
+UPSTREAM_ERROR_NAMES = {"TimeoutException", "TransportError", "Timeout", "APIConnectionError"}
+
+def is_upstream_error(error: BaseException) -> bool:
+    """
+    判断异常是否为上游故障（超时、连接错误、429和5xx）
+
+    请求本身的错误（400、上下文超长、401鉴权失败等4xx）换上游重试也会失败，不计入摘除也不重试
+
+    参数:
+        error: 调用上游时抛出的异常
+
+    返回:
+        bool: 是否为上游故障
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in (408, 429) or status_code >= 500
+    return any(cls.__name__ in UPSTREAM_ERROR_NAMES for cls in type(error).__mro__)
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """计算样本的分位数（最近秩法），没有样本时返回None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+class Upstream:
+    """单个上游端点（API基础URL和API密钥）及其负载和延迟统计"""
+
+    def __init__(self, name: str, api_base: str, api_key: str, model: str, provider: str = "openai"):
+        """
+        初始化上游端点
+
+        参数:
+            name: 上游名称，用于统计信息
+            api_base: API基础URL
+            api_key: API密钥
+            model: 上游使用的模型名称
+            provider: LiteLLM的custom_llm_provider
+        """
+        self.name = name
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+        self.provider = provider
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # 非流式请求的完整响应延迟和流式请求的首个片段延迟（秒）
+        self.latencies: Dict[str, deque] = {"completion": deque(maxlen=LATENCY_WINDOW), "ttft": deque(maxlen=LATENCY_WINDOW)}
+
+    def call_params(self) -> Dict[str, Any]:
+        """返回调用LiteLLM时的上游参数"""
+        return {"model": self.model, "api_key": self.api_key, "api_base": self.api_base, "custom_llm_provider": self.provider}
+
+    def is_available(self, now: float) -> bool:
+        """未被摘除时返回True"""
+        return self.ejected_until <= now
+
+    def begin(self):
+        """开始一个请求"""
+        self.outstanding += 1
+        self.requests += 1
+
+    def end(self):
+        """结束一个请求"""
+        self.outstanding -= 1
+
+    def record_success(self, kind: str, latency: float):
+        """记录成功的请求，恢复连续失败计数"""
+        self.latencies[kind].append(latency)
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        """记录失败的请求，连续失败达到阈值时摘除该上游"""
+        self.failures += 1
+        self.consecutive_failures += 1
+        # 并发进行中的请求在摘除后失败时不重复摘除
+        if self.consecutive_failures >= UPSTREAM_EJECT_FAILURES and self.is_available(time.monotonic()):
+            self.ejections += 1
+            backoff = min(UPSTREAM_EJECT_SECONDS * (2 ** (self.consecutive_failures // UPSTREAM_EJECT_FAILURES - 1)), UPSTREAM_EJECT_MAX_SECONDS)
+            self.ejected_until = time.monotonic() + backoff
+            print(f"上游{self.name}连续失败{self.consecutive_failures}次，摘除{backoff:.0f}秒")
+
+    def p95(self, kind: str) -> Optional[float]:
+        """返回最近请求延迟的p95，样本不足时返回None"""
+        samples = self.latencies[kind]
+        if len(samples) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(list(samples), 0.95)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回上游统计信息（不包含API密钥）"""
+        now = time.monotonic()
+        result = {
+            "name": self.name,
+            "api_base": self.api_base,
+            "model": self.model,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "ejected": not self.is_available(now),
+            "ejected_remaining_s": max(0.0, self.ejected_until - now)
+        }
+        for kind, samples in self.latencies.items():
+            samples = list(samples)
+            result[f"{kind}_latency"] = {
+                "samples": len(samples),
+                "p50_s": percentile(samples, 0.5),
+                "p95_s": percentile(samples, 0.95),
+                "p99_s": percentile(samples, 0.99)
+            }
+        return result
+
+class UpstreamPool:
+    """
+    上游连接池服务类
+
+    每个模型可以配置多个上游端点，按未完成请求数最少（least outstanding requests）选择上游，
+    连续失败的上游被暂时摘除（被动健康检查），因上游故障（超时、连接错误、429和5xx）失败的请求换一个上游重试。
+    启用对冲请求时，请求耗时超过当前上游延迟的p95后向另一个上游发出相同的请求，
+    先成功的结果胜出，另一个请求被取消；对冲请求数量不超过总请求数的一定比例，避免放大上游负载。
+    流式请求以首个片段的到达作为完成标志进行对冲。
+    """
+
+    def __init__(self, upstreams: Optional[Dict[str, List[Upstream]]] = None, default_model: str = LLM_MODEL):
+        """
+        初始化上游连接池
+
+        参数:
+            upstreams: 模型名称 -> 上游列表，不提供时从环境变量加载
+            default_model: 未配置上游的模型使用该模型的上游
+        """
+        self.upstreams = upstreams if upstreams is not None else load_upstreams()
+        self.default_model = default_model if default_model in self.upstreams else next(iter(self.upstreams))
+        # 统计信息
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+
+    def resolve_model(self, model: str) -> str:
+        """
+        将请求中的模型名称解析为配置的模型名称，未配置的模型使用默认模型的上游
+
+        参数:
+            model: 请求中的模型名称（来自客户端，取值不受限制）
+
+        返回:
+            str: 配置中的模型名称，调度器的并发槽位按该名称划分
+        """
+        return model if model in self.upstreams else self.default_model
+
+    def metric_label(self, model: str) -> str:
+        """
+        获取模型在监控指标中的标签值，未配置的模型统一记为other，避免客户端传入的模型名称使指标序列无限增长
+
+        参数:
+            model: 请求中的模型名称
+
+        返回:
+            str: 配置中的模型名称或other
+        """
+        return model if model in self.upstreams else "other"
+
+    def get_upstreams(self, model: str) -> List[Upstream]:
+        """返回模型的上游列表"""
+        return self.upstreams[self.resolve_model(model)]
+
+    def select(self, model: str, exclude: Optional[List[Upstream]] = None) -> Optional[Upstream]:
+        """
+        选择未完成请求数最少的可用上游
+
+        参数:
+            model: 模型名称
+            exclude: 不参与选择的上游（如本次请求已经使用过的上游）
+
+        返回:
+            Optional[Upstream]: 选中的上游，没有可选的上游时返回None；所有上游都被摘除时选择最先恢复的上游
+        """
+        now = time.monotonic()
+        candidates = [upstream for upstream in self.get_upstreams(model) if not exclude or upstream not in exclude]
+        if not candidates:
+            return None
+        available = [upstream for upstream in candidates if upstream.is_available(now)]
+        if not available:
+            return min(candidates, key=lambda upstream: upstream.ejected_until)
+        least = min(upstream.outstanding for upstream in available)
+        return random.choice([upstream for upstream in available if upstream.outstanding == least])
+
+    def _hedge_delay(self, upstream: Upstream, kind: str) -> Optional[float]:
+        """返回发出对冲请求前的等待时间，未启用对冲时返回None"""
+        if not UPSTREAM_HEDGE_ENABLED:
+            return None
+        p95 = upstream.p95(kind)
+        return p95 if p95 is not None else UPSTREAM_HEDGE_DELAY
+
+    def _hedge_allowed(self) -> bool:
+        """对冲请求数量未超过总请求数的UPSTREAM_HEDGE_MAX_RATIO时返回True"""
+        return self.hedges < self.requests * UPSTREAM_HEDGE_MAX_RATIO
+
+    async def _race(self, model: str, kind: str, attempt: Callable[[Upstream], Awaitable[Any]],
+                    discard: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        在一个或多个上游上执行请求，返回第一个成功的结果
+
+        参数:
+            model: 模型名称
+            kind: 延迟统计类型（completion或ttft）
+            attempt: 在指定上游上执行请求的协程函数
+            discard: 释放落败请求结果的协程函数
+
+        返回:
+            Any: 第一个成功的结果，所有尝试都失败时抛出最后一个异常；请求本身的错误（4xx）直接抛出，不换上游重试
+        """
+        self.requests += 1
+        tried: List[Upstream] = []
+        pending: Dict[asyncio.Task, Upstream] = {}
+
+        def launch() -> bool:
+            upstream = self.select(model, tried)
+            if upstream is None:
+                return False
+            tried.append(upstream)
+            pending[asyncio.ensure_future(attempt(upstream))] = upstream
+            return True
+
+        launch()
+        hedge_delay = self._hedge_delay(tried[0], kind)
+        hedge: Optional[Upstream] = None
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                # 只在第一个请求进行中时对冲一次
+                timeout = hedge_delay if len(tried) == 1 else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_delay = None
+                    if self._hedge_allowed() and launch():
+                        hedge = tried[-1]
+                        self.hedges += 1
+                    continue
+                for task in done:
+                    upstream = pending.pop(task)
+                    if task.exception() is None:
+                        if upstream is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                    if not is_upstream_error(last_error):
+                        raise last_error
+                # 失败后换一个上游重试（已经有对冲请求在进行中时不再重试）
+                if not pending and len(tried) < UPSTREAM_MAX_ATTEMPTS and launch():
+                    self.retries += 1
+            raise last_error if last_error is not None else RuntimeError(f"模型{model}没有可用的上游")
+        finally:
+            # 取消落败的请求，已经完成的结果交给discard释放
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(lambda done: asyncio.ensure_future(discard(done.result())) if not done.cancelled() and done.exception() is None else None)
+
+    async def completion(self, model: str, **params) -> Any:
+        """
+        调用大模型获取完整响应
+
+        参数:
+            model: 模型名称
+            params: 传给litellm.acompletion的其他参数（messages、max_tokens、temperature等）
+
+        返回:
+            Any: LiteLLM的响应对象
+        """
+        import litellm
+
+        async def attempt(upstream: Upstream) -> Any:
+            upstream.begin()
+            start = time.monotonic()
+            try:
+                response = await litellm.acompletion(**params, **upstream.call_params(), stream=False)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if is_upstream_error(e):
+                    upstream.record_failure()
+                raise
+            finally:
+                upstream.end()
+            upstream.record_success("completion", time.monotonic() - start)
+            return response
+
+        async def discard(response: Any):
+            pass
+
+        return await self._race(model, "completion", attempt, discard)
+
+    async def stream(self, model: str, **params) -> AsyncGenerator[Any, None]:
+        """
+        调用大模型获取流式响应
+
+        参数:
+            model: 模型名称
+            params: 传给litellm.acompletion的其他参数（messages、max_tokens、temperature等）
+
+        返回:
+            AsyncGenerator[Any, None]: LiteLLM的流式响应片段
+        """
+        import litellm
+
+        async def attempt(upstream: Upstream) -> Tuple[Upstream, Any, Any]:
+            # 等到首个片段到达才算成功，首个片段之前的失败可以换上游重试
+            upstream.begin()
+            start = time.monotonic()
+            try:
+                response = await litellm.acompletion(**params, **upstream.call_params(), stream=True)
+                iterator = response.__aiter__()
+                try:
+                    first = await iterator.__anext__()
+                except StopAsyncIteration:
+                    iterator = None
+                    first = None
+            except asyncio.CancelledError:
+                upstream.end()
+                raise
+            except Exception as e:
+                upstream.end()
+                if is_upstream_error(e):
+                    upstream.record_failure()
+                raise
+            upstream.record_success("ttft", time.monotonic() - start)
+            return upstream, iterator, first
+
+        async def discard(result: Tuple[Upstream, Any, Any]):
+            upstream, iterator, _ = result
+            upstream.end()
+            await self._close_iterator(iterator)
+
+        upstream, iterator, first = await self._race(model, "ttft", attempt, discard)
+        try:
+            if first is not None:
+                yield first
+            if iterator is not None:
+                async for chunk in iterator:
+                    yield chunk
+        except Exception as e:
+            if is_upstream_error(e):
+                upstream.record_failure()
+            raise
+        finally:
+            upstream.end()
+            # 调用方提前停止读取（客户端断开、协程被取消）时关闭上游的流式响应，释放连接
+            await self._close_iterator(iterator)
+
+    @staticmethod
+    async def _close_iterator(iterator: Any):
+        """关闭LiteLLM的流式响应迭代器，忽略关闭时的错误"""
+        if iterator is not None and hasattr(iterator, "aclose"):
+            try:
+                await iterator.aclose()
+            except Exception:
+                pass
+
+    def check_api_keys(self):
+        """
+        检查所有上游都配置了API密钥
+
+        异常:
+            ValueError: 存在未配置API密钥的上游
+        """
+        missing = [upstream.name for upstreams in self.upstreams.values() for upstream in upstreams if not upstream.api_key]
+        if missing:
+            raise ValueError(f"以下上游未配置API密钥（LLM_API_KEY或LLM_UPSTREAMS）: {', '.join(missing)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回上游连接池统计信息"""
+        return {
+            "default_model": self.default_model,
+            "hedge_enabled": UPSTREAM_HEDGE_ENABLED,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retries": self.retries,
+            "models": {model: [upstream.stats() for upstream in upstreams] for model, upstreams in self.upstreams.items()}
+        }
+
+def load_upstreams() -> Dict[str, List[Upstream]]:
+    """
+    从环境变量加载上游配置
+
+    LLM_UPSTREAMS为JSON对象（或LLM_UPSTREAMS_FILE指向的JSON文件），键为请求中的模型名称，值为上游列表，例如:
+        {"Qwen/QwQ-32B": [{"name": "a", "api_base": "https://a/v1", "api_key_env": "KEY_A"},
+                          {"name": "b", "api_base": "https://b/v1", "api_key": "sk-...", "model": "Qwen/QwQ-32B"}]}
+    每个上游的model默认为键名，provider默认为openai；api_key_env指定从哪个环境变量读取API密钥。
+    未配置时使用LLM_MODEL、LLM_API_BASE、LLM_API_KEY和LLM_PROVIDER组成的单个上游。
+
+    返回:
+        Dict[str, List[Upstream]]: 模型名称 -> 上游列表
+    """
+    raw = os.getenv("LLM_UPSTREAMS")
+    path = os.getenv("LLM_UPSTREAMS_FILE")
+    if not raw and path:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read()
+    if not raw:
+        return {LLM_MODEL: [Upstream("default", LLM_API_BASE, LLM_API_KEY, LLM_MODEL, LLM_PROVIDER)]}
+
+    upstreams: Dict[str, List[Upstream]] = {}
+    for model, items in json.loads(raw).items():
+        upstreams[model] = [
+            Upstream(
+                name=item.get("name") or f"{model}#{index}",
+                api_base=item["api_base"],
+                api_key=os.getenv(item["api_key_env"], "") if item.get("api_key_env") else item.get("api_key", ""),
+                model=item.get("model") or model,
+                provider=item.get("provider") or LLM_PROVIDER
+            )
+            for index, item in enumerate(items)
+        ]
+    if not any(upstreams.values()):
+        raise ValueError("LLM_UPSTREAMS中没有配置任何上游")
+    return {model: items for model, items in upstreams.items() if items}
+
+# 创建全局的上游连接池实例
+upstream_pool = UpstreamPool()
+
+# 提供便捷的函数
+async def upstream_completion(model: str, **params) -> Any:
+    """便捷函数，通过上游连接池获取完整响应"""
+    return await upstream_pool.completion(model, **params)
+
+def upstream_stream(model: str, **params) -> AsyncGenerator[Any, None]:
+    """便捷函数，通过上游连接池获取流式响应"""
+    return upstream_pool.stream(model, **params)
+
+def resolve_upstream_model(model: str) -> str:
+    """便捷函数，将请求中的模型名称解析为配置的模型名称"""
+    return upstream_pool.resolve_model(model)
+
+def upstream_model_label(model: str) -> str:
+    """便捷函数，获取模型在监控指标中的标签值"""
+    return upstream_pool.metric_label(model)
+
+def check_upstream_api_keys():
+    """便捷函数，检查所有上游都配置了API密钥"""
+    upstream_pool.check_api_keys()
+
+def get_upstream_stats() -> Dict[str, Any]:
+    """便捷函数，获取上游连接池统计信息"""
+    return upstream_pool.stats()
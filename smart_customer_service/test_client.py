@@ -140,6 +140,9 @@ def test_streaming_response():
                         json_data = decoded_line[6:]
                         try:
                             data = json.loads(json_data)
+                            # 最后一帧携带完整响应，不重复输出
+                            if data.get('is_final'):
+                                continue
                             content = data.get('content', '')
                             print(content, end='', flush=True)
                             full_response += content
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# 测试使用临时数据库，必须在导入服务模块（创建数据库引擎）之前设置，避免写入实际的数据库
+_test_dir = tempfile.mkdtemp(prefix="smart-cs-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_test_dir, 'test.db')}"
+os.environ["DB_ASYNC_ENABLED"] = "false"
+os.environ["RESPONSE_CACHE_DB"] = ""
+os.environ["KB_PERSIST"] = "false"
+
+# 服务模块以项目目录为导入根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
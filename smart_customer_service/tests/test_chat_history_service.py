@@ -0,0 +1,69 @@
+"""
+聊天历史游标（keyset）分页测试：逐页读取时不重复、不遗漏，时间戳相同的记录按ID区分先后
+"""
+import random
+from datetime import datetime, timedelta
+import pytest
+from database.database import init_db, SessionLocal, ChatHistory
+from services.chat_history_service import chat_history_service, decode_history_cursor, encode_history_cursor
+
+USER_ID = "pagination-user"
+
+@pytest.fixture(scope="module")
+def history_ids():
+    """写入测试记录，返回每个会话的记录ID按(timestamp, id)倒序排列的列表，None键为全部记录"""
+    init_db()
+    rng = random.Random(7)
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    db = SessionLocal()
+    try:
+        records = []
+        for i in range(157):
+            # 大量记录共用同一个时间戳，检验游标在时间戳相同的记录之间的定位
+            timestamp = base + timedelta(seconds=rng.randint(0, 20))
+            records.append(ChatHistory(user_id=USER_ID, session_id=f"s{i % 3}", role="user", content=f"消息{i}", timestamp=timestamp))
+        # 其他用户的记录不应出现在结果中
+        records.append(ChatHistory(user_id="other-user", session_id="s0", role="user", content="其他", timestamp=base))
+        db.add_all(records)
+        db.commit()
+        rows = db.query(ChatHistory.id, ChatHistory.session_id, ChatHistory.timestamp).filter(ChatHistory.user_id == USER_ID).all()
+    finally:
+        db.close()
+    ordered = sorted(rows, key=lambda row: (row.timestamp, row.id), reverse=True)
+    result = {None: [row.id for row in ordered]}
+    for session_id in ("s0", "s1", "s2"):
+        result[session_id] = [row.id for row in ordered if row.session_id == session_id]
+    return result
+
+def walk_pages(limit: int, session_id=None):
+    """按next_cursor逐页读取，返回记录ID序列和页数"""
+    ids = []
+    pages = 0
+    cursor = None
+    while True:
+        page = chat_history_service.get_user_chat_history_page(USER_ID, session_id=session_id, limit=limit, cursor=cursor)
+        pages += 1
+        assert len(page["history"]) <= limit
+        ids.extend(record["id"] for record in page["history"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+@pytest.mark.parametrize("limit", [1, 2, 7, 10, 50, 156, 157, 1000])
+def test_cursor_walk_covers_all_rows_once(history_ids, limit):
+    ids, pages = walk_pages(limit)
+    assert ids == history_ids[None]
+    assert pages == max(1, -(-len(ids) // limit))
+
+@pytest.mark.parametrize("session_id", ["s0", "s1", "s2"])
+def test_cursor_walk_within_session(history_ids, session_id):
+    ids, _ = walk_pages(4, session_id)
+    assert ids == history_ids[session_id]
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    assert decode_history_cursor(encode_history_cursor(timestamp, 42)) == (timestamp, 42)
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        chat_history_service.get_user_chat_history_page(USER_ID, cursor="not-a-cursor")
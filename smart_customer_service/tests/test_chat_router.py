@@ -0,0 +1,130 @@
+"""
+聊天接口测试：流式接口的空响应，批量接口按完成顺序输出NDJSON，客户端断开时取消进行中的大模型调用
+"""
+import sys
+import json
+import time
+import types
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import api.chat_router as chat_router
+from database.database import init_db, SessionLocal, ChatHistory
+from models.chat_models import ChatRequest, Message
+from services.chat_service import process_chat_batch
+from services.history_writer import flush_history
+from services.llm_scheduler import llm_scheduler
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.include_router(chat_router.router)
+    return TestClient(app)
+
+def chat_payload(content: str = "你好") -> dict:
+    return {"user_id": "router-user", "messages": [{"role": "user", "content": content}]}
+
+def test_empty_stream_returns_empty_event_stream(monkeypatch):
+    async def empty_stream():
+        return
+        yield
+
+    async def process_chat_request(request, stream=False):
+        return empty_stream()
+
+    monkeypatch.setattr(chat_router, "process_chat_request", process_chat_request)
+    response = make_client().post("/chat/stream", json=chat_payload())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.content == b""
+
+class FakeResponse(types.SimpleNamespace):
+    """LiteLLM响应对象"""
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+class FakeLiteLLM:
+    """假的litellm模块：问题中包含“慢”时长时间不返回，包含“错”时抛出请求错误"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+
+    async def acompletion(self, messages, **params):
+        self.started += 1
+        question = messages[-1]["content"]
+        try:
+            await asyncio.sleep(5 if "慢" in question else 0.01)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if "错" in question:
+            raise ValueError("bad request")
+        usage = FakeResponse(prompt_tokens=3, completion_tokens=2, total_tokens=5)
+        return FakeResponse(choices=[FakeResponse(message=FakeResponse(content=f"回答{len(messages)}"))], usage=usage)
+
+def install_fake_litellm(monkeypatch) -> FakeLiteLLM:
+    fake = FakeLiteLLM()
+    monkeypatch.setitem(sys.modules, "litellm", types.SimpleNamespace(acompletion=fake.acompletion))
+    return fake
+
+def history_roles(user_id: str):
+    db = SessionLocal()
+    try:
+        return [record.role for record in db.query(ChatHistory.role).filter(ChatHistory.user_id == user_id)]
+    finally:
+        db.close()
+
+def test_batch_returns_ndjson_lines(monkeypatch):
+    init_db()
+    install_fake_litellm(monkeypatch)
+    requests = [chat_payload(f"批量问题{index}") for index in range(3)] + [chat_payload("出错的问题")]
+    for request in requests:
+        request["user_id"] = "batch-ndjson-user"
+    response = make_client().post("/chat/batch", json={"requests": requests, "concurrency": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.content.splitlines()]
+    # 每个请求一行（按完成顺序），最后一行为汇总
+    assert lines[-1] == {"done": True, "total": 4, "failed": 1}
+    results = {line["index"]: line for line in lines[:-1]}
+    assert sorted(results) == [0, 1, 2, 3]
+    assert results[3]["status_code"] == 500 and "response" not in results[3]
+    for index in range(3):
+        assert results[index]["response"]["message"]["role"] == "assistant"
+        assert results[index]["response"]["usage"]["total_tokens"] == 5
+    assert flush_history(5)
+    assert sorted(history_roles("batch-ndjson-user")) == ["assistant"] * 4 + ["user"] * 4
+
+def test_batch_too_large_is_rejected(monkeypatch):
+    monkeypatch.setattr(chat_router, "BATCH_MAX_SIZE", 2)
+    response = make_client().post("/chat/batch", json={"requests": [chat_payload()] * 3})
+    assert response.status_code == 413
+
+def test_batch_disconnect_cancels_upstream_calls(monkeypatch):
+    init_db()
+    fake = install_fake_litellm(monkeypatch)
+
+    async def scenario():
+        requests = [ChatRequest(user_id="batch-cancel-user", messages=[Message(role="user", content=("快" if index == 0 else "慢") + f"问题{index}")])
+                    for index in range(10)]
+        results = await process_chat_batch(requests, concurrency=3)
+        first = await results.__anext__()
+        start = time.perf_counter()
+        # 客户端断开时StreamingResponse关闭结果生成器
+        await results.aclose()
+        elapsed = time.perf_counter() - start
+        active = sum(lane["active"] + lane["waiting"] for lane in llm_scheduler.stats()["models"].values())
+        return first, elapsed, active
+
+    first, elapsed, active = asyncio.run(scenario())
+    assert first["index"] == 0 and "response" in first
+    # 进行中的慢请求被取消而不是等到完成，调度槽位全部释放
+    assert elapsed < 1
+    assert fake.cancelled == fake.started - 1 >= 2
+    assert active == 0
+    assert flush_history(5)
+    roles = history_roles("batch-cancel-user")
+    # 已完成的请求照常写入，尚未开始的请求不记录，被取消的请求不记录错误回复
+    assert roles.count("assistant") == 1
+    assert 2 <= roles.count("user") <= 4
@@ -0,0 +1,72 @@
+"""
+聊天历史后台写入器测试：多组记录合并为一次提交，整批失败时逐组重试，只丢弃重试仍然失败的记录组
+"""
+from database.database import init_db, SessionLocal, ChatHistory
+from services.history_writer import HistoryWriter
+from services.chat_service import build_history_row
+
+def count_rows(user_id: str) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(ChatHistory).filter(ChatHistory.user_id == user_id).count()
+    finally:
+        db.close()
+
+def turn(user_id: str, index: int):
+    return [
+        build_history_row(user_id, "s1", "user", f"问题{index}"),
+        build_history_row(user_id, "s1", "assistant", f"回答{index}"),
+    ]
+
+def test_groups_are_written_in_one_batch():
+    init_db()
+    writer = HistoryWriter(batch_size=1000, flush_interval=0.2)
+    for index in range(10):
+        writer.submit(turn("batch-user", index))
+    assert writer.flush(5)
+    writer.stop()
+    assert count_rows("batch-user") == 20
+    assert writer.written_count == 20 and writer.failed_count == 0
+    # 刷新间隔内提交的记录组合并为一个事务
+    assert writer.batch_count == 1
+
+def test_failed_group_does_not_drop_other_groups():
+    init_db()
+    writer = HistoryWriter(batch_size=1000, flush_interval=0.2)
+    writer.submit(turn("retry-user", 0))
+    writer.submit(turn("retry-user", 1))
+    assert writer.flush(5)
+    db = SessionLocal()
+    try:
+        existing_id = db.query(ChatHistory.id).filter(ChatHistory.user_id == "retry-user").first().id
+    finally:
+        db.close()
+    # 主键冲突的记录组使整批提交失败，逐组重试时只有这一组失败
+    bad_group = turn("retry-user", 2)
+    bad_group[0]["id"] = existing_id
+    writer.submit(turn("retry-user", 3))
+    writer.submit(bad_group)
+    writer.submit(turn("retry-user", 4))
+    assert writer.flush(5)
+    writer.stop()
+    assert count_rows("retry-user") == 8
+    assert writer.failed_count == len(bad_group)
+    assert writer.written_count == 8
+
+def test_stop_writes_remaining_rows():
+    init_db()
+    writer = HistoryWriter(batch_size=1000, flush_interval=5)
+    writer.submit(turn("stop-user", 0))
+    # 停止时不等待刷新间隔，直接写入队列中剩余的记录
+    writer.stop()
+    assert count_rows("stop-user") == 2
+
+def test_flush_session_waits_only_for_that_session():
+    init_db()
+    writer = HistoryWriter(batch_size=1000, flush_interval=0.3)
+    writer.submit(turn("session-user", 0))
+    assert not writer.flush_session("session-user", "s1", timeout=0.01)
+    assert writer.flush_session("other-user", "s1", timeout=0.01)
+    assert writer.flush_session("session-user", "s1", timeout=5)
+    assert count_rows("session-user") == 2
+    writer.stop()
@@ -0,0 +1,75 @@
+"""
+离线索引测试：保存后内存映射加载的索引与内存中构建的索引检索结果一致，词表和条目ID映射按UTF-8字节二分查找
+"""
+import json
+import os
+import random
+import numpy as np
+import pytest
+import services.index_store as index_store
+from services.retrieval_engine import InvertedIndex, StringTable
+from services.index_store import save_index, load_index, MappedIdMap
+
+WORDS = ["退货", "退款", "发票", "快递", "物流", "会员", "积分", "优惠券", "密码", "账号", "Refund", "VIP", "ａｂｃ", "😀表情"]
+
+@pytest.fixture(scope="module")
+def entries():
+    rng = random.Random(11)
+    return [{"id": f"kb{rng.randrange(10 ** 6)}-{i}-{rng.choice(WORDS)}", "title": rng.choice(WORDS),
+             "content": "".join(rng.choice(WORDS) for _ in range(rng.randint(2, 8)))} for i in range(200)]
+
+@pytest.mark.parametrize("sorted_table", [False, True])
+def test_string_table_lookup_follows_str_order(sorted_table):
+    # 包含前8个字节相同的字符串，以及恰好8个字节、是更长字符串前缀的字符串
+    strings = sorted({"a", "b", "ab", "中", "中文", "z", "é", "😀", "Ａ", "abcdefgh", "abcdefghij", "abcdefghik", "international"})
+    table = StringTable.from_strings(strings, sorted_table=sorted_table)
+    assert list(table) == strings
+    assert table.lookup(strings).tolist() == list(range(len(strings)))
+    assert table.lookup(["", "c", "中国", "😁", "abcdefg", "abcdefghi", "internat", "internationalx"]).tolist() == [-1] * 8
+
+def test_loaded_index_matches_in_memory_index(tmp_path, entries):
+    index = InvertedIndex.build([index_store.document_text(item) for item in entries])
+    save_index(str(tmp_path), index, entries)
+    loaded, mapped_entries, _ = load_index(str(tmp_path))
+    # 词表以字节数组加偏移的形式内存映射，不再是定长字符串数组
+    assert isinstance(loaded.terms, StringTable) and isinstance(loaded.terms.blob, np.memmap)
+    assert list(loaded.terms) == index.terms.tolist()
+    tokens = index.terms.tolist()[::7] + ["不存在的词", "zzz"]
+    assert loaded.lookup_terms(tokens).tolist() == index.lookup_terms(tokens).tolist()
+    for query in WORDS + ["怎么退货退款", "没有关系"]:
+        assert loaded.search(query, top_k=5) == index.search(query, top_k=5)
+    assert list(mapped_entries) == entries
+
+def test_mapped_id_map(tmp_path, entries):
+    save_index(str(tmp_path), InvertedIndex.build([index_store.document_text(item) for item in entries]), entries)
+    _, _, id_to_doc = load_index(str(tmp_path))
+    assert isinstance(id_to_doc, MappedIdMap)
+    for idx, entry in enumerate(entries):
+        assert id_to_doc.get(entry["id"]) == idx
+    assert id_to_doc.get("missing") is None and "missing" not in id_to_doc
+    # 在线变更保存在内存中，覆盖内存映射的部分
+    first = entries[0]["id"]
+    assert id_to_doc.pop(first) == 0
+    assert first not in id_to_doc
+    with pytest.raises(KeyError):
+        id_to_doc.pop(first)
+    id_to_doc[first] = 500
+    id_to_doc["new"] = 501
+    assert id_to_doc.get(first) == 500 and id_to_doc.get("new") == 501
+
+def test_old_format_is_not_loaded(tmp_path, entries):
+    version_dir = save_index(str(tmp_path), InvertedIndex.build([index_store.document_text(item) for item in entries]), entries)
+    manifest_file = os.path.join(version_dir, "manifest.json")
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["format_version"] = 1
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    assert load_index(str(tmp_path)) is None
+
+def test_empty_index_round_trip(tmp_path):
+    save_index(str(tmp_path), InvertedIndex.empty(), [])
+    loaded, mapped_entries, id_to_doc = load_index(str(tmp_path))
+    assert len(loaded.terms) == 0 and len(mapped_entries) == 0
+    assert loaded.search("退货") == []
+    assert "kb1" not in id_to_doc
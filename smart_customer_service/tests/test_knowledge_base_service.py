@@ -0,0 +1,80 @@
+"""
+知识库服务测试：更新和删除通过删除标记屏蔽旧条目，合并重建清除删除标记并重放重建期间的变更
+"""
+import json
+import pytest
+import services.knowledge_base_service as knowledge_base_service
+from services.knowledge_base_service import KnowledgeBaseService
+from services.retrieval_engine import InvertedIndex
+
+TOPICS = ["退货流程", "发票开具", "快递查询", "会员积分", "密码找回", "售后保修"]
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    entries = [{"id": f"kb{i}", "title": TOPICS[i % len(TOPICS)], "content": f"{TOPICS[i % len(TOPICS)]}说明第{i}条"} for i in range(60)]
+    kb_file = tmp_path / "knowledge_base.json"
+    kb_file.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+    monkeypatch.setattr(knowledge_base_service, "KNOWLEDGE_BASE_FILE", str(kb_file))
+    monkeypatch.setattr(knowledge_base_service, "KB_INDEX_DIR", "")
+    # 阈值小于基础段文档数、大于测试中的变更数，不会自动触发后台合并
+    monkeypatch.setenv("KB_COMPACT_THRESHOLD", "50")
+    monkeypatch.setenv("KB_PERSIST", "false")
+    return KnowledgeBaseService()
+
+def result_ids(service: KnowledgeBaseService, query: str, top_k: int = 100):
+    return [item["id"] for item in service.search_knowledge_base(query, top_k=top_k)]
+
+def test_update_and_delete_use_tombstones(service):
+    assert "kb0" in result_ids(service, "退货流程")
+    updated = service.update_entry("kb0", content="量子纠缠售后政策")
+    assert updated["title"] == "退货流程"
+    # 旧版本被删除标记屏蔽，新版本追加到增量段
+    stats = service.stats()
+    assert stats["delta_documents"] == 1 and stats["deleted_documents"] == 1 and stats["entries"] == 60
+    assert service.get_entry("kb0")["content"] == "量子纠缠售后政策"
+    assert result_ids(service, "退货流程").count("kb0") == 1
+    assert service.delete_entry("kb6")
+    assert not service.delete_entry("kb6")
+    assert service.get_entry("kb6") is None
+    assert "kb6" not in result_ids(service, "退货流程")
+    assert service.stats()["entries"] == 59
+
+def test_compaction_clears_tombstones(service):
+    service.update_entry("kb1", content="发票开具新规定")
+    service.delete_entry("kb2")
+    added = service.add_entry({"title": "新主题", "content": "快递查询新渠道"})
+    service.compact()
+    stats = service.stats()
+    assert stats["delta_documents"] == 0 and stats["deleted_documents"] == 0
+    assert stats["base_documents"] == stats["entries"] == 60
+    assert service.get_entry("kb1")["content"] == "发票开具新规定"
+    assert service.get_entry("kb2") is None
+    assert service.get_entry(added["id"])["content"] == "快递查询新渠道"
+    assert added["id"] in result_ids(service, "快递查询新渠道", top_k=3)
+
+def test_compaction_replays_concurrent_changes(service, monkeypatch):
+    build = InvertedIndex.build
+    changes = {}
+
+    def build_with_concurrent_changes(documents, **kwargs):
+        # 重建期间（不持有写锁）发生的变更
+        if not changes:
+            changes["added"] = service.add_entry({"id": "during", "title": "重建期间", "content": "发票开具快递查询"})
+            service.update_entry("kb3", content="重建期间更新的会员积分")
+            service.delete_entry("kb4")
+        return build(documents, **kwargs)
+
+    monkeypatch.setattr(knowledge_base_service.InvertedIndex, "build", build_with_concurrent_changes)
+    service.delete_entry("kb5")
+    service.compact()
+    # 重建使用开始时的条目，期间的三次变更重放到新索引上
+    stats = service.stats()
+    assert stats["base_documents"] == 59
+    assert stats["delta_documents"] == 2 and stats["deleted_documents"] == 2
+    assert stats["entries"] == 59
+    assert service.get_entry("during")["content"] == "发票开具快递查询"
+    assert service.get_entry("kb3")["content"] == "重建期间更新的会员积分"
+    assert service.get_entry("kb4") is None and service.get_entry("kb5") is None
+    # 增量段沿用新基础段的词表，由已有词项组成的条目立即可被检索到
+    assert "during" in result_ids(service, "发票开具快递查询", top_k=3)
+    assert "kb4" not in result_ids(service, "密码找回") and "kb5" not in result_ids(service, "售后保修")
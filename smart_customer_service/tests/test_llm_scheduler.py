@@ -0,0 +1,112 @@
+"""
+大模型调度器测试：并发上限按配置的模型划分，队列满时429、排队超时503并带有Retry-After，高优先级请求挤掉低优先级请求
+"""
+import asyncio
+import pytest
+from services.llm_scheduler import LLMScheduler, SchedulerRejected, PRIORITY_VIP, PRIORITY_NORMAL, PRIORITY_BATCH
+from services.upstream_pool import UpstreamPool, Upstream
+
+def make_scheduler(**kwargs) -> LLMScheduler:
+    """创建只配置了known模型的调度器"""
+    pool = UpstreamPool({"known": [Upstream("a", "http://a/v1", "key", "known")]})
+    kwargs.setdefault("default_concurrency", 1)
+    kwargs.setdefault("max_queue", 1)
+    kwargs.setdefault("queue_timeout", 5)
+    scheduler = LLMScheduler(resolve_model=pool.resolve_model, **kwargs)
+    scheduler.enabled = True
+    return scheduler
+
+def test_unknown_models_share_default_capacity():
+    async def scenario():
+        scheduler = make_scheduler(max_queue=0)
+        await scheduler.acquire("unknown-a")
+        # 另一个未配置的模型名称解析到同一个通道，槽位已被占用
+        with pytest.raises(SchedulerRejected) as rejected:
+            scheduler.check_admission("unknown-b")
+        assert rejected.value.status_code == 429
+        with pytest.raises(SchedulerRejected):
+            await scheduler.acquire("known")
+        scheduler.release("unknown-c")
+        await scheduler.acquire("unknown-d")
+        assert list(scheduler.stats()["models"]) == ["known"]
+    asyncio.run(scenario())
+
+def test_queue_full_rejects_with_retry_after():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire("known")
+        waiter = asyncio.create_task(scheduler.acquire("known"))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerRejected) as rejected:
+            await scheduler.acquire("known")
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after >= 1
+        scheduler.release("known")
+        await waiter
+        assert scheduler.stats()["models"]["known"]["active"] == 1
+    asyncio.run(scenario())
+
+def test_queue_timeout_rejects_with_503():
+    async def scenario():
+        scheduler = make_scheduler(queue_timeout=0.05)
+        await scheduler.acquire("known")
+        with pytest.raises(SchedulerRejected) as rejected:
+            await scheduler.acquire("known")
+        assert rejected.value.status_code == 503
+        assert rejected.value.retry_after >= 1
+        stats = scheduler.stats()["models"]["known"]
+        assert stats["rejected_timeout"] == 1
+        assert stats["waiting"] == 0
+    asyncio.run(scenario())
+
+def test_higher_priority_evicts_lowest_waiter():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire("known")
+        batch = asyncio.create_task(scheduler.acquire("known", PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        vip = asyncio.create_task(scheduler.acquire("known", PRIORITY_VIP))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerRejected) as rejected:
+            await batch
+        assert rejected.value.status_code == 429
+        # 优先级不高于队列中等待者的请求不能挤占
+        with pytest.raises(SchedulerRejected):
+            await scheduler.acquire("known", PRIORITY_NORMAL)
+        scheduler.release("known")
+        await vip
+        assert scheduler.stats()["models"]["known"]["evicted"] == 1
+    asyncio.run(scenario())
+
+def test_release_serves_waiters_by_priority():
+    async def scenario():
+        scheduler = make_scheduler(max_queue=10)
+        await scheduler.acquire("known")
+        order = []
+
+        async def wait(name, priority):
+            await scheduler.acquire("known", priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(wait("batch", PRIORITY_BATCH)), asyncio.create_task(wait("normal", PRIORITY_NORMAL)),
+                 asyncio.create_task(wait("vip", PRIORITY_VIP))]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            scheduler.release("known")
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["vip", "normal", "batch"]
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_passes_slot_on():
+    async def scenario():
+        scheduler = make_scheduler(max_queue=10)
+        await scheduler.acquire("known")
+        first = asyncio.create_task(scheduler.acquire("known"))
+        second = asyncio.create_task(scheduler.acquire("known"))
+        await asyncio.sleep(0)
+        first.cancel()
+        scheduler.release("known")
+        await second
+        assert scheduler.stats()["models"]["known"]["active"] == 1
+    asyncio.run(scenario())
@@ -0,0 +1,15 @@
+"""
+监控指标测试：客户端传入的模型名称不会产生新的指标序列
+"""
+from services.metrics import MetricsRegistry
+from services.upstream_pool import UpstreamPool, Upstream
+
+def test_unknown_models_are_labelled_other():
+    pool = UpstreamPool({"known": [Upstream("a", "http://a/v1", "key", "known")]})
+    registry = MetricsRegistry()
+    tokens = registry.counter("tokens_total", "token用量", ["model"])
+    for index in range(100):
+        tokens.inc(1, pool.metric_label(f"random-{index}"))
+    tokens.inc(1, pool.metric_label("known"))
+    lines = [line for line in registry.render().splitlines() if line.startswith("tokens_total")]
+    assert sorted(lines) == ['tokens_total{model="known"} 1', 'tokens_total{model="other"} 100']
@@ -0,0 +1,134 @@
+"""
+请求合并测试：并发的相同请求共享一次上游调用或一个上游流，最后一个等待者或订阅者离开时取消上游
+"""
+import asyncio
+from services.request_coalescer import RequestCoalescer
+
+class Upstream:
+    """可控的上游：记录调用次数、是否被取消，流式片段之间等待一小段时间"""
+
+    def __init__(self, chunks: int = 5, delay: float = 0.01):
+        self.chunks = chunks
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+        self.closed = 0
+        self.completed = []
+
+    async def call(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay * self.chunks)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"result-{self.calls}"
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for index in range(self.chunks):
+                await asyncio.sleep(self.delay)
+                yield f"{index},"
+        finally:
+            self.closed += 1
+
+    async def on_complete(self, text: str):
+        self.completed.append(text)
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def scenario():
+        coalescer, upstream = RequestCoalescer(enabled=True), Upstream()
+        results = await asyncio.gather(*(coalescer.run("k", upstream.call) for _ in range(5)))
+        return coalescer, upstream, results
+
+    coalescer, upstream, results = asyncio.run(scenario())
+    assert upstream.calls == 1
+    assert [result for result, _ in results] == ["result-1"] * 5
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert coalescer.stats()["inflight_calls"] == 0
+
+def test_call_is_cancelled_when_last_waiter_leaves():
+    async def scenario():
+        coalescer, upstream = RequestCoalescer(enabled=True), Upstream(delay=0.05)
+        first = asyncio.ensure_future(coalescer.run("k", upstream.call))
+        second = asyncio.ensure_future(coalescer.run("k", upstream.call))
+        await asyncio.sleep(0.01)
+        # 一个等待者离开不影响另一个等待者
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert upstream.cancelled == 0
+        second.cancel()
+        await asyncio.sleep(0.01)
+        cancelled = upstream.cancelled
+        # 取消之后的相同请求重新发起调用
+        result = await coalescer.run("k", upstream.call)
+        return upstream, cancelled, result
+
+    upstream, cancelled, result = asyncio.run(scenario())
+    assert cancelled == 1
+    assert result == ("result-2", False)
+    assert upstream.calls == 2
+
+def test_streams_are_broadcast_to_late_subscribers():
+    async def scenario():
+        coalescer, upstream = RequestCoalescer(enabled=True), Upstream(chunks=10)
+        first, first_shared = coalescer.stream("k", upstream.stream, upstream.on_complete)
+
+        async def read(stream):
+            return "".join([chunk async for chunk in stream])
+
+        first_task = asyncio.ensure_future(read(first))
+        await asyncio.sleep(0.035)
+        # 中途加入的订阅者先补齐已收到的片段
+        second, second_shared = coalescer.stream("k", upstream.stream, upstream.on_complete)
+        texts = await asyncio.gather(first_task, read(second))
+        await asyncio.sleep(0)
+        return upstream, texts, (first_shared, second_shared)
+
+    upstream, texts, shared = asyncio.run(scenario())
+    expected = "".join(f"{index}," for index in range(10))
+    assert texts == [expected, expected]
+    assert shared == (False, True)
+    assert upstream.calls == 1
+    assert upstream.completed == [expected]
+
+def test_stream_is_cancelled_when_last_subscriber_leaves():
+    async def scenario():
+        coalescer, upstream = RequestCoalescer(enabled=True), Upstream(chunks=20)
+        first, _ = coalescer.stream("k", upstream.stream, upstream.on_complete)
+        second, _ = coalescer.stream("k", upstream.stream, upstream.on_complete)
+        assert await first.__anext__() == "0,"
+        assert await second.__anext__() == "0,"
+        # 还有其他订阅者时单个订阅者断开不影响上游
+        await first.aclose()
+        assert await second.__anext__() == "1,"
+        assert upstream.closed == 0
+        await second.aclose()
+        await asyncio.sleep(0.01)
+        closed = upstream.closed
+        # 已被取消的流不再接受新的订阅者，相同请求重新发起上游流
+        third, shared = coalescer.stream("k", upstream.stream, upstream.on_complete)
+        text = "".join([chunk async for chunk in third])
+        return upstream, closed, shared, text
+
+    upstream, closed, shared, text = asyncio.run(scenario())
+    assert closed == 1
+    assert shared is False
+    assert text == "".join(f"{index}," for index in range(20))
+    assert upstream.calls == 2
+    # 被取消的流不调用完成回调（不缓存不完整的响应）
+    assert upstream.completed == [text]
+
+def test_passthrough_closes_source_when_disabled():
+    async def scenario():
+        coalescer, upstream = RequestCoalescer(enabled=False), Upstream(chunks=20)
+        stream, shared = coalescer.stream("k", upstream.stream, upstream.on_complete)
+        assert await stream.__anext__() == "0,"
+        await stream.aclose()
+        return upstream, shared
+
+    upstream, shared = asyncio.run(scenario())
+    assert shared is False
+    assert upstream.closed == 1
+    assert upstream.completed == []
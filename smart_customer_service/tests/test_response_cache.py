@@ -0,0 +1,64 @@
+"""
+响应缓存测试：缓存键的规范化（空白、全角半角、温度分桶），LRU淘汰、TTL过期和SQLite持久化
+"""
+import time
+from services.response_cache import ResponseCache, make_cache_key
+
+def key(content: str, model: str = "m", temperature=0.7, max_tokens=1000, role: str = "user") -> str:
+    return make_cache_key([{"role": "system", "content": "你是客服"}, {"role": role, "content": content}], model, temperature, max_tokens)
+
+def test_cache_key_normalization():
+    # 首尾空白、连续空白和全角字符不影响缓存键
+    assert key("怎么退货？") == key("  怎么退货?  ")
+    assert key("order  123\n status") == key("order 123 status")
+    assert key("ＡＢＣ１２３") == key("ABC123")
+    # 同一温度桶内的温度视为相同
+    assert key("hi", temperature=0.7) == key("hi", temperature=0.71)
+    assert key("hi", temperature=None) == key("hi", temperature=None)
+
+def test_cache_key_distinguishes_parameters():
+    base = key("怎么退货")
+    assert base != key("怎么退款")
+    assert base != key("怎么退货", model="other")
+    assert base != key("怎么退货", temperature=0.9)
+    assert base != key("怎么退货", temperature=None)
+    assert base != key("怎么退货", max_tokens=500)
+    assert base != key("怎么退货", role="assistant")
+    # 内部空白只合并不删除
+    assert key("a b") != key("ab")
+
+def test_lru_and_ttl():
+    cache = ResponseCache(max_entries=2, ttl=0.2, db_path="", enabled=True)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a")["content"] == "A"
+    cache.set("c", "C")
+    # b最久未使用，被淘汰
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    time.sleep(0.25)
+    assert cache.get("a") is None and cache.get("c") is None
+    # 空响应不缓存
+    cache.set("d", "")
+    assert cache.get("d") is None
+
+def test_disabled_cache():
+    cache = ResponseCache(db_path="", enabled=False)
+    cache.set("a", "A")
+    assert cache.get("a") is None
+
+def test_disk_cache_survives_restart(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ResponseCache(max_entries=10, ttl=60, db_path=db_path, enabled=True)
+    cache.set("a", "A", {"prompt_tokens": 3})
+    restarted = ResponseCache(max_entries=10, ttl=60, db_path=db_path, enabled=True)
+    assert restarted.get("a") == {"content": "A", "usage": {"prompt_tokens": 3}}
+    assert restarted.disk_hits == 1
+    # 回查磁盘后写入内存，再次读取不访问磁盘
+    assert restarted.get("a") is not None and restarted.disk_hits == 1
+
+def test_expired_disk_entry_is_ignored(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    ResponseCache(ttl=0.1, db_path=db_path, enabled=True).set("a", "A")
+    time.sleep(0.15)
+    assert ResponseCache(ttl=60, db_path=db_path, enabled=True).get("a") is None
@@ -0,0 +1,75 @@
+"""
+检索引擎测试：倒排索引的排序与TF-IDF全量余弦相似度一致，批量检索与逐条检索结果一致（包括增量段和删除标记）
+"""
+import random
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+from services.retrieval_engine import InvertedIndex, IndexSnapshot, char_ngram_analyzer
+
+WORDS = ["退货", "退款", "发票", "快递", "物流", "会员", "积分", "优惠券", "密码", "账号", "售后", "保修", "订单", "取消", "地址", "refund", "vip"]
+
+def make_documents(rng: random.Random, count: int):
+    return [" ".join(rng.choice(WORDS) + rng.choice("的了吗呢") for _ in range(rng.randint(3, 12))) for _ in range(count)]
+
+def assert_same_results(batch, single):
+    assert len(batch) == len(single)
+    for batch_results, single_results in zip(batch, single):
+        # 单查询路径用float64累加，批量路径用float32稀疏矩阵乘法，得分只在末位有差别，得分相同的文档之间先后顺序不定
+        assert {doc_id for doc_id, _ in batch_results} == {doc_id for doc_id, _ in single_results}
+        assert np.allclose([score for _, score in batch_results], [score for _, score in single_results], atol=1e-5)
+
+def brute_force_search(documents, query: str, top_k: int):
+    """参照实现：与倒排索引相同的分词器和TF-IDF参数，对所有文档计算余弦相似度后排序"""
+    vectorizer = TfidfVectorizer(analyzer=char_ngram_analyzer, max_df=0.8, min_df=1)
+    document_vectors = vectorizer.fit_transform(documents)
+    similarities = cosine_similarity(vectorizer.transform([query]), document_vectors).flatten()
+    top = np.argsort(-similarities, kind="stable")[:top_k]
+    return [(int(idx), float(similarities[idx])) for idx in top if similarities[idx] > 0]
+
+def test_inverted_index_matches_brute_force_tfidf():
+    rng = random.Random(9)
+    documents = make_documents(rng, 200)
+    index = InvertedIndex.build(documents)
+    queries = ["".join(rng.sample(WORDS, rng.randint(1, 3))) for _ in range(40)] + ["怎么申请退货退款", "VIP积分"]
+    for query in queries:
+        assert_same_results([index.search(query, top_k=5)], [brute_force_search(documents, query, 5)])
+
+def test_unspaced_chinese_query_matches_partially():
+    documents = ["如何申请退货退款", "发票开具说明", "会员积分规则"]
+    index = InvertedIndex.build(documents)
+    # 不带空格的中文句子按字符n-gram切分，部分词语相同即可检索到
+    assert [doc_id for doc_id, _ in index.search("我想退货", top_k=3, min_score=0.1)] == [0]
+    assert [doc_id for doc_id, _ in index.search("积分怎么算", top_k=3, min_score=0.1)] == [2]
+
+@pytest.fixture(scope="module")
+def snapshot():
+    rng = random.Random(3)
+    documents = make_documents(rng, 300)
+    base = InvertedIndex.build(documents)
+    delta_documents = make_documents(rng, 40)
+    delta = InvertedIndex.from_vectors([base.vectorize(document) for document in delta_documents], base.terms, base.idf)
+    deleted = np.zeros(len(documents) + len(delta_documents), dtype=bool)
+    deleted[rng.sample(range(deleted.size), 60)] = True
+    entries = [{"id": str(i), "title": "", "content": text} for i, text in enumerate(documents + delta_documents)]
+    return IndexSnapshot(entries, base, delta, deleted)
+
+def test_batch_search_matches_single_search(snapshot):
+    rng = random.Random(5)
+    queries = ["".join(rng.sample(WORDS, rng.randint(1, 4))) for _ in range(50)]
+    # 没有任何已知词项的查询和空查询
+    queries += ["完全无关的内容xyz", ""]
+    for top_k, min_score in ((1, 0.0), (3, 0.1), (10, 0.0)):
+        single = [snapshot.search(query, top_k=top_k, min_score=min_score) for query in queries]
+        assert_same_results(snapshot.search_batch(queries, top_k=top_k, min_score=min_score), single)
+    assert snapshot.search_batch(["完全无关的内容xyz", ""]) == [[], []]
+
+def test_batch_search_skips_deleted_documents(snapshot):
+    queries = list(WORDS)
+    for results in snapshot.search_batch(queries, top_k=20):
+        assert all(not snapshot.deleted[doc_id] for doc_id, _ in results)
+
+def test_batch_search_on_empty_index():
+    snapshot = IndexSnapshot([], InvertedIndex.empty(), InvertedIndex.empty(), np.zeros(0, dtype=bool))
+    assert snapshot.search_batch(["退货", "发票"]) == [[], []]
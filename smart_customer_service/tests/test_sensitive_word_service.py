@@ -0,0 +1,85 @@
+"""
+敏感词过滤测试：一次性过滤与流式过滤在任意分片方式下的结果一致，且与暴力匹配的结果一致
+"""
+import random
+import pytest
+from services.sensitive_word_service import AhoCorasickAutomaton, StreamingSensitiveWordFilter, SensitiveWordFilter
+
+# 字母表较小、敏感词之间互为前缀、后缀或相互重叠，容易触发跨片段匹配和最长匹配选择
+WORD_LISTS = [
+    ["ab", "bab", "abcab", "c", "bb"],
+    ["aaa", "aa", "abba", "ba"],
+    ["abc", "bcd", "cde", "abcdef", "d"],
+    ["政治", "政治家", "治安", "赌博", "博彩", "毒品"],
+]
+
+ALPHABETS = ["abc", "ab", "abcdef", "政治家安赌博彩毒品的是"]
+
+def make_filter(words, tmp_path, monkeypatch) -> SensitiveWordFilter:
+    """创建使用指定敏感词的过滤器"""
+    words_file = tmp_path / "words.txt"
+    words_file.write_text("\n".join(words), encoding="utf-8")
+    monkeypatch.setenv("SENSITIVE_WORDS_FILE", str(words_file))
+    return SensitiveWordFilter()
+
+def brute_force_mask(text: str, words) -> str:
+    """暴力匹配：任意敏感词的任意一次出现覆盖的字符都替换为*"""
+    masked = [False] * len(text)
+    for word in words:
+        start = text.find(word)
+        while start != -1:
+            for i in range(start, start + len(word)):
+                masked[i] = True
+            start = text.find(word, start + 1)
+    return "".join("*" if flag else char for char, flag in zip(text, masked))
+
+def random_chunks(rng: random.Random, text: str):
+    """随机切分文本，包含空片段和单字符片段"""
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.choice([0, 1, 1, 2, 3, 5, 8])
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+def run_stream(filter_service: SensitiveWordFilter, chunks):
+    """按片段输入流式过滤器，返回拼接的输出和过滤器"""
+    stream_filter = StreamingSensitiveWordFilter(filter_service.automaton)
+    output = "".join(stream_filter.feed(chunk) for chunk in chunks) + stream_filter.finish()
+    return output, stream_filter
+
+@pytest.mark.parametrize("words,alphabet", list(zip(WORD_LISTS, ALPHABETS)))
+def test_stream_matches_one_shot_and_brute_force(words, alphabet, tmp_path, monkeypatch):
+    filter_service = make_filter(words, tmp_path, monkeypatch)
+    rng = random.Random(20240101)
+    for _ in range(300):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        filtered, found = filter_service.filter_sensitive_words(text)
+        assert filtered == brute_force_mask(text, words)
+        for _ in range(5):
+            output, stream_filter = run_stream(filter_service, random_chunks(rng, text))
+            assert output == filtered
+            assert stream_filter.filtered_text == filtered
+            assert stream_filter.text == text
+            assert stream_filter.sensitive_words == found
+
+def test_longest_match_selection(tmp_path, monkeypatch):
+    filter_service = make_filter(["政治", "政治家", "治安"], tmp_path, monkeypatch)
+    filtered, found = filter_service.filter_sensitive_words("他是政治家，关心治安")
+    assert filtered == "他是***，关心**"
+    assert found == ["政治家", "治安"]
+
+def test_stream_holds_back_partial_word(tmp_path, monkeypatch):
+    filter_service = make_filter(["赌博"], tmp_path, monkeypatch)
+    stream_filter = StreamingSensitiveWordFilter(filter_service.automaton)
+    # 片段末尾的“赌”可能是敏感词的开头，暂不输出
+    assert stream_filter.feed("不要赌") == "不要"
+    assert stream_filter.feed("博了") == "**了"
+    assert stream_filter.finish() == ""
+
+def test_empty_automaton():
+    automaton = AhoCorasickAutomaton([])
+    assert automaton.scan("任意文本") == (0, [])
+    stream_filter = StreamingSensitiveWordFilter(automaton)
+    assert stream_filter.feed("任意文本") == "任意文本"
@@ -0,0 +1,62 @@
+"""
+会话上下文缓存测试：LRU淘汰、TTL过期，以及从聊天历史重建上下文时包含仍在后台写入队列中的记录
+"""
+import time
+from database.database import init_db
+from services.history_writer import history_writer
+from services.chat_service import build_history_row
+from services.session_service import SessionContextCache
+
+def message(role: str, content: str):
+    return {"role": role, "content": content}
+
+def test_lru_evicts_least_recently_used():
+    cache = SessionContextCache(max_sessions=2, ttl=60)
+    cache.set("u", "a", [message("user", "a")])
+    cache.set("u", "b", [message("user", "b")])
+    # 访问a之后，b成为最久未使用的会话
+    assert cache.get("u", "a") == [message("user", "a")]
+    cache.set("u", "c", [message("user", "c")])
+    assert cache.get("u", "b") is None
+    assert cache.get("u", "a") is not None
+    assert cache.get("u", "c") is not None
+
+def test_ttl_expires_and_append_refreshes():
+    cache = SessionContextCache(max_sessions=10, ttl=0.2)
+    cache.set("u", "a", [message("user", "a")])
+    cache.set("u", "b", [message("user", "b")])
+    time.sleep(0.12)
+    cache.append("u", "a", message("assistant", "reply"))
+    time.sleep(0.12)
+    # b已过期，a在追加消息时重新计时
+    assert cache.get("u", "b") is None
+    assert cache.get("u", "a") == [message("user", "a"), message("assistant", "reply")]
+
+def test_get_returns_copy():
+    cache = SessionContextCache(max_sessions=10, ttl=60)
+    cache.set("u", "a", [message("user", "a")])
+    cache.get("u", "a").append(message("user", "modified"))
+    assert cache.get("u", "a") == [message("user", "a")]
+
+def test_rebuild_includes_rows_still_queued_in_writer(monkeypatch):
+    init_db()
+    # 拉长批量等待时间，使记录在重建时仍停留在写入器中
+    monkeypatch.setattr(history_writer, "flush_interval", 0.3)
+    history_writer.submit([
+        build_history_row("rebuild-user", "s1", "user", "原始问题", "过滤后的问题"),
+        build_history_row("rebuild-user", "s1", "assistant", "回答"),
+    ])
+    history_writer.submit([
+        build_history_row("rebuild-user", "s1", "user", "第二个问题"),
+        build_history_row("rebuild-user", "s1", "assistant", "错误", metadata={"error": True}),
+        build_history_row("rebuild-user", "other", "user", "其他会话"),
+    ])
+    cache = SessionContextCache(max_sessions=10, ttl=60, history_limit=10)
+    messages = cache.load_from_history("rebuild-user", "s1")
+    # 使用过滤后的内容，跳过错误响应，不包含其他会话的消息
+    assert messages == [
+        message("user", "过滤后的问题"),
+        message("assistant", "回答"),
+        message("user", "第二个问题"),
+    ]
+    assert history_writer.flush(5)
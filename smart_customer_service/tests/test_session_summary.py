@@ -0,0 +1,74 @@
+"""
+会话汇总表测试：写入历史记录时增量合并的汇总与根据历史记录回填的结果一致，删除历史记录后重新回填
+"""
+from datetime import datetime, timedelta
+from database.database import init_db, engine, SessionLocal, ChatHistory
+from database.session_summary import backfill_session_summaries
+from services.history_writer import HistoryWriter
+from services.chat_service import build_history_row
+from services.chat_history_service import chat_history_service
+
+BASE_TIME = datetime(2024, 3, 1, 9, 0, 0)
+
+def row(user_id: str, session_id: str, minutes: int, usage=None):
+    history_row = build_history_row(user_id, session_id, "assistant" if usage else "user", f"消息{minutes}",
+                                    metadata={"usage": usage} if usage else None)
+    history_row["timestamp"] = BASE_TIME + timedelta(minutes=minutes)
+    return history_row
+
+def write(*groups):
+    writer = HistoryWriter(batch_size=1000, flush_interval=0.05)
+    for group in groups:
+        writer.submit(group)
+    assert writer.flush(5)
+    writer.stop()
+    assert writer.failed_count == 0
+
+def sessions(user_id: str):
+    return {item["session_id"]: item for item in chat_history_service.get_user_sessions(user_id)}
+
+def test_incremental_upsert_matches_backfill():
+    init_db()
+    usage = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+    # 第二批中的记录早于第一批，首条消息时间取最小值
+    write([row("summary-user", "s1", 10), row("summary-user", "s1", 11, usage)])
+    write([row("summary-user", "s1", 5), row("summary-user", "s1", 20, usage)], [row("summary-user", "s2", 30)])
+    incremental = sessions("summary-user")
+    assert list(incremental) == ["s2", "s1"]
+    s1 = incremental["s1"]
+    assert s1["message_count"] == 4
+    assert s1["first_message_time"] == (BASE_TIME + timedelta(minutes=5)).isoformat()
+    assert s1["latest_message_time"] == (BASE_TIME + timedelta(minutes=20)).isoformat()
+    assert (s1["prompt_tokens"], s1["completion_tokens"], s1["total_tokens"]) == (20, 10, 30)
+    assert incremental["s2"]["message_count"] == 1 and incremental["s2"]["total_tokens"] == 0
+
+    with engine.begin() as connection:
+        assert backfill_session_summaries(connection, user_id="summary-user") == 2
+    assert sessions("summary-user") == incremental
+
+def test_delete_rebuilds_summary():
+    init_db()
+    usage = {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}
+    write([row("delete-user", "s1", 1), row("delete-user", "s1", 2, usage), row("delete-user", "s1", 3, usage)],
+          [row("delete-user", "s2", 4)])
+    db = SessionLocal()
+    try:
+        last_id = db.query(ChatHistory.id).filter(ChatHistory.user_id == "delete-user", ChatHistory.session_id == "s1") \
+            .order_by(ChatHistory.timestamp.desc()).first().id
+    finally:
+        db.close()
+
+    # 删除单条记录后，该会话的计数、token用量和最近消息时间按剩余记录重建
+    assert chat_history_service.delete_chat_history(history_id=last_id)
+    s1 = sessions("delete-user")["s1"]
+    assert s1["message_count"] == 2 and s1["total_tokens"] == 10
+    assert s1["latest_message_time"] == (BASE_TIME + timedelta(minutes=2)).isoformat()
+
+    # 删除整个会话后汇总随之删除，其他会话不受影响
+    assert chat_history_service.delete_chat_history(user_id="delete-user", session_id="s1")
+    assert list(sessions("delete-user")) == ["s2"]
+    assert sessions("delete-user")["s2"]["message_count"] == 1
+
+    # 之后写入同一会话的记录从零开始累加
+    write([row("delete-user", "s1", 50)])
+    assert sessions("delete-user")["s1"]["message_count"] == 1
@@ -0,0 +1,93 @@
+"""
+SSE编码器测试：compact格式只在首帧和末帧携带元数据，合并窗口按字符数和时间合并片段且不丢失、不改变文本
+"""
+import json
+import time
+import asyncio
+from services.sse_encoder import SSEStreamEncoder, json_dumps, encode_event
+
+META = {"user_id": "u1", "session_id": "s1", "model": "m", "is_final": False}
+
+def delta(content: str):
+    return {**META, "content": content}
+
+def final(content: str):
+    return {**META, "is_final": True, "content": content, "metadata": {"sensitive_words": []}}
+
+async def source(parts, delay: float = 0.0, pauses=None):
+    """依次产生文本片段和最后一帧，pauses为{片段下标: 该片段之前额外等待的秒数}"""
+    for index, part in enumerate(parts):
+        if delay or (pauses and index in pauses):
+            await asyncio.sleep(delay + (pauses or {}).get(index, 0))
+        yield delta(part)
+    yield final("".join(parts))
+
+def encode(encoder: SSEStreamEncoder, chunks):
+    """编码并返回(解析后的帧, 每帧产生的时间)"""
+    async def run():
+        frames, times = [], []
+        start = time.monotonic()
+        async for data in encoder.encode(chunks):
+            assert data.startswith(b"data: ") and data.endswith(b"\n\n")
+            frames.append(json.loads(data[6:]))
+            times.append(time.monotonic() - start)
+        return frames, times
+    return asyncio.run(run())
+
+def text_of(frames):
+    return "".join(frame["content"] for frame in frames if not frame.get("is_final"))
+
+def test_json_dumps_is_compact_utf8():
+    assert json_dumps({"a": "中文", "b": [1, 2]}) == '{"a":"中文","b":[1,2]}'.encode("utf-8")
+    assert encode_event({"a": 1}) == b'data: {"a":1}\n\n'
+
+def test_compact_frames():
+    parts = ["你", "好", "，", "世界"]
+    frames, _ = encode(SSEStreamEncoder("compact", 0, 0), source(parts))
+    assert frames[0] == {"user_id": "u1", "session_id": "s1", "model": "m", "content": "你"}
+    assert frames[1:4] == [{"content": "好"}, {"content": "，"}, {"content": "世界"}]
+    # 最后一帧原样输出完整响应和元数据
+    assert frames[-1] == final("".join(parts))
+
+def test_full_frames_repeat_metadata():
+    frames, _ = encode(SSEStreamEncoder("full", 0, 0), source(["a", "b"]))
+    assert frames[:2] == [delta("a"), delta("b")]
+    assert frames[-1]["is_final"] is True
+
+def test_compact_is_smaller_than_full():
+    parts = [f"片段{index}" for index in range(50)]
+    compact = SSEStreamEncoder("compact", 0, 0)
+    full = SSEStreamEncoder("full", 0, 0)
+    encode(compact, source(parts))
+    encode(full, source(parts))
+    assert compact.frames == full.frames == 51
+    assert compact.bytes < full.bytes * 0.6
+
+def test_coalesce_by_chars():
+    parts = list("abcdefghijklmnopqrstuvwxyz")
+    encoder = SSEStreamEncoder("compact", 0, 5)
+    frames, _ = encode(encoder, source(parts))
+    # 首个片段立即发送，之后每累计5个字符发送一帧，剩余的文本在最后一帧之前发送
+    assert [frame["content"] for frame in frames[:-1]] == ["a", "bcdef", "ghijk", "lmnop", "qrstu", "vwxyz"]
+    assert frames[0]["user_id"] == "u1" and "user_id" not in frames[1]
+    assert text_of(frames) == "".join(parts)
+    assert frames[-1]["is_final"] is True
+
+def test_coalesce_by_time_window():
+    parts = [str(index % 10) for index in range(30)]
+    encoder = SSEStreamEncoder("compact", 40, 0)
+    frames, _ = encode(encoder, source(parts, delay=0.005))
+    assert frames[0]["content"] == "0"
+    assert text_of(frames) == "".join(parts)
+    # 30个片段约150毫秒，40毫秒的窗口合并为少数几帧
+    assert len(frames) - 1 <= 8
+    assert frames[-1]["is_final"] is True
+
+def test_window_flushes_when_source_stalls():
+    # 第3个片段之后上游停顿300毫秒，暂存的文本在窗口到期时发送，不等待下一个片段
+    parts = ["a", "b", "c", "d"]
+    encoder = SSEStreamEncoder("compact", 50, 0)
+    frames, times = encode(encoder, source(parts, pauses={3: 0.3}))
+    assert [frame["content"] for frame in frames[:-1]] == ["a", "bc", "d"]
+    assert times[1] < 0.2
+    assert times[2] >= 0.3
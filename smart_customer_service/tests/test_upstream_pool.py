@@ -0,0 +1,132 @@
+"""
+上游连接池测试：上游故障的识别、失败后换上游重试、对冲请求，以及流式响应提前停止读取时关闭上游迭代器
+"""
+import sys
+import types
+import asyncio
+import pytest
+import services.upstream_pool as upstream_pool_module
+from services.upstream_pool import UpstreamPool, Upstream, is_upstream_error
+
+class StatusError(Exception):
+    """带有HTTP状态码的上游异常"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+class APIConnectionError(Exception):
+    """与LiteLLM同名的连接错误"""
+
+def make_pool() -> UpstreamPool:
+    return UpstreamPool({"m": [Upstream("a", "http://a/v1", "key", "m"), Upstream("b", "http://b/v1", "key", "m")]})
+
+def fake_litellm(monkeypatch, acompletion):
+    """用假的litellm模块替换真实模块，acompletion接收上游参数"""
+    monkeypatch.setitem(sys.modules, "litellm", types.SimpleNamespace(acompletion=acompletion))
+
+def test_is_upstream_error():
+    assert is_upstream_error(TimeoutError())
+    assert is_upstream_error(asyncio.TimeoutError())
+    assert is_upstream_error(ConnectionError())
+    assert is_upstream_error(APIConnectionError())
+    for status_code in (408, 429, 500, 503):
+        assert is_upstream_error(StatusError(status_code))
+    for status_code in (400, 401, 404, 422):
+        assert not is_upstream_error(StatusError(status_code))
+    error = ValueError("bad response")
+    error.response = types.SimpleNamespace(status_code=502)
+    assert is_upstream_error(error)
+    assert not is_upstream_error(ValueError("context length exceeded"))
+
+def test_upstream_error_is_retried_on_another_upstream(monkeypatch):
+    calls = []
+
+    async def acompletion(**params):
+        calls.append(params["api_base"])
+        if len(calls) == 1:
+            raise StatusError(503)
+        return f"ok from {params['api_base']}"
+
+    fake_litellm(monkeypatch, acompletion)
+    pool = make_pool()
+    result = asyncio.run(pool.completion("m", messages=[]))
+    assert len(calls) == 2 and calls[0] != calls[1]
+    assert result == f"ok from {calls[1]}"
+    assert pool.retries == 1
+    failed = next(upstream for upstream in pool.upstreams["m"] if upstream.api_base == calls[0])
+    assert failed.failures == 1
+    assert all(upstream.outstanding == 0 for upstream in pool.upstreams["m"])
+
+def test_request_error_is_not_retried(monkeypatch):
+    calls = []
+
+    async def acompletion(**params):
+        calls.append(params["api_base"])
+        raise StatusError(400)
+
+    fake_litellm(monkeypatch, acompletion)
+    pool = make_pool()
+    with pytest.raises(StatusError):
+        asyncio.run(pool.completion("m", messages=[]))
+    # 请求本身的错误换上游也会失败，不重试，也不计入上游摘除
+    assert len(calls) == 1
+    assert pool.retries == 0
+    assert all(upstream.failures == 0 for upstream in pool.upstreams["m"])
+
+def test_hedge_wins_when_first_upstream_is_slow(monkeypatch):
+    monkeypatch.setattr(upstream_pool_module, "UPSTREAM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(upstream_pool_module, "UPSTREAM_HEDGE_DELAY", 0.05)
+    calls = []
+    cancelled = []
+
+    async def acompletion(**params):
+        calls.append(params["api_base"])
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(params["api_base"])
+                raise
+        return params["api_base"]
+
+    fake_litellm(monkeypatch, acompletion)
+    pool = make_pool()
+
+    async def scenario():
+        result = await pool.completion("m", messages=[])
+        # 等待被取消的请求执行完清理
+        await asyncio.sleep(0.01)
+        return result
+
+    result = asyncio.run(scenario())
+    assert result == calls[1]
+    assert cancelled == [calls[0]]
+    assert pool.hedges == 1 and pool.hedge_wins == 1
+    assert all(upstream.outstanding == 0 for upstream in pool.upstreams["m"])
+
+def test_stream_closes_upstream_iterator_when_consumer_stops(monkeypatch):
+    closed = []
+
+    async def chunks():
+        try:
+            for index in range(100):
+                yield index
+        finally:
+            closed.append(True)
+
+    async def acompletion(**params):
+        return chunks()
+
+    fake_litellm(monkeypatch, acompletion)
+    pool = make_pool()
+
+    async def scenario():
+        stream = pool.stream("m", messages=[])
+        received = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        # 在事件循环结束（回收未关闭的异步生成器）之前检查
+        return received, list(closed)
+
+    assert asyncio.run(scenario()) == ([0, 1], [True])
+    assert all(upstream.outstanding == 0 for upstream in pool.upstreams["m"])
@@ -0,0 +1,285 @@
+"""
+聊天接口压力测试工具
+
+以固定的目标RPS（开环，不因服务变慢而降低发送速率）向/api/chat和/api/chat/stream发送请求，
+统计各接口的延迟分位数、流式响应的首个片段延迟、错误分布和实际吞吐量。
+
+用法（在smart_customer_service目录下执行，先启动中间件，建议配合tools.mock_upstream使用）:
+    python -m tools.loadgen --url http://127.0.0.1:8000 --rps 50 --duration 60
+    python -m tools.loadgen --rps 200 --duration 30 --endpoint mixed --stream-ratio 0.3 --output result.json
+"""
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from typing import List, Dict, Any, Optional
+
+import httpx
+
+# 默认测试问题
+DEFAULT_PROMPTS = [
+    "你好，我想了解一下你们的产品",
+    "我的订单什么时候发货？",
+    "怎么申请退货退款？",
+    "会员积分怎么使用，有效期多久？",
+    "发票怎么开，可以开增值税专用发票吗？",
+    "修改绑定手机号需要哪些步骤？",
+    "快递一直没有更新物流信息怎么办？",
+    "你们支持哪些付款方式？",
+]
+
+
+class RequestResult:
+    """单个请求的结果"""
+
+    __slots__ = ("endpoint", "status", "latency", "ttft", "bytes", "error", "server_timing")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.status: Optional[int] = None
+        self.latency: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.bytes = 0
+        self.error: Optional[str] = None
+        self.server_timing: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status == 200
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """计算样本的分位数（最近秩法），没有样本时返回None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def latency_percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """延迟分位数（毫秒）"""
+    result = {}
+    for name, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99), ("max", 1.0)):
+        value = percentile(samples, q)
+        result[f"{name}_ms"] = round(value * 1000, 3) if value is not None else None
+    return result
+
+
+def build_payload(prompt: str, user_id: str, model: Optional[str], max_tokens: Optional[int], session_id: Optional[str] = None) -> Dict[str, Any]:
+    """构建聊天请求体"""
+    payload: Dict[str, Any] = {"user_id": user_id, "messages": [{"role": "user", "content": prompt}]}
+    if session_id:
+        payload["session_id"] = session_id
+    if model:
+        payload["model"] = model
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+    return payload
+
+
+async def send_chat(client: httpx.AsyncClient, base_url: str, payload: Dict[str, Any], stream: bool,
+                    headers: Optional[Dict[str, str]] = None) -> RequestResult:
+    """
+    发送一个聊天请求并计时，流式请求以收到第一个data行的时间作为首个片段延迟
+
+    返回:
+        RequestResult: 请求结果，连接错误和超时记录在error中
+    """
+    endpoint = "/api/chat/stream" if stream else "/api/chat"
+    result = RequestResult(endpoint)
+    start = time.perf_counter()
+    try:
+        if stream:
+            async with client.stream("POST", base_url + endpoint, json=payload, headers=headers) as response:
+                result.status = response.status_code
+                async for line in response.aiter_lines():
+                    result.bytes += len(line) + 1
+                    if result.ttft is None and line.startswith("data:"):
+                        result.ttft = time.perf_counter() - start
+        else:
+            response = await client.post(base_url + endpoint, json=payload, headers=headers)
+            result.status = response.status_code
+            result.bytes = len(response.content)
+        result.server_timing = response.headers.get("server-timing")
+        if result.status != 200:
+            result.error = f"HTTP {result.status}"
+    except httpx.TimeoutException:
+        result.error = "timeout"
+    except httpx.HTTPError as e:
+        result.error = type(e).__name__
+    result.latency = time.perf_counter() - start
+    return result
+
+
+def summarize(results: List[RequestResult], elapsed: float) -> Dict[str, Any]:
+    """按接口汇总请求结果"""
+    summary: Dict[str, Any] = {}
+    for endpoint in sorted({result.endpoint for result in results}):
+        items = [result for result in results if result.endpoint == endpoint]
+        ok = [result for result in items if result.ok]
+        errors: Dict[str, int] = {}
+        for result in items:
+            if not result.ok:
+                errors[result.error or "unknown"] = errors.get(result.error or "unknown", 0) + 1
+        entry = {
+            "requests": len(items),
+            "ok": len(ok),
+            "error_rate": round(1 - len(ok) / len(items), 4) if items else 0.0,
+            "errors": errors,
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+            "bytes_per_s": round(sum(result.bytes for result in items) / elapsed, 1) if elapsed > 0 else None,
+            "latency": latency_percentiles([result.latency for result in ok]),
+        }
+        ttfts = [result.ttft for result in ok if result.ttft is not None]
+        if ttfts:
+            entry["ttft"] = latency_percentiles(ttfts)
+        summary[endpoint] = entry
+    return summary
+
+
+def print_summary(report: Dict[str, Any]):
+    """打印汇总结果"""
+    print(f"目标RPS: {report['target_rps']}  发送: {report['sent']}  因并发上限丢弃: {report['dropped']}  耗时: {report['elapsed_s']:.1f}秒")
+    print(f"{'接口':<20} {'请求':>7} {'成功':>7} {'错误率':>7} {'吞吐(rps)':>10} {'P50(ms)':>9} {'P90(ms)':>9} {'P99(ms)':>9} {'首片段P50':>10} {'首片段P99':>10}")
+    for endpoint, entry in report["endpoints"].items():
+        latency = entry["latency"]
+        ttft = entry.get("ttft", {})
+
+        def fmt(value: Optional[float]) -> str:
+            return f"{value:.1f}" if value is not None else "-"
+
+        print(f"{endpoint:<20} {entry['requests']:>7} {entry['ok']:>7} {entry['error_rate']:>7.1%} {fmt(entry['throughput_rps']):>10} "
+              f"{fmt(latency['p50_ms']):>9} {fmt(latency['p90_ms']):>9} {fmt(latency['p99_ms']):>9} "
+              f"{fmt(ttft.get('p50_ms')):>10} {fmt(ttft.get('p99_ms')):>10}")
+        if entry["errors"]:
+            print(f"{'':<20} 错误: {json.dumps(entry['errors'], ensure_ascii=False)}")
+
+
+async def run_load(url: str, rps: float, duration: float, endpoint: str = "chat", stream_ratio: float = 0.5,
+                   prompts: Optional[List[str]] = None, users: int = 100, model: Optional[str] = None,
+                   max_tokens: Optional[int] = None, max_in_flight: int = 1000, timeout: float = 120.0,
+                   arrival: str = "poisson", seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    以目标RPS发送请求并汇总结果
+
+    参数:
+        url: 中间件地址
+        rps: 目标每秒请求数
+        duration: 发送请求的时长（秒），之后等待进行中的请求完成
+        endpoint: chat、stream或mixed
+        stream_ratio: mixed模式下流式请求的比例
+        prompts: 测试问题
+        users: 用户ID数量，请求在这些用户之间轮换
+        model: 请求的模型名称，默认使用服务端默认模型
+        max_tokens: 请求的最大生成token数
+        max_in_flight: 进行中请求数上限，超过时丢弃新请求并计数，避免压测端自身无限堆积
+        timeout: 单个请求超时（秒）
+        arrival: poisson（指数分布的到达间隔）或uniform（固定间隔）
+        seed: 随机数种子
+
+    返回:
+        Dict[str, Any]: 包含配置、发送和丢弃的请求数、耗时和各接口的汇总结果
+    """
+    rng = random.Random(seed)
+    prompts = prompts or DEFAULT_PROMPTS
+    base_url = url.rstrip("/")
+    results: List[RequestResult] = []
+    tasks = set()
+    sent = 0
+    dropped = 0
+
+    async def one(payload: Dict[str, Any], stream: bool):
+        results.append(await send_chat(client, base_url, payload, stream))
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        next_send = start
+        while True:
+            now = time.perf_counter()
+            if now - start >= duration:
+                break
+            if next_send > now:
+                await asyncio.sleep(next_send - now)
+            interval = rng.expovariate(rps) if arrival == "poisson" else 1 / rps
+            next_send += interval
+            if len(tasks) >= max_in_flight:
+                dropped += 1
+                continue
+            stream = endpoint == "stream" or (endpoint == "mixed" and rng.random() < stream_ratio)
+            payload = build_payload(rng.choice(prompts), f"loadgen-{rng.randrange(users)}", model, max_tokens)
+            task = asyncio.create_task(one(payload, stream))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        send_elapsed = time.perf_counter() - start
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "url": base_url,
+        "target_rps": rps,
+        "duration_s": duration,
+        "endpoint": endpoint,
+        "sent": sent,
+        "dropped": dropped,
+        "achieved_send_rps": round(sent / send_elapsed, 2) if send_elapsed > 0 else None,
+        "elapsed_s": elapsed,
+        "endpoints": summarize(results, elapsed),
+    }
+
+
+def load_prompts(path: str) -> List[str]:
+    """加载测试问题，每行一个"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="聊天接口压力测试工具")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="中间件地址")
+    parser.add_argument("--rps", type=float, default=10.0, help="目标每秒请求数")
+    parser.add_argument("--duration", type=float, default=30.0, help="发送请求的时长（秒）")
+    parser.add_argument("--endpoint", choices=("chat", "stream", "mixed"), default="chat", help="测试的接口")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="mixed模式下流式请求的比例")
+    parser.add_argument("--prompts", default=None, help="测试问题文件（每行一个）")
+    parser.add_argument("--users", type=int, default=100, help="模拟的用户数量")
+    parser.add_argument("--model", default=None, help="请求的模型名称")
+    parser.add_argument("--max-tokens", type=int, default=None, help="请求的最大生成token数")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="进行中请求数上限")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson", help="请求到达间隔分布")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    parser.add_argument("--output", default=None, help="结果JSON文件路径")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(
+        url=args.url,
+        rps=args.rps,
+        duration=args.duration,
+        endpoint=args.endpoint,
+        stream_ratio=args.stream_ratio,
+        prompts=load_prompts(args.prompts) if args.prompts else None,
+        users=args.users,
+        model=args.model,
+        max_tokens=args.max_tokens,
+        max_in_flight=args.max_in_flight,
+        timeout=args.timeout,
+        arrival=args.arrival,
+        seed=args.seed
+    ))
+    print_summary(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.output}")
+    total_errors = sum(entry["requests"] - entry["ok"] for entry in report["endpoints"].values())
+    return 1 if report["sent"] and total_errors == report["sent"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+OpenAI兼容的模拟大模型服务
+
+实现/v1/chat/completions接口（非流式和SSE流式），按配置的首个token延迟、生成速度和错误率返回语料中的回复，
+用于压力测试和延迟测试，不产生真实大模型的费用和网络抖动。
+
+用法（在smart_customer_service目录下执行）:
+    python -m tools.mock_upstream --port 9000 --ttft-ms 300 --tokens-per-sec 40
+    python -m tools.mock_upstream --error-rate 0.02 --error-status 429 --corpus replies.txt
+
+中间件指向模拟服务:
+    LLM_API_BASE=http://127.0.0.1:9000/v1 LLM_API_KEY=mock python main.py
+
+运行期间可以通过GET/POST /mock/config查看和修改配置，GET /mock/stats查看请求统计。
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import List, Dict, Any, Optional, AsyncGenerator
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from services.context_manager import estimate_text_tokens
+
+# 默认回复语料
+DEFAULT_CORPUS = [
+    "您好，感谢您的咨询。关于您提到的问题，建议您先登录账户，在“我的订单”页面查看订单状态。如果订单显示已发货，可以点击物流详情查看配送进度；如果长时间没有更新，请提供订单号，我们会尽快为您核实处理。",
+    "您好，我们的产品支持七天无理由退货。请在订单详情页提交退货申请，并按照页面提示填写退货原因和寄回地址。仓库收到退货并检查无误后，退款会在三到五个工作日内原路退回。",
+    "感谢您的反馈。您可以在设置页面中修改绑定的手机号：进入“账户与安全”，选择“更换手机号”，通过原手机号验证后输入新的手机号即可。如果原手机号已无法使用，请联系人工客服进行身份核验。",
+    "您好，会员积分可以在下单时抵扣现金，每一百积分抵扣一元，单笔订单最多抵扣订单金额的百分之二十。积分有效期为获得之日起十二个月，过期后将自动清零，请您及时使用。",
+    "抱歉给您带来不便。发票可以在订单完成后申请，支持电子普通发票和增值税专用发票。电子发票会在申请后二十四小时内发送到您预留的邮箱，纸质发票将随下一次配送一起寄出。",
+]
+
+# 切分回复文本为token：中文按字，其他按单词、数字或单个标点
+_TOKEN_PATTERN = re.compile(r"[一-鿿㐀-䶿]|[A-Za-z]+|\d+|\s+|[^\w\s]", re.UNICODE)
+
+
+class MockSettings:
+    """模拟服务配置，运行期间可以通过/mock/config修改"""
+
+    # 可以通过/mock/config修改的配置项
+    TUNABLE = ("ttft_ms", "tokens_per_sec", "jitter", "error_rate", "error_status", "output_tokens", "chunk_tokens")
+
+    def __init__(self, ttft_ms: float = 200.0, tokens_per_sec: float = 50.0, jitter: float = 0.1,
+                 error_rate: float = 0.0, error_status: int = 500, output_tokens: int = 0,
+                 chunk_tokens: int = 1, api_key: Optional[str] = None, corpus: Optional[List[str]] = None, seed: Optional[int] = None):
+        """
+        参数:
+            ttft_ms: 首个token延迟（毫秒），非流式响应同样先等待该时间
+            tokens_per_sec: 首个token之后的生成速度，0表示不限速
+            jitter: 延迟的随机波动比例，0.1表示在±10%范围内均匀波动
+            error_rate: 返回错误的请求比例
+            error_status: 错误响应的HTTP状态码
+            output_tokens: 每个回复的token数，0表示使用语料原文（不超过请求的max_tokens）
+            chunk_tokens: 流式响应每个片段包含的token数
+            api_key: 要求请求携带的API密钥，None表示不校验
+            corpus: 回复语料
+            seed: 随机数种子
+        """
+        self.ttft_ms = ttft_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.output_tokens = output_tokens
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.api_key = api_key
+        self.corpus = corpus or DEFAULT_CORPUS
+        self.rng = random.Random(seed)
+        # 统计信息
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.completion_tokens = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.TUNABLE}
+
+    def update(self, values: Dict[str, Any]):
+        for name, value in values.items():
+            if name in self.TUNABLE:
+                setattr(self, name, type(getattr(self, name))(value))
+        self.chunk_tokens = max(1, self.chunk_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "streams": self.streams,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "completion_tokens": self.completion_tokens
+        }
+
+    def with_jitter(self, seconds: float) -> float:
+        """为延迟增加随机波动"""
+        if self.jitter <= 0:
+            return seconds
+        return max(0.0, seconds * self.rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def ttft(self) -> float:
+        return self.with_jitter(self.ttft_ms / 1000)
+
+    def token_interval(self) -> float:
+        return self.with_jitter(1 / self.tokens_per_sec) if self.tokens_per_sec > 0 else 0.0
+
+    def make_reply(self, max_tokens: Optional[int]) -> List[str]:
+        """从语料中随机选取回复并切分为token，按output_tokens或max_tokens截断"""
+        tokens = _TOKEN_PATTERN.findall(self.rng.choice(self.corpus))
+        limit = self.output_tokens or max_tokens
+        if self.output_tokens:
+            # 指定长度超过语料原文时循环拼接
+            while len(tokens) < self.output_tokens:
+                tokens.extend(_TOKEN_PATTERN.findall(self.rng.choice(self.corpus)))
+            if max_tokens:
+                limit = min(limit, max_tokens)
+        return tokens[:limit] if limit else tokens
+
+
+def load_corpus(path: str) -> List[str]:
+    """加载回复语料，.json文件为字符串列表，其他文件每行一条回复"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return [str(item) for item in json.load(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+def prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """估算提示词token数"""
+    return sum(estimate_text_tokens(str(message.get("content") or "")) + 4 for message in messages)
+
+
+def error_response(status_code: int, message: str) -> JSONResponse:
+    """OpenAI格式的错误响应"""
+    error_type = "rate_limit_exceeded" if status_code == 429 else "server_error"
+    return JSONResponse(status_code=status_code, content={"error": {"message": message, "type": error_type, "code": status_code}})
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    """创建模拟服务应用"""
+    app = FastAPI(title="模拟大模型服务")
+
+    async def completions(request: Request):
+        if settings.api_key is not None and request.headers.get("authorization") != f"Bearer {settings.api_key}":
+            return error_response(401, "Invalid API key")
+        body = await request.json()
+        settings.requests += 1
+        if settings.error_rate > 0 and settings.rng.random() < settings.error_rate:
+            settings.errors += 1
+            return error_response(settings.error_status, "Mock upstream error")
+
+        model = body.get("model", "mock-model")
+        messages = body.get("messages") or []
+        tokens = settings.make_reply(body.get("max_tokens"))
+        usage = {"prompt_tokens": prompt_tokens(messages), "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        settings.completion_tokens += len(tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+        if body.get("stream"):
+            settings.streams += 1
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(stream_events(settings, completion_id, model, tokens, usage if include_usage else None),
+                                     media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+        settings.in_flight += 1
+        try:
+            await asyncio.sleep(settings.ttft() + sum(settings.token_interval() for _ in range(max(len(tokens) - 1, 0))))
+        finally:
+            settings.in_flight -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    # LiteLLM按api_base拼接路径，同时支持带/v1和不带/v1的配置
+    app.add_api_route("/v1/chat/completions", completions, methods=["POST"])
+    app.add_api_route("/chat/completions", completions, methods=["POST"])
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/mock/config")
+    async def get_config():
+        return settings.to_dict()
+
+    @app.post("/mock/config")
+    async def update_config(values: Dict[str, Any]):
+        settings.update(values)
+        return settings.to_dict()
+
+    @app.get("/mock/stats")
+    async def get_stats():
+        return settings.stats()
+
+    return app
+
+
+async def stream_events(settings: MockSettings, completion_id: str, model: str, tokens: List[str],
+                        usage: Optional[Dict[str, int]]) -> AsyncGenerator[str, None]:
+    """按首个token延迟和生成速度输出SSE事件"""
+    created = int(time.time())
+
+    def event(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **extra
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    settings.in_flight += 1
+    try:
+        await asyncio.sleep(settings.ttft())
+        yield event({"role": "assistant", "content": ""})
+        # 按绝对时间安排每个片段，避免sleep误差累积
+        deadline = time.monotonic()
+        for i in range(0, len(tokens), settings.chunk_tokens):
+            if i > 0:
+                deadline += sum(settings.token_interval() for _ in range(settings.chunk_tokens))
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield event({"content": "".join(tokens[i:i + settings.chunk_tokens])})
+        yield event({}, "stop")
+        if usage is not None:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        settings.in_flight -= 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI兼容的模拟大模型服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=9000, help="监听端口")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="首个token延迟（毫秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="生成速度（token/秒），0表示不限速")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延迟随机波动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例")
+    parser.add_argument("--error-status", type=int, default=500, help="错误响应的HTTP状态码")
+    parser.add_argument("--output-tokens", type=int, default=0, help="每个回复的token数，0表示使用语料原文")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="流式响应每个片段的token数")
+    parser.add_argument("--corpus", default=None, help="回复语料文件（每行一条，或JSON字符串列表）")
+    parser.add_argument("--api-key", default=None, help="要求请求携带的API密钥，默认不校验")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(
+        ttft_ms=args.ttft_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        output_tokens=args.output_tokens,
+        chunk_tokens=args.chunk_tokens,
+        api_key=args.api_key,
+        corpus=load_corpus(args.corpus) if args.corpus else None,
+        seed=args.seed
+    )
+    print(f"模拟大模型服务: http://{args.host}:{args.port}/v1  配置: {json.dumps(settings.to_dict())}")
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+"""
+基于聊天历史的流量回放工具
+
+从chat_history表读取用户消息，匿名化用户ID、会话ID和消息中的手机号、邮箱等个人信息后重建ChatRequest，
+按原始的请求间隔（可按倍数压缩）回放到运行中的中间件，使消息长度、会话轮次和敏感词比例与生产流量一致。
+回放前后采集/metrics，按差值统计各处理阶段的延迟，并根据调度器的并发上限估算容量余量。
+
+用法（在smart_customer_service目录下执行，先启动中间件，建议配合tools.mock_upstream使用）:
+    python -m tools.replay --database sqlite:///./chat_history.db --dry-run
+    python -m tools.replay --url http://127.0.0.1:8000 --speed 10 --max-gap 5
+    python -m tools.replay --since 2024-06-01 --until 2024-06-02 --speed 60 --endpoint mixed --output replay.json
+"""
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+from sqlalchemy import select
+
+from database.database import DATABASE_URL, ChatHistory, create_database_engine
+from models.chat_models import ChatRequest, Message
+from tools.loadgen import RequestResult, send_chat, summarize, print_summary, percentile
+
+# 消息中的个人信息，替换为等长的占位内容以保持消息长度分布
+_PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+"), lambda m: "x" * (len(m.group(0)) - 12) + "@example.com" if len(m.group(0)) > 12 else "a@example.com"),
+    # 手机号、身份证号、订单号等6位以上的数字串
+    (re.compile(r"\d{6,}[Xx]?"), lambda m: "0" * len(m.group(0))),
+]
+
+# 分阶段延迟直方图的指标名称
+STAGE_METRIC = "chat_stage_duration_seconds"
+
+# Prometheus文本格式的样本行：名称{标签} 值
+_SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class Anonymizer:
+    """把用户ID和会话ID映射为带盐哈希的假名，并去除消息中的个人信息"""
+
+    def __init__(self, salt: str):
+        self.salt = salt
+
+    def pseudonym(self, prefix: str, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return None
+        digest = hashlib.sha256(f"{self.salt}:{prefix}:{value}".encode("utf-8")).hexdigest()[:12]
+        return f"replay-{prefix}-{digest}"
+
+    @staticmethod
+    def scrub(text: str) -> str:
+        for pattern, replacement in _PII_PATTERNS:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+def load_turns(database_url: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    按时间顺序读取用户消息
+
+    返回:
+        List[Dict[str, Any]]: 包含user_id、session_id、content、timestamp和message_metadata
+    """
+    engine = create_database_engine(database_url)
+    query = select(
+        ChatHistory.user_id, ChatHistory.session_id, ChatHistory.content, ChatHistory.timestamp, ChatHistory.message_metadata
+    ).where(ChatHistory.role == "user")
+    if since is not None:
+        query = query.where(ChatHistory.timestamp >= since)
+    if until is not None:
+        query = query.where(ChatHistory.timestamp < until)
+    query = query.order_by(ChatHistory.timestamp, ChatHistory.id)
+    if limit:
+        query = query.limit(limit)
+    try:
+        with engine.connect() as connection:
+            return [dict(row._mapping) for row in connection.execute(query)]
+    finally:
+        engine.dispose()
+
+
+def build_workload(turns: List[Dict[str, Any]], anonymizer: Anonymizer, speed: float = 1.0, max_gap: Optional[float] = None,
+                   use_sessions: bool = True, model: Optional[str] = None, max_tokens: Optional[int] = None) -> List[Tuple[float, ChatRequest]]:
+    """
+    重建回放请求
+
+    参数:
+        turns: 按时间排序的用户消息
+        anonymizer: 匿名化处理
+        speed: 时间压缩倍数，10表示按原始间隔的十分之一发送
+        max_gap: 原始请求间隔的上限（秒），跳过夜间等长时间的空闲
+        use_sessions: 是否携带（匿名化的）会话ID，使多轮会话使用服务端保存的上下文
+        model: 覆盖请求的模型名称
+        max_tokens: 覆盖请求的最大生成token数
+
+    返回:
+        List[Tuple[float, ChatRequest]]: (相对回放开始的发送时间（秒）, 请求)
+    """
+    workload = []
+    offset = 0.0
+    previous: Optional[datetime] = None
+    for turn in turns:
+        if previous is not None and turn["timestamp"] is not None:
+            gap = max(0.0, (turn["timestamp"] - previous).total_seconds())
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap / speed
+        previous = turn["timestamp"] or previous
+        request = ChatRequest(
+            user_id=anonymizer.pseudonym("user", turn["user_id"]),
+            session_id=anonymizer.pseudonym("session", turn["session_id"]) if use_sessions else None,
+            messages=[Message(role="user", content=anonymizer.scrub(turn["content"] or ""))],
+            **({"model": model} if model else {}),
+            **({"max_tokens": max_tokens} if max_tokens else {})
+        )
+        workload.append((offset, request))
+    return workload
+
+
+def describe_workload(turns: List[Dict[str, Any]], workload: List[Tuple[float, ChatRequest]]) -> Dict[str, Any]:
+    """统计回放流量的特征：原始时间跨度和请求率、消息长度分布、会话轮次和含敏感词的消息比例"""
+    if not turns:
+        return {"requests": 0}
+    lengths = [len(request.messages[-1].content) for _, request in workload]
+    sessions: Dict[Any, int] = {}
+    for turn in turns:
+        key = (turn["user_id"], turn["session_id"])
+        sessions[key] = sessions.get(key, 0) + 1
+    with_sensitive = sum(1 for turn in turns if (turn["message_metadata"] or {}).get("sensitive_words"))
+    timestamps = [turn["timestamp"] for turn in turns if turn["timestamp"] is not None]
+    original_span = (max(timestamps) - min(timestamps)).total_seconds() if timestamps else 0.0
+    replay_span = workload[-1][0]
+    turns_per_session = sorted(sessions.values())
+    return {
+        "requests": len(turns),
+        "users": len({turn["user_id"] for turn in turns}),
+        "sessions": len(sessions),
+        "original_span_s": original_span,
+        "original_rps": len(turns) / original_span if original_span > 0 else None,
+        "replay_span_s": replay_span,
+        "replay_rps": len(turns) / replay_span if replay_span > 0 else None,
+        "message_chars": {"p50": percentile(lengths, 0.5), "p95": percentile(lengths, 0.95), "max": max(lengths)},
+        "turns_per_session": {"p50": percentile(turns_per_session, 0.5), "p95": percentile(turns_per_session, 0.95)},
+        "sensitive_ratio": with_sensitive / len(turns),
+    }
+
+
+def parse_prometheus(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """解析Prometheus文本格式，返回(指标名称, 排序后的标签) -> 值"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_PATTERN.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        label_items = tuple(sorted(_LABEL_PATTERN.findall(labels or "")))
+        samples[(name, label_items)] = float(value)
+    return samples
+
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """按分桶计数线性插值估算分位数，buckets为按上界排序的(上界, 累计计数)"""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def stage_latency_delta(before: Dict, after: Dict) -> Dict[str, Dict[str, Any]]:
+    """根据回放前后两次采集的差值计算各阶段的调用次数、平均延迟和延迟分位数（毫秒）"""
+    stages: Dict[str, Dict[str, Any]] = {}
+    for (name, labels), value in after.items():
+        label_map = dict(labels)
+        stage = label_map.get("stage")
+        if stage is None or not name.startswith(STAGE_METRIC):
+            continue
+        delta = value - before.get((name, labels), 0.0)
+        entry = stages.setdefault(stage, {"buckets": [], "sum": 0.0, "count": 0.0})
+        if name == STAGE_METRIC + "_bucket":
+            bound = float("inf") if label_map["le"] == "+Inf" else float(label_map["le"])
+            entry["buckets"].append((bound, delta))
+        elif name == STAGE_METRIC + "_sum":
+            entry["sum"] = delta
+        elif name == STAGE_METRIC + "_count":
+            entry["count"] = delta
+
+    result = {}
+    for stage, entry in stages.items():
+        if entry["count"] <= 0:
+            continue
+        buckets = sorted(entry["buckets"])
+
+        def quantile_ms(q: float) -> Optional[float]:
+            value = histogram_quantile(q, buckets)
+            return round(value * 1000, 3) if value is not None else None
+
+        result[stage] = {
+            "count": int(entry["count"]),
+            "mean_ms": round(entry["sum"] / entry["count"] * 1000, 3),
+            "p50_ms": quantile_ms(0.5),
+            "p95_ms": quantile_ms(0.95),
+            "p99_ms": quantile_ms(0.99),
+            "total_s": round(entry["sum"], 3),
+        }
+    return result
+
+
+# 调用大模型的阶段，其余阶段为中间件自身的处理
+UPSTREAM_STAGES = ("upstream", "upstream_stream")
+QUEUE_STAGE = "llm_queue"
+
+
+def estimate_headroom(stages: Dict[str, Dict[str, Any]], scheduler: Optional[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """
+    估算容量余量
+
+    大模型调用按利特尔法则计算平均并发（到达率 × 平均调用耗时），与调度器的并发上限相比得到上游余量；
+    中间件自身各阶段的总耗时除以回放时长得到事件循环的占用比例。排队阶段的平均耗时明显大于0说明已经饱和。
+    """
+    result: Dict[str, Any] = {}
+    if elapsed <= 0:
+        return result
+    upstream_busy = sum(stages[name]["total_s"] for name in UPSTREAM_STAGES if name in stages)
+    average_concurrency = upstream_busy / elapsed
+    result["llm_average_concurrency"] = round(average_concurrency, 3)
+    if scheduler and scheduler.get("models"):
+        capacity = sum(model["capacity"] for model in scheduler["models"].values())
+        result["llm_capacity"] = capacity
+        result["llm_utilization"] = round(average_concurrency / capacity, 4) if capacity else None
+        result["llm_headroom_x"] = round(capacity / average_concurrency, 2) if average_concurrency > 0 else None
+    local_busy = sum(entry["total_s"] for name, entry in stages.items() if name not in UPSTREAM_STAGES and name != QUEUE_STAGE)
+    result["middleware_busy_ratio"] = round(local_busy / elapsed, 4)
+    result["middleware_headroom_x"] = round(elapsed / local_busy, 2) if local_busy > 0 else None
+    if QUEUE_STAGE in stages:
+        result["llm_queue_mean_ms"] = stages[QUEUE_STAGE]["mean_ms"]
+        result["llm_queue_p99_ms"] = stages[QUEUE_STAGE]["p99_ms"]
+    return result
+
+
+async def fetch_json(client: httpx.AsyncClient, url: str) -> Optional[Dict[str, Any]]:
+    try:
+        response = await client.get(url)
+        return response.json() if response.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+async def fetch_metrics(client: httpx.AsyncClient, base_url: str) -> Optional[Dict]:
+    try:
+        response = await client.get(base_url + "/metrics")
+        return parse_prometheus(response.text) if response.status_code == 200 else None
+    except httpx.HTTPError:
+        return None
+
+
+async def replay(url: str, workload: List[Tuple[float, ChatRequest]], endpoint: str = "chat", stream_ratio: float = 0.5,
+                 max_in_flight: int = 1000, timeout: float = 120.0, seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    按计划的发送时间回放请求
+
+    返回:
+        Dict[str, Any]: 包含发送和丢弃的请求数、落后于计划的最大时间、各接口的汇总结果、各阶段延迟和容量余量
+    """
+    rng = random.Random(seed)
+    base_url = url.rstrip("/")
+    results: List[RequestResult] = []
+    tasks = set()
+    sent = 0
+    dropped = 0
+    max_lag = 0.0
+
+    async def one(payload: Dict[str, Any], stream: bool):
+        results.append(await send_chat(client, base_url, payload, stream))
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        metrics_before = await fetch_metrics(client, base_url)
+        start = time.perf_counter()
+        for offset, request in workload:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            if len(tasks) >= max_in_flight:
+                dropped += 1
+                continue
+            stream = endpoint == "stream" or (endpoint == "mixed" and rng.random() < stream_ratio)
+            task = asyncio.create_task(one(request.model_dump(mode="json", exclude_none=True), stream))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        metrics_after = await fetch_metrics(client, base_url)
+        scheduler = await fetch_json(client, base_url + "/api/scheduler/stats")
+
+    report: Dict[str, Any] = {
+        "url": base_url,
+        "endpoint": endpoint,
+        "sent": sent,
+        "dropped": dropped,
+        "target_rps": round(len(workload) / workload[-1][0], 2) if workload and workload[-1][0] > 0 else None,
+        "max_schedule_lag_s": round(max_lag, 3),
+        "elapsed_s": elapsed,
+        "endpoints": summarize(results, elapsed),
+    }
+    if metrics_before is not None and metrics_after is not None:
+        stages = stage_latency_delta(metrics_before, metrics_after)
+        report["stages"] = stages
+        report["headroom"] = estimate_headroom(stages, scheduler, elapsed)
+    else:
+        print("无法获取/metrics，不统计各阶段延迟和容量余量")
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    """打印回放结果"""
+    print_summary(report)
+    if report["max_schedule_lag_s"] > 1:
+        print(f"注意: 回放端最多落后计划{report['max_schedule_lag_s']:.1f}秒，实际请求率低于目标")
+    if report.get("stages"):
+        print(f"{'阶段':<20} {'次数':>8} {'平均(ms)':>10} {'P50(ms)':>10} {'P95(ms)':>10} {'P99(ms)':>10}")
+        for stage, entry in sorted(report["stages"].items(), key=lambda item: -item[1]["total_s"]):
+            values = [entry[name] for name in ("mean_ms", "p50_ms", "p95_ms", "p99_ms")]
+            print(f"{stage:<20} {entry['count']:>8} " + " ".join(f"{value:>10.2f}" if value is not None else f"{'-':>10}" for value in values))
+    headroom = report.get("headroom")
+    if headroom:
+        print("容量估算:")
+        print(f"  大模型平均并发 {headroom['llm_average_concurrency']}"
+              + (f" / 并发上限 {headroom['llm_capacity']}，可承受约{headroom['llm_headroom_x']}倍当前流量" if headroom.get("llm_headroom_x") else ""))
+        print(f"  中间件处理占用 {headroom['middleware_busy_ratio']:.1%}"
+              + (f"，单进程可承受约{headroom['middleware_headroom_x']}倍当前流量" if headroom.get("middleware_headroom_x") else ""))
+        if headroom.get("llm_queue_mean_ms"):
+            print(f"  调度排队平均 {headroom['llm_queue_mean_ms']:.1f} ms，P99 {headroom['llm_queue_p99_ms']} ms")
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="基于聊天历史的流量回放工具")
+    parser.add_argument("--database", default=DATABASE_URL, help="读取聊天历史的数据库URL")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="中间件地址")
+    parser.add_argument("--since", type=parse_time, default=None, help="只回放该时间之后的消息（ISO格式）")
+    parser.add_argument("--until", type=parse_time, default=None, help="只回放该时间之前的消息（ISO格式）")
+    parser.add_argument("--limit", type=int, default=None, help="最多回放的消息数量")
+    parser.add_argument("--speed", type=float, default=1.0, help="时间压缩倍数")
+    parser.add_argument("--max-gap", type=float, default=None, help="原始请求间隔上限（秒）")
+    parser.add_argument("--no-sessions", action="store_true", help="不携带会话ID，每条消息作为独立请求")
+    parser.add_argument("--endpoint", choices=("chat", "stream", "mixed"), default="chat", help="回放的接口")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="mixed模式下流式请求的比例")
+    parser.add_argument("--model", default=None, help="覆盖请求的模型名称")
+    parser.add_argument("--max-tokens", type=int, default=None, help="覆盖请求的最大生成token数")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="进行中请求数上限")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument("--salt", default=None, help="匿名化使用的盐，默认每次随机生成")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    parser.add_argument("--dry-run", action="store_true", help="只统计回放流量的特征，不发送请求")
+    parser.add_argument("--output", default=None, help="结果JSON文件路径")
+    args = parser.parse_args(argv)
+
+    if args.speed <= 0:
+        parser.error("--speed必须大于0")
+
+    turns = load_turns(args.database, args.since, args.until, args.limit)
+    if not turns:
+        print("没有可回放的用户消息")
+        return 1
+    anonymizer = Anonymizer(args.salt or random.SystemRandom().getrandbits(64).to_bytes(8, "big").hex())
+    workload = build_workload(turns, anonymizer, args.speed, args.max_gap, not args.no_sessions, args.model, args.max_tokens)
+    workload_stats = describe_workload(turns, workload)
+    print(f"回放流量: {json.dumps(workload_stats, ensure_ascii=False, default=str)}")
+
+    report: Dict[str, Any] = {"workload": workload_stats}
+    if not args.dry_run:
+        report.update(asyncio.run(replay(args.url, workload, args.endpoint, args.stream_ratio, args.max_in_flight, args.timeout, args.seed)))
+        print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"结果已写入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())